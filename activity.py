@@ -0,0 +1,267 @@
+# Contributor and changeset activity tables with integer users and timestamps
+# File = activity.py
+
+import argparse
+import calendar
+import itertools
+import sqlite3
+import time
+
+"""
+The element tables keep the OSM attributes as shaped: user names repeated on
+every row, version as text and timestamps as ISO strings, which every
+per-user or time-windowed query has to group or parse.  The loaders also fill
+(tables created with the rest of the schema in create_db.py):
+
+- users: uid -> user name, taken from the user's latest edit loaded (seen);
+  users stay once loaded, even if later updates replace all their elements,
+- edits: element type, id, uid, changeset, version and timestamp of every
+  element, all integers, timestamps in epoch seconds,
+- user_activity: per uid, its nodes, ways and relations and its first and last
+  edit,
+- changesets: per changeset, its uid, nodes, ways and relations, first and
+  last edit and the bounding box of its nodes,
+
+describing the element versions in the database.  Timestamps are parsed once,
+by SQLite's strftime('%s') as the rows are staged.  Each loaded chunk (or
+commit of osm_to_db.py) is staged in a temporary table, appended to edits and
+merged into the other tables with one grouped UPSERT each, so the cost grows
+with the rows loaded, not with the table sizes.  osc_update.py removes the
+edits of modified and deleted elements, and recompute() rebuilds the activity
+of their users and changesets from edits.  The edits, changesets and user_activity
+indexes (create_db.INDEXES) serve time ranges and per-user lookups as integer
+range scans.
+
+refresh() rebuilds all of it from the element tables, e.g. for a database
+built before these tables existed.
+"""
+
+# Element table -> element_type in edits
+ELEMENT_TABLES = {'nodes': 'node', 'ways': 'way', 'relations': 'relation'}
+
+STAGED_FIELDS = ['element_type', 'id', 'uid', 'user', 'changeset', 'version', 'timestamp', 'lat', 'lon']
+
+# SQLite's date functions read 'YYYY-MM-DDTHH:MM:SSZ' directly
+EPOCH_SQL = "CAST(strftime('%s', {0}) AS INTEGER)"
+
+STAGE_SQL = '''
+INSERT INTO temp.staged_edits (element_type, id, uid, user, changeset, version, timestamp, lat, lon)
+VALUES (?, ?, ?, ?, ?, CAST(? AS INTEGER), {0}, ?, ?)
+'''.format(EPOCH_SQL.format('?'))
+
+# Column prefix {0} is '' or 'edits.' in a join
+COUNTS_SQL = '''SUM({0}element_type = 'node'), SUM({0}element_type = 'way'), SUM({0}element_type = 'relation'),
+MIN({0}timestamp), MAX({0}timestamp)'''
+
+MERGE_COUNTS = '''nodes = nodes + excluded.nodes, ways = ways + excluded.ways,
+relations = relations + excluded.relations,
+first_edit = MIN(COALESCE(first_edit, excluded.first_edit), COALESCE(excluded.first_edit, first_edit)),
+last_edit = MAX(COALESCE(last_edit, excluded.last_edit), COALESCE(excluded.last_edit, last_edit))'''
+
+# SQLite needs 3.24 for UPSERT
+MERGE_SQL = [
+    '''INSERT INTO edits (element_type, id, uid, changeset, version, timestamp)
+SELECT element_type, id, uid, changeset, version, timestamp FROM temp.staged_edits''',
+    # The user column of MAX()'s row is the name at the user's latest edit
+    '''INSERT INTO users (uid, user, seen)
+SELECT uid, user, MAX(timestamp) FROM temp.staged_edits WHERE uid IS NOT NULL GROUP BY uid
+ON CONFLICT (uid) DO UPDATE SET
+user = CASE WHEN excluded.seen >= COALESCE(seen, excluded.seen) THEN excluded.user ELSE user END,
+seen = MAX(COALESCE(seen, excluded.seen), COALESCE(excluded.seen, seen))''',
+    '''INSERT INTO user_activity (uid, nodes, ways, relations, first_edit, last_edit)
+SELECT uid, {0} FROM temp.staged_edits WHERE uid IS NOT NULL GROUP BY uid
+ON CONFLICT (uid) DO UPDATE SET {1}'''.format(COUNTS_SQL.format(''), MERGE_COUNTS),
+    '''INSERT INTO changesets (id, uid, nodes, ways, relations, first_edit, last_edit,
+                        min_lat, min_lon, max_lat, max_lon)
+SELECT changeset, uid, {0}, MIN(lat), MIN(lon), MAX(lat), MAX(lon)
+FROM temp.staged_edits WHERE changeset IS NOT NULL GROUP BY changeset
+ON CONFLICT (id) DO UPDATE SET {1},
+uid = COALESCE(uid, excluded.uid),
+min_lat = MIN(COALESCE(min_lat, excluded.min_lat), COALESCE(excluded.min_lat, min_lat)),
+min_lon = MIN(COALESCE(min_lon, excluded.min_lon), COALESCE(excluded.min_lon, min_lon)),
+max_lat = MAX(COALESCE(max_lat, excluded.max_lat), COALESCE(excluded.max_lat, max_lat)),
+max_lon = MAX(COALESCE(max_lon, excluded.max_lon), COALESCE(excluded.max_lon, max_lon))'''.format(
+        COUNTS_SQL.format(''), MERGE_COUNTS),
+    'DELETE FROM temp.staged_edits']
+
+# Activity of some users and changesets ({0}: their ids) recomputed from edits
+RECOMPUTE_SQL = {
+    'user_activity': '''INSERT INTO user_activity (uid, nodes, ways, relations, first_edit, last_edit)
+SELECT uid, {0} FROM edits WHERE uid IN ({{0}}) GROUP BY uid'''.format(COUNTS_SQL.format('')),
+    'changesets': '''INSERT INTO changesets (id, uid, nodes, ways, relations, first_edit, last_edit,
+                        min_lat, min_lon, max_lat, max_lon)
+SELECT edits.changeset, edits.uid, {0}, MIN(lat), MIN(lon), MAX(lat), MAX(lon)
+FROM edits LEFT JOIN nodes ON edits.element_type = 'node' AND nodes.id = edits.id
+WHERE edits.changeset IN ({{0}}) GROUP BY edits.changeset'''.format(COUNTS_SQL.format('edits.'))}
+
+# SQLite's default limit on the number of ? parameters is 999
+MAX_PARAMS = 900
+
+
+def parse_time(value):
+    """Epoch seconds of a 'YYYY-MM-DD' or 'YYYY-MM-DDTHH:MM:SS' (UTC) string."""
+    pattern = '%Y-%m-%dT%H:%M:%S' if 'T' in value else '%Y-%m-%d'
+    return calendar.timegm(time.strptime(value.rstrip('Z'), pattern))
+
+
+def create_staging(conn):
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS staged_edits ({0})'.format(', '.join(STAGED_FIELDS)))
+
+
+def stage_rows(conn, table, fields, rows):
+    """Stage rows of an element table (tuples in fields order); other tables are ignored.
+    Args:
+        conn (obj): sqlite3 connection.
+        table (str): element table, e.g. 'nodes'.
+        fields (list): column names of the row tuples.
+        rows (list): row tuples, values as in the element tables.
+    """
+    element_type = ELEMENT_TABLES.get(table)
+    if element_type is None or not rows:
+        return
+    create_staging(conn)
+    positions = [fields.index(field) if field in fields else None for field in STAGED_FIELDS[1:]]
+    columns = [itertools.repeat(None) if i is None else [row[i] for row in rows] for i in positions]
+    conn.executemany(STAGE_SQL, zip(itertools.repeat(element_type, len(rows)), *columns))
+
+
+def stage_frame(conn, table, frame):
+    """Stage a pandas DataFrame of element table rows.  NaN floats are stored as NULL."""
+    if table not in ELEMENT_TABLES or not len(frame):
+        return
+    create_staging(conn)
+    # Whole columns as Python lists, much faster than row by row
+    columns = [frame[field].tolist() if field in frame else itertools.repeat(None)
+               for field in STAGED_FIELDS[1:]]
+    conn.executemany(STAGE_SQL, zip(itertools.repeat(ELEMENT_TABLES[table], len(frame)), *columns))
+
+
+def merge(conn):
+    """Append the staged rows to edits and merge them into users, user_activity
+    and changesets, within the caller's transaction.
+    """
+    create_staging(conn)
+    for sql in MERGE_SQL:
+        conn.execute(sql)
+
+
+def in_chunks(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), MAX_PARAMS):
+        yield ids[i:i + MAX_PARAMS]
+
+
+def forget(conn, element_type, element_id):
+    """Remove an element's edit before it is replaced or deleted.
+    Returns:
+        (uid, changeset) of the removed edit, whose activity is then stale, or None.
+    """
+    row = conn.execute('SELECT uid, changeset FROM edits WHERE element_type = ? AND id = ?',
+                       (element_type, element_id)).fetchone()
+    if row is not None:
+        conn.execute('DELETE FROM edits WHERE element_type = ? AND id = ?', (element_type, element_id))
+    return row
+
+
+def recompute(conn, uids=(), changesets=()):
+    """Rebuild the user_activity rows of some uids and the changesets rows of
+    some changesets from edits, within the caller's transaction.
+    """
+    for table, column, ids in (('user_activity', 'uid', uids), ('changesets', 'id', changesets)):
+        for chunk in in_chunks(set(ids) - set([None])):
+            params = ', '.join('?' * len(chunk))
+            conn.execute('DELETE FROM {0} WHERE {1} IN ({2})'.format(table, column, params), chunk)
+            conn.execute(RECOMPUTE_SQL[table].format(params), chunk)
+
+
+def has_activity(conn):
+    """True if the database has the activity tables."""
+    tables = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+    return all(table in tables for table in ('users', 'edits', 'user_activity', 'changesets'))
+
+
+def refresh(conn):
+    """Rebuild users, edits, user_activity and changesets from the element tables and commit."""
+    for table in ('users', 'edits', 'user_activity', 'changesets'):
+        conn.execute('DELETE FROM {0}'.format(table))
+    create_staging(conn)
+    for table, element_type in sorted(ELEMENT_TABLES.items()):
+        lat, lon = ('lat', 'lon') if table == 'nodes' else ('NULL', 'NULL')
+        conn.execute('INSERT INTO temp.staged_edits ({0}) SELECT ?, id, uid, user, changeset, '
+                     'CAST(version AS INTEGER), {1}, {2}, {3} FROM {4}'.format(
+                         ', '.join(STAGED_FIELDS), EPOCH_SQL.format('timestamp'), lat, lon, table),
+                     (element_type,))
+    merge(conn)
+    conn.commit()
+
+
+# ================================================== #
+#               Queries                              #
+# ================================================== #
+def top_contributors(conn, limit=10, start=None, end=None):
+    """[(uid, user, nodes, ways)] of the users with the most nodes and ways,
+    optionally only counting edits with start <= timestamp < end (epoch seconds).
+    """
+    if start is None and end is None:
+        return conn.execute('SELECT uid, user, nodes, ways FROM user_activity JOIN users USING (uid) '
+                            'ORDER BY nodes + ways DESC LIMIT ?', (limit,)).fetchall()
+    return conn.execute('SELECT uid, user, SUM(element_type = \'node\') AS nodes, SUM(element_type = \'way\') AS ways '
+                        'FROM edits LEFT JOIN users USING (uid) '
+                        'WHERE timestamp >= ? AND timestamp < ? AND element_type IN (\'node\', \'way\') '
+                        'GROUP BY uid ORDER BY nodes + ways DESC LIMIT ?',
+                        (start or 0, end if end is not None else 2 ** 62, limit)).fetchall()
+
+
+def edits_per_period(conn, period=86400 * 365, uid=None):
+    """[(period start, edits)] of all users, or of one uid, in epoch seconds."""
+    where, params = ('WHERE uid = ? ', (period, period, uid)) if uid is not None else ('', (period, period))
+    return conn.execute('SELECT timestamp / ? * ? AS start, COUNT(*) FROM edits {0}'
+                        'GROUP BY start ORDER BY start'.format(where), params).fetchall()
+
+
+def largest_changesets(conn, limit=10, start=None, end=None):
+    """[(changeset, user, elements, first edit, last edit, min_lat, min_lon, max_lat, max_lon)]
+    of the changesets with the most elements, optionally first edited in [start, end).
+    """
+    return conn.execute('SELECT id, user, nodes + ways + relations AS elements, changesets.first_edit, '
+                        'changesets.last_edit, min_lat, min_lon, max_lat, max_lon '
+                        'FROM changesets LEFT JOIN users USING (uid) '
+                        'WHERE changesets.first_edit >= ? AND changesets.first_edit < ? '
+                        'ORDER BY elements DESC LIMIT ?',
+                        (start or 0, end if end is not None else 2 ** 62, limit)).fetchall()
+
+
+if __name__ == '__main__':
+    # Imported here: create_db imports this module
+    import create_db
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description='Contributor and changeset activity from the database.')
+    parser.add_argument('--db', default=create_db.DB_FILE, help='SQLite database file')
+    parser.add_argument('--refresh', action='store_true',
+                        help='rebuild the users, edits and activity tables from the element tables')
+    parser.add_argument('--since', help='only count edits from this date (YYYY-MM-DD, UTC)')
+    parser.add_argument('--until', help='only count edits before this date (YYYY-MM-DD, UTC)')
+    parser.add_argument('--limit', type=int, default=10, help='rows of each list')
+    args = parser.parse_args()
+
+    if args.refresh:
+        # Creates the tables of a database built before they existed
+        create_db.metadata.create_all(create_engine('sqlite:///' + args.db))
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.refresh:
+            began = time.time()
+            refresh(conn)
+            create_db.create_indexes(conn)
+            print('Activity tables rebuilt in {0:.1f}s'.format(time.time() - began))
+        start = parse_time(args.since) if args.since else None
+        end = parse_time(args.until) if args.until else None
+        print('Top contributors (uid, user, nodes, ways):')
+        for row in top_contributors(conn, args.limit, start, end):
+            print('  {0}'.format(row))
+        print('Largest changesets (id, user, elements, first, last, bbox):')
+        for row in largest_changesets(conn, args.limit, start, end):
+            print('  {0}'.format(row))
+    finally:
+        conn.close()
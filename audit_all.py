@@ -0,0 +1,19 @@
+import pprint
+
+import audit_engine
+# Importing the audit scripts registers their plugins
+import tags
+import tags_types
+import street_name_audit
+import postalcode_audit
+import tag_rules_audit
+
+# Run every registered audit over the map file in a single pass.
+
+OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
+
+if __name__ == '__main__':
+    results = audit_engine.run_audits(OSM_FILE, [plugin() for plugin in audit_engine.PLUGINS])
+    for plugin in audit_engine.PLUGINS:
+        print(plugin.name)
+        pprint.pprint(results[plugin.name])
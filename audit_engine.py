@@ -0,0 +1,74 @@
+import xml.etree.cElementTree as ET
+
+import osm_io
+import pbf_reader
+
+"""
+Single pass audit engine.  Each audit registers a plugin class; every plugin is
+fed every element of the OSM file from one streaming iterparse pass.  Top level
+elements are cleared from the root as soon as they end, so memory stays flat
+however large the file is.
+
+A plugin has a 'name', a process(elem) method called on the end event of every
+element (children end before their parent, so a node or way is complete when
+it is passed in) and a result() method returning its findings.
+"""
+
+PLUGINS = []
+"""Registered audit plugin classes, in registration order."""
+
+
+def register(plugin_class):
+    """Class decorator adding an audit plugin to PLUGINS."""
+    PLUGINS.append(plugin_class)
+    return plugin_class
+
+
+def run_audits(osm_file, plugins):
+    """Run several audits over the OSM file in a single pass.
+    Args:
+        osm_file (obj): OSM (XML) file to audit, plain or .gz/.bz2 compressed, or
+            an OSM PBF file.
+        plugins (list): audit plugin instances.
+    Returns:
+        results (dict): result() of each plugin, keyed by plugin name.
+    """
+    if osm_io.is_pbf(osm_file):
+        return run_audits_pbf(osm_file, plugins)
+    source = osm_io.open_osm(osm_file)
+    try:
+        context = ET.iterparse(source, events=('start', 'end'))
+        _, root = next(context)
+        depth = 0
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            for plugin in plugins:
+                plugin.process(elem)
+            # A top level element has ended, drop it from the tree
+            if depth == 0:
+                root.clear()
+    finally:
+        if source is not osm_file:
+            source.close()
+    return dict((plugin.name, plugin.result()) for plugin in plugins)
+
+
+def run_audits_pbf(osm_file, plugins):
+    """run_audits() for an OSM PBF file.
+    Plugins see the same sequence of end events as for the XML: each element's
+    children, then the element, and the <osm> root last.
+    """
+    elements = pbf_reader.iter_elements(osm_file, tags=('bounds', 'node', 'way', 'relation'))
+    for elem in elements:
+        for child in elem:
+            for plugin in plugins:
+                plugin.process(child)
+        for plugin in plugins:
+            plugin.process(elem)
+    root = ET.Element('osm')
+    for plugin in plugins:
+        plugin.process(root)
+    return dict((plugin.name, plugin.result()) for plugin in plugins)
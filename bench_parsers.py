@@ -0,0 +1,122 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import ing_import
+import parsers
+import synthetic_osm
+from instrument import traced_peak_mb
+
+"""
+Compare the XML parser backends of parsers.py.  Each backend is timed parsing
+only (iterating the elements and reading their attributes) and parsing plus
+shaping and writing the CSV files, on the sample file and on a larger synthetic
+file made by synthetic_osm.py.  Every run is done in a freshly spawned process,
+first timed, then traced with tracemalloc for the peak of the Python memory it
+allocates (tracing slows it down, so it is not timed).  libxml2 allocates the
+lxml trees with its own malloc, outside tracemalloc, so lxml's peak counts only
+its Python objects.
+"""
+
+SAMPLE_FILE = "ing_small_sample.osm"
+
+
+def parse_only(osm_file, parser):
+    """Iterate the elements and touch their attributes, as shaping does."""
+    count = 0
+    for element in ing_import.get_element(osm_file, tags=ing_import.ELEMENT_TAGS, parser=parser):
+        for child in element:
+            child.attrib.get('k')
+        element.attrib.get('user')
+        count += 1
+    return count
+
+
+def run_stage(osm_file, parser, stage, out_dir):
+    """Run one backend through one stage; returns the elements processed."""
+    if stage == 'parse':
+        return parse_only(osm_file, parser)
+    paths = [os.path.join(out_dir, os.path.basename(path)) for _, path, _ in ing_import.TABLES]
+    return ing_import.write_elements(
+        ing_import.get_element(osm_file, tags=ing_import.ELEMENT_TAGS, parser=parser), paths, fast=True)
+
+
+def run_backend(osm_file, parser, stage, results):
+    """Time and trace one backend through one stage (child process)."""
+    out_dir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        count = run_stage(osm_file, parser, stage, out_dir)
+        seconds = time.time() - start
+        _, peak = traced_peak_mb(run_stage, osm_file, parser, stage, out_dir)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    results.put({'parser': parser, 'stage': stage, 'elements': count, 'seconds': seconds,
+                 'elements_per_s': count / seconds if seconds else 0, 'traced_peak_mb': peak})
+
+
+def available_parsers():
+    """The backends whose dependencies are installed."""
+    available = []
+    for parser in parsers.PARSERS:
+        if parser == 'lxml':
+            try:
+                import lxml.etree  # noqa: F401
+            except ImportError:
+                continue
+        available.append(parser)
+    return available
+
+
+def benchmark_file(osm_file, repeat=3):
+    """Run every backend and stage repeat times on osm_file and print the best elements/s of each."""
+    # spawn, not fork: each run starts without the parent's memory and caches
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    best = {}
+    for _ in range(repeat):
+        for stage in ('parse', 'shape'):
+            for parser in available_parsers():
+                process = context.Process(target=run_backend, args=(osm_file, parser, stage, results))
+                process.start()
+                result = results.get()
+                process.join()
+                key = (parser, stage)
+                if key not in best or result['elements_per_s'] > best[key]['elements_per_s']:
+                    best[key] = result
+    print('{0} ({1:.1f} MB)'.format(osm_file, os.path.getsize(osm_file) / (1024.0 * 1024.0)))
+    for (parser, stage), result in sorted(best.items(), key=lambda item: (item[0][1], item[0][0])):
+        print('  {0:<7}{1:<7}{2:>10.0f} elements/s   traced peak {3:.2f} MB'.format(
+            stage, parser, result['elements_per_s'], result['traced_peak_mb']))
+    return best
+
+
+def benchmark(osm_file=SAMPLE_FILE, target_mb=30, repeat=3, seed=0):
+    """Benchmark the backends on osm_file and on a synthetic file of about target_mb MB.
+    Returns:
+        stats (dict): file -> {(parser, stage): best result}
+    """
+    stats = {osm_file: benchmark_file(osm_file, repeat)}
+    if target_mb:
+        work_dir = tempfile.mkdtemp()
+        try:
+            synthetic = os.path.join(work_dir, 'synthetic.osm')
+            synthetic_osm.generate(synthetic, seed, target_mb)
+            stats[synthetic] = benchmark_file(synthetic, repeat)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the XML parser backends.')
+    parser.add_argument('osm_file', nargs='?', default=SAMPLE_FILE, help='OSM (XML) file to parse')
+    parser.add_argument('--target-mb', type=float, default=30,
+                        help='approximate size of the larger synthetic file (0 skips it)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic file')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each backend')
+    args = parser.parse_args()
+    benchmark(args.osm_file, args.target_mb, args.repeat, args.seed)
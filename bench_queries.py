@@ -0,0 +1,79 @@
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import create_db
+from queries import NOTEBOOK_QUERIES, UNIFIED_QUERIES
+
+"""
+Time the notebook queries, and their unified tags table versions, before and
+after building the create_db indexes.  The database is copied first so the
+original is left untouched.
+"""
+
+QUERIES = NOTEBOOK_QUERIES + UNIFIED_QUERIES
+
+
+def time_query(conn, query, repeat):
+    """Best wall clock time of running the query repeat times, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        conn.execute(query).fetchall()
+        taken = (time.time() - start) * 1000
+        if best is None or taken < best:
+            best = taken
+    return best
+
+
+def time_queries(conn, queries=QUERIES, repeat=5):
+    """Time each query.
+    Returns:
+        timings (dict): best time of each query, in milliseconds.
+    """
+    return dict((name, time_query(conn, query, repeat)) for name, query in queries)
+
+
+def benchmark(db_file=create_db.DB_FILE, repeat=5):
+    """Time the notebook queries without and with the create_db indexes.
+    Args:
+        db_file (str): SQLite database to benchmark.
+        repeat (int): runs of each query; the best one is reported.
+    Returns:
+        (before, after) timings in milliseconds.
+    """
+    work_dir = tempfile.mkdtemp()
+    copy = os.path.join(work_dir, os.path.basename(db_file))
+    shutil.copy(db_file, copy)
+    conn = sqlite3.connect(copy)
+    try:
+        for name, _, _ in create_db.INDEXES:
+            conn.execute('DROP INDEX IF EXISTS {0}'.format(name))
+        conn.execute('ANALYZE')
+        conn.commit()
+        before = time_queries(conn, repeat=repeat)
+
+        create_db.create_indexes(conn)
+        conn.execute('ANALYZE')
+        conn.commit()
+        after = time_queries(conn, repeat=repeat)
+    finally:
+        conn.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print('{0:<22}{1:>12}{2:>12}{3:>10}'.format('query', 'before ms', 'after ms', 'speedup'))
+    for name, _ in QUERIES:
+        print('{0:<22}{1:>12.2f}{2:>12.2f}{3:>9.1f}x'.format(
+            name, before[name], after[name], before[name] / after[name] if after[name] else 0))
+    return before, after
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the notebook queries before and after indexing.')
+    parser.add_argument('--db', default=create_db.DB_FILE, help='SQLite database file')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each query')
+    args = parser.parse_args()
+    benchmark(args.db, args.repeat)
@@ -0,0 +1,94 @@
+import argparse
+import gc
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import ing_import
+from instrument import traced_peak_mb
+
+"""
+Microbenchmark of the two shaping paths of ing_import: shape_element() with
+DictWriter, and shape_element_rows() with a positional writer.  Each path runs
+in a freshly spawned process, first timed, then traced with tracemalloc, which
+slows it down but counts only its own Python allocations:
+
+- traced peak: the peak memory of shaping and writing the whole file,
+- held: the memory of HELD_ELEMENTS shaped elements kept alive, per element,
+  i.e. what each representation costs wherever rows are buffered.
+"""
+
+SAMPLE_FILE = "ing_small_sample.osm"
+
+HELD_ELEMENTS = 10000
+"""Shaped elements kept alive to measure the memory of each representation."""
+
+
+def write_all(osm_file, paths, fast):
+    return ing_import.write_elements(ing_import.get_element(osm_file, tags=ing_import.ELEMENT_TAGS),
+                                     paths, fast=fast)
+
+
+def held_bytes(osm_file, fast, count=HELD_ELEMENTS):
+    """Traced bytes per shaped element, with count of them alive."""
+    shape = ing_import.shape_element_rows if fast else ing_import.shape_element
+    elements = ing_import.get_element(osm_file, tags=ing_import.ELEMENT_TAGS)
+    tracemalloc.start()
+    try:
+        shaped = [shape(element) for element in itertools.islice(elements, count)]
+        # Drops the parser, so only the shaped elements are left
+        elements.close()
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return held / float(len(shaped)) if shaped else 0
+
+
+def run_path(osm_file, fast, results):
+    """Shape and write every element with one path (child process)."""
+    out_dir = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(out_dir, os.path.basename(path)) for _, path, _ in ing_import.TABLES]
+        start = time.time()
+        count = write_all(osm_file, paths, fast)
+        seconds = time.time() - start
+        _, peak = traced_peak_mb(write_all, osm_file, paths, fast)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    results.put({'path': 'tuple' if fast else 'dict', 'elements': count, 'seconds': seconds,
+                 'elements_per_s': count / seconds if seconds else 0,
+                 'traced_peak_mb': peak, 'held_bytes_per_element': held_bytes(osm_file, fast)})
+
+
+def benchmark(osm_file=SAMPLE_FILE, repeat=3):
+    """Run both paths repeat times and print the best elements/s of each, with its memory."""
+    # spawn, not fork: each run starts without the parent's memory and caches
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    best = {}
+    for _ in range(repeat):
+        for fast in (False, True):
+            process = context.Process(target=run_path, args=(osm_file, fast, results))
+            process.start()
+            result = results.get()
+            process.join()
+            if result['path'] not in best or result['elements_per_s'] > best[result['path']]['elements_per_s']:
+                best[result['path']] = result
+    for path in ('dict', 'tuple'):
+        result = best[path]
+        print('{0:<6}{1:>10.0f} elements/s   traced peak {2:.2f} MB   held {3:.0f} B/element'.format(
+            path, result['elements_per_s'], result['traced_peak_mb'], result['held_bytes_per_element']))
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the dict and tuple shaping paths.')
+    parser.add_argument('osm_file', nargs='?', default=SAMPLE_FILE, help='OSM (XML) file to shape')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each path')
+    args = parser.parse_args()
+    benchmark(args.osm_file, args.repeat)
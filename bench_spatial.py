@@ -0,0 +1,98 @@
+import argparse
+import random
+import sqlite3
+import time
+
+import create_db
+import spatial
+
+"""
+Compare the latency of bounding box and radius lookups answered from the
+R-tree tables with the same lookups done as full table scans.  Query boxes are
+centred on randomly chosen nodes so that they fall where the data is.
+"""
+
+
+def query_points(conn, count, seed=0):
+    """Coordinates of count randomly chosen nodes."""
+    points = conn.execute('SELECT lat, lon FROM nodes WHERE lat IS NOT NULL').fetchall()
+    rng = random.Random(seed)
+    return [rng.choice(points) for _ in range(count)]
+
+
+def time_lookup(lookup, repeat):
+    """Best wall clock time of calling lookup() repeat times, in milliseconds, and its result."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = lookup()
+        taken = (time.time() - start) * 1000
+        if best is None or taken < best:
+            best = taken
+    return best, result
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def benchmark(db_file=create_db.DB_FILE, queries=50, size=0.01, radius=500, repeat=3, seed=0):
+    """Time R-tree and full scan lookups around random points.
+    Args:
+        db_file (str): SQLite database with the create_db R-trees.
+        queries (int): query points.
+        size (float): width and height of the query boxes, in degrees.
+        radius (float): radius of the radius lookups, in metres.
+        repeat (int): runs of each lookup; the best one is kept.
+        seed (int): seed of the query point choice.
+    Returns:
+        stats (dict): lookup -> (median R-tree ms, median scan ms, mismatches)
+    """
+    conn = sqlite3.connect(db_file)
+    points = query_points(conn, queries, seed)
+    half = size / 2.0
+    lookups = []
+    for element_type in ('node', 'way'):
+        lookups.append(('bbox ' + element_type, element_type,
+                        lambda lat, lon, t, rtree: spatial.bbox_query(
+                            conn, lat - half, lon - half, lat + half, lon + half,
+                            element_types=(t,), tags=False, use_rtree=rtree)))
+        lookups.append(('radius ' + element_type, element_type,
+                        lambda lat, lon, t, rtree: spatial.radius_query(
+                            conn, lat, lon, radius, element_types=(t,), tags=False, use_rtree=rtree)))
+
+    stats = {}
+    print('{0:<14}{1:>10}{2:>12}{3:>12}{4:>12}{5:>10}{6:>12}'.format(
+        'lookup', 'results', 'rtree ms', 'rtree p95', 'scan ms', 'speedup', 'mismatches'))
+    try:
+        for name, element_type, lookup in lookups:
+            rtree_ms, scan_ms, found = [], [], []
+            mismatches = 0
+            for lat, lon in points:
+                taken, rtree = time_lookup(lambda: lookup(lat, lon, element_type, True), repeat)
+                rtree_ms.append(taken)
+                taken, scan = time_lookup(lambda: lookup(lat, lon, element_type, False), repeat)
+                scan_ms.append(taken)
+                found.append(len(rtree))
+                if set(r['id'] for r in rtree) != set(r['id'] for r in scan):
+                    mismatches += 1
+            rtree_median, scan_median = percentile(rtree_ms, 0.5), percentile(scan_ms, 0.5)
+            stats[name] = (rtree_median, scan_median, mismatches)
+            print('{0:<14}{1:>10.0f}{2:>12.2f}{3:>12.2f}{4:>12.2f}{5:>9.1f}x{6:>12}'.format(
+                name, sum(found) / float(len(found)), rtree_median, percentile(rtree_ms, 0.95),
+                scan_median, scan_median / rtree_median if rtree_median else 0, mismatches))
+    finally:
+        conn.close()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark R-tree lookups against full table scans.')
+    parser.add_argument('--db', default=create_db.DB_FILE, help='SQLite database file')
+    parser.add_argument('--queries', type=int, default=50, help='query points')
+    parser.add_argument('--size', type=float, default=0.01, help='query box size in degrees')
+    parser.add_argument('--radius', type=float, default=500, help='query radius in metres')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each lookup')
+    args = parser.parse_args()
+    benchmark(args.db, args.queries, args.size, args.radius, args.repeat)
@@ -0,0 +1,250 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import unicodecsv
+from sqlalchemy import create_engine
+
+import create_db
+import ing_import
+import parsers
+import schema_validator
+import synthetic_osm
+from instrument import peak_rss_mb
+
+"""
+Benchmark suite of the import pipeline, stage by stage:
+
+- parse: get_element() streaming the elements out of the file,
+- shape: shape_element() (or shape_element_rows() with --fast),
+- validate: validate_element() against the schema,
+- write: writing the csv rows,
+- load: create_db.csv_to_db() of every csv file with the bulk settings,
+- index: the indexes, R-trees and ANALYZE after the load.
+
+The first four are timed in one pass over the file, each stage's time
+accumulated around its own calls; load and index run afterwards in another
+process.  Each process reports its peak RSS.  The input is an OSM file, or a
+synthetic one of --target-mb MB made by synthetic_osm.py, so runs at 1-10 GB
+need no download.  The results (elements/s, MB/s of input, rows/s, peak RSS)
+are written to a JSON file; --compare prints the speed of each stage against
+an earlier results file, e.g. of another version.
+"""
+
+RESULTS_FILE = 'benchmark.json'
+
+IMPORT_STAGES = ('parse', 'shape', 'validate', 'write')
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def git_commit():
+    """Commit of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_import(osm_file, out_dir, validate, fast, parser, results):
+    """Parse, shape, validate and write osm_file to csv files in out_dir, timing each stage (child process)."""
+    timers = dict((stage, 0.0) for stage in IMPORT_STAGES)
+    files = [open(os.path.join(out_dir, os.path.basename(path)), 'wb') for _, path, _ in ing_import.TABLES]
+    writers = {}
+    for (key, _, fields), f in zip(ing_import.TABLES, files):
+        if fast:
+            writers[key] = unicodecsv.writer(f)
+            writers[key].writerow(fields)
+        else:
+            writers[key] = unicodecsv.DictWriter(f, fields)
+            writers[key].writeheader()
+    shape = ing_import.shape_element_rows if fast else ing_import.shape_element
+    validator = schema_validator.Validator()
+    elements = ing_import.get_element(osm_file, tags=ing_import.ELEMENT_TAGS, parser=parser)
+    count = 0
+    try:
+        while True:
+            began = clock()
+            element = next(elements, None)
+            parsed = clock()
+            timers['parse'] += parsed - began
+            if element is None:
+                break
+            el = shape(element)
+            shaped = clock()
+            timers['shape'] += shaped - parsed
+            if not el:
+                continue
+            if validate:
+                ing_import.validate_element(ing_import.rows_to_dicts(el) if fast else el, validator)
+                validated = clock()
+                timers['validate'] += validated - shaped
+                shaped = validated
+            for key, rows in el.items():
+                if key in ing_import.ELEMENT_KEYS:
+                    writers[key].writerow(rows)
+                else:
+                    writers[key].writerows(rows)
+            timers['write'] += clock() - shaped
+            count += 1
+    finally:
+        for f in files:
+            f.close()
+    results.put({'elements': count, 'timers': timers, 'peak_rss_mb': peak_rss_mb()})
+
+
+def run_load(out_dir, results):
+    """Load the csv files of out_dir into a new database with create_db.bulk_load() (child process)."""
+    db_file = os.path.join(out_dir, 'benchmark.db')
+    engine = create_engine('sqlite:///' + db_file)
+    create_db.metadata.create_all(engine)
+    engine.dispose()
+    csv_tables = [(os.path.join(out_dir, csvfile), table) for csvfile, table in create_db.CSV_TABLES
+                  if os.path.exists(os.path.join(out_dir, csvfile))]
+    began = clock()
+    stats = create_db.bulk_load(csv_tables, db_file)
+    total = clock() - began
+    load = sum(seconds for _, seconds in stats.values())
+    results.put({'rows': sum(rows for rows, _ in stats.values()), 'load': load, 'index': total - load,
+                 'csv_bytes': sum(os.path.getsize(path) for path, _ in csv_tables),
+                 'db_bytes': os.path.getsize(db_file), 'peak_rss_mb': peak_rss_mb()})
+
+
+def in_process(target, *args):
+    """Run target(*args, results) in a new process and return what it put in results."""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (results,))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def rate(amount, seconds):
+    return amount / seconds if seconds else 0.0
+
+
+def benchmark(osm_file, validate=True, fast=False, parser='etree', load=True, work_dir=None):
+    """Time every stage of the pipeline on osm_file.
+    Args:
+        osm_file (str): OSM (XML) file.
+        validate (bool): if True, will time the validate stage.
+        fast (bool): if True, will shape with shape_element_rows().
+        parser (str): XML parser backend, see parsers.PARSERS.
+        load (bool): if True, will also time loading the csv files into SQLite.
+        work_dir (str): directory for the csv files and database; a temporary one if None.
+    Returns:
+        report (dict): see RESULTS_FILE.
+    """
+    if work_dir is not None and not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    out_dir = tempfile.mkdtemp(prefix='osm_benchmark_', dir=work_dir)
+    size = os.path.getsize(osm_file)
+    megabytes = size / (1024.0 * 1024.0)
+    try:
+        imported = in_process(run_import, osm_file, out_dir, validate, fast, parser)
+        loaded = in_process(run_load, out_dir) if load else None
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    elements = imported['elements']
+    stages = {}
+    for stage in IMPORT_STAGES:
+        if stage == 'validate' and not validate:
+            continue
+        seconds = imported['timers'][stage]
+        stages[stage] = {'seconds': seconds, 'elements_per_s': rate(elements, seconds),
+                         'mb_per_s': rate(megabytes, seconds)}
+    import_seconds = sum(stage['seconds'] for stage in stages.values())
+    stages['import'] = {'seconds': import_seconds, 'elements_per_s': rate(elements, import_seconds),
+                        'mb_per_s': rate(megabytes, import_seconds)}
+    peak_rss = {'import': imported['peak_rss_mb']}
+    if loaded is not None:
+        csv_megabytes = loaded['csv_bytes'] / (1024.0 * 1024.0)
+        for stage in ('load', 'index'):
+            stages[stage] = {'seconds': loaded[stage], 'rows_per_s': rate(loaded['rows'], loaded[stage]),
+                             'mb_per_s': rate(csv_megabytes, loaded[stage])}
+        peak_rss['load'] = loaded['peak_rss_mb']
+
+    return {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': multiprocessing.cpu_count(), 'file': os.path.abspath(osm_file), 'bytes': size,
+            'options': {'validate': validate, 'fast': fast, 'parser': parser},
+            'elements': elements, 'rows': loaded['rows'] if loaded else None,
+            'db_bytes': loaded['db_bytes'] if loaded else None,
+            'stages': stages, 'peak_rss_mb': peak_rss}
+
+
+def print_report(report, baseline=None):
+    """Print the stage timings, and their speed-up over a baseline report."""
+    name = report['file']
+    if name is None:
+        name = 'synthetic file (seed {0})'.format(report['synthetic']['seed'])
+    print('{0}: {1:.1f} MB, {2} elements'.format(name, report['bytes'] / (1024.0 * 1024.0), report['elements']))
+    header = '{0:<10}{1:>10}{2:>14}{3:>10}'.format('stage', 'seconds', 'elements/s', 'MB/s')
+    print(header + ('{0:>10}'.format('vs base') if baseline else ''))
+    for stage in IMPORT_STAGES + ('import', 'load', 'index'):
+        if stage not in report['stages']:
+            continue
+        result = report['stages'][stage]
+        speed = result.get('elements_per_s', result.get('rows_per_s'))
+        line = '{0:<10}{1:>10.2f}{2:>14.0f}{3:>10.2f}'.format(stage, result['seconds'], speed, result['mb_per_s'])
+        if baseline and stage in baseline['stages'] and result['mb_per_s']:
+            line += '{0:>9.2f}x'.format(result['mb_per_s'] / baseline['stages'][stage]['mb_per_s']
+                                        if baseline['stages'][stage]['mb_per_s'] else 0)
+        print(line)
+    print('peak RSS: ' + ', '.join('{0} {1}'.format(name, 'n/a' if rss is None else '{0:.1f} MB'.format(rss))
+                                   for name, rss in sorted(report['peak_rss_mb'].items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the import pipeline.')
+    parser.add_argument('osm_file', nargs='?', help='OSM (XML) file; a synthetic file is generated if omitted')
+    parser.add_argument('--target-mb', type=float, default=100,
+                        help='size of the synthetic file in MB')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic file')
+    parser.add_argument('--keep', help='keep the synthetic file at this path')
+    parser.add_argument('--no-validate', action='store_true', help='skip the validate stage')
+    parser.add_argument('--no-load', action='store_true', help='skip the load and index stages')
+    parser.add_argument('--fast', action='store_true', help='shape elements to tuples instead of dicts')
+    parser.add_argument('--parser', choices=parsers.PARSERS, default='etree', help='XML parser backend')
+    parser.add_argument('--work-dir', help='directory for the csv files and database')
+    parser.add_argument('--output', default=RESULTS_FILE, help='JSON results file')
+    parser.add_argument('--compare', help='earlier JSON results file to compare against')
+    args = parser.parse_args()
+
+    if args.work_dir and not os.path.isdir(args.work_dir):
+        os.makedirs(args.work_dir)
+    osm_file = args.osm_file
+    synthetic_dir = None
+    if osm_file is None:
+        synthetic_dir = tempfile.mkdtemp(prefix='osm_synthetic_', dir=args.work_dir)
+        osm_file = args.keep or os.path.join(synthetic_dir, 'synthetic.osm')
+        counts = synthetic_osm.generate(osm_file, args.seed, args.target_mb)
+        print('generated {0}: {1} nodes, {2} ways, {3} relations'.format(
+            osm_file, counts['node'], counts['way'], counts['relation']))
+    try:
+        report = benchmark(osm_file, validate=not args.no_validate, fast=args.fast, parser=args.parser,
+                           load=not args.no_load, work_dir=args.work_dir)
+    finally:
+        if synthetic_dir is not None:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
+    if synthetic_dir is not None:
+        report['synthetic'] = {'seed': args.seed, 'target_mb': args.target_mb, 'params': synthetic_osm.DEFAULTS}
+        if not args.keep:
+            # The file is gone; the seed, size and parameters above regenerate it
+            report['file'] = None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('results written to {0}'.format(args.output))
@@ -0,0 +1,194 @@
+import argparse
+import collections
+import sqlite3
+import time
+
+import pandas as pd
+
+import summary
+import tag_rules
+
+"""
+The tag cleaning stage: street name and postcode rules applied to tag values.
+
+A Cleaner holds the rules, each keyed by the full tag key ("addr:street").
+By default they are the rules of tag_rules.json; more can be registered or
+replaced, so other clean-ups plug into the same stage.  Cleaned values are
+memoized in a bounded LRU memo keyed on the raw value: the same few thousand
+streets and postcodes repeat across the whole map, so most values are looked
+up instead of recleaned.  stats() reports the hit
+rate and an estimate of the time saved (hits times the average cost of a miss).
+
+For data already in CSV files or the database, clean_frame() cleans whole
+columns at once with pandas string operations.  The vectorized rules give the
+same values as the scalar ones.
+"""
+
+MEMO_SIZE = 65536
+"""Raw values remembered by a Cleaner."""
+
+# Full tag key -> (rule, vectorized rule), from tag_rules.json
+DEFAULT_RULES = dict((key, (rule.normalize, rule.vectorized))
+                     for key, rule in tag_rules.RULES.items() if rule.normalize is not None)
+
+
+class Cleaner(object):
+    """Tag value cleaning rules with a bounded LRU memo of their results.
+    Args:
+        rules (dict): full tag key -> (rule, vectorized rule); DEFAULT_RULES if None.
+        memo_size (int): raw values remembered; 0 disables the memo.
+    """
+
+    def __init__(self, rules=None, memo_size=MEMO_SIZE):
+        self.rules = {}
+        self.vectorized = {}
+        for key, (rule, vectorized) in (DEFAULT_RULES if rules is None else rules).items():
+            self.register(key, rule, vectorized)
+        self.memo_size = memo_size
+        self.memo = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.miss_seconds = 0.0
+
+    def register(self, key, rule, vectorized=None):
+        """Clean the values of tag key with rule(value), and with vectorized(Series)
+        in clean_frame(); without a vectorized rule the distinct values are cleaned
+        one by one.
+        """
+        self.rules[key] = rule
+        self.vectorized[key] = vectorized
+        self.clear()
+
+    def clear(self):
+        """Forget the memoized values, e.g. after changing a rule."""
+        self.memo = collections.OrderedDict()
+
+    def clean(self, key, value):
+        """Return the cleaned value of a tag, or the value itself if no rule applies."""
+        rule = self.rules.get(key)
+        if rule is None:
+            return value
+        memo = self.memo
+        memo_key = (key, value)
+        if memo_key in memo:
+            self.hits += 1
+            # Move to the most recently used end
+            cleaned = memo.pop(memo_key)
+            memo[memo_key] = cleaned
+            return cleaned
+        self.misses += 1
+        began = time.time()
+        cleaned = rule(value)
+        self.miss_seconds += time.time() - began
+        if self.memo_size > 0:
+            memo[memo_key] = cleaned
+            if len(memo) > self.memo_size:
+                memo.popitem(last=False)
+                self.evictions += 1
+        return cleaned
+
+    def stats(self):
+        """Memo counters.
+        Returns:
+            dict with hits, misses, hit_rate, evictions, size and time_saved (seconds,
+            estimated from the average cost of a miss).
+        """
+        lookups = self.hits + self.misses
+        miss_cost = self.miss_seconds / self.misses if self.misses else 0.0
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+                'evictions': self.evictions, 'size': len(self.memo),
+                'time_saved': self.hits * miss_cost}
+
+    def report(self):
+        stats = self.stats()
+        return ('cleaning: {0} values, {1:.1%} memo hits, {2} evictions, ~{3:.3f}s saved'.format(
+            stats['hits'] + stats['misses'], stats['hit_rate'], stats['evictions'], stats['time_saved']))
+
+    def clean_series(self, key, values):
+        """Clean a pandas Series of the values of tag key at once.  Only the
+        distinct values are cleaned, like the memo does for single values.
+        """
+        codes, uniques = pd.factorize(values)
+        uniques = pd.Series(uniques, dtype=object)
+        vectorized = self.vectorized.get(key)
+        if vectorized is not None:
+            cleaned = vectorized(uniques)
+        else:
+            cleaned = pd.Series([self.rules[key](value) for value in uniques], dtype=object)
+        cleaned = pd.Series(cleaned.values, dtype=object).take(codes).values
+        return pd.Series(cleaned, index=values.index, dtype=object).where(codes >= 0, None)
+
+    def clean_frame(self, frame, default_tag_type='regular'):
+        """Clean a tags DataFrame (key, value and type columns, as in the tags
+        csv files) in place.
+        Returns:
+            number of values changed.
+        """
+        changed = 0
+        for full_key in self.rules:
+            tag_type, _, key = full_key.partition(':') if ':' in full_key else (default_tag_type, '', full_key)
+            mask = (frame['type'] == tag_type) & (frame['key'] == key) & frame['value'].notna()
+            if not mask.any():
+                continue
+            values = frame.loc[mask, 'value'].astype(str)
+            cleaned = self.clean_series(full_key, values)
+            changed += int((cleaned != values).sum())
+            frame.loc[mask, 'value'] = cleaned
+        return changed
+
+
+TAG_TABLES = ['nodes_tags', 'ways_tags', 'relations_tags', 'tags']
+
+
+def clean_csv(csv_file, cleaner=None, out_file=None):
+    """Clean the values of a tags csv file, in place unless out_file is given."""
+    cleaner = cleaner or Cleaner()
+    frame = pd.read_csv(csv_file, dtype=str, keep_default_na=False, na_values=[''])
+    changed = cleaner.clean_frame(frame)
+    # Same line endings as the csv module writes in ing_import
+    with open(out_file or csv_file, 'w', newline='') as f:
+        frame.to_csv(f, index=False, lineterminator='\r\n')
+    return changed
+
+
+def clean_db(db_file, cleaner=None, tables=TAG_TABLES):
+    """Clean the tag values of the database's tag tables in place, then rebuild
+    tag_summary from them.
+    Returns:
+        changed (dict): table -> values changed.
+    """
+    cleaner = cleaner or Cleaner()
+    conn = sqlite3.connect(db_file)
+    changed = {}
+    try:
+        present = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+        for table in tables:
+            if table not in present:
+                continue
+            frame = pd.read_sql('SELECT rowid, key, value, type FROM {0}'.format(table), conn)
+            before = frame['value'].copy()
+            changed[table] = cleaner.clean_frame(frame)
+            rows = frame[(frame['value'] != before) & ~(frame['value'].isna() & before.isna())]
+            conn.executemany('UPDATE {0} SET value = ? WHERE rowid = ?'.format(table),
+                             [(value, int(rowid)) for rowid, value in zip(rows['rowid'], rows['value'])])
+        conn.commit()
+        if any(changed.values()) and summary.has_summaries(conn):
+            summary.refresh(conn, ['tag_summary'])
+    finally:
+        conn.close()
+    return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clean street names and postcodes in tags csv files '
+                                                 'or the database after the import.')
+    parser.add_argument('csv_files', nargs='*', help='tags csv files to clean in place')
+    parser.add_argument('--db', help='SQLite database whose tag tables are cleaned in place')
+    args = parser.parse_args()
+    for csv_file in args.csv_files:
+        print('{0}: {1} values changed'.format(csv_file, clean_csv(csv_file)))
+    if args.db:
+        for table, count in sorted(clean_db(args.db).items()):
+            print('{0}: {1} values changed'.format(table, count))
@@ -1,9 +1,21 @@
-from sqlalchemy import create_engine, Table, Column, Integer, Float, String, MetaData, ForeignKey
+from sqlalchemy import create_engine, select, Table, Column, Index, Integer, Float, String, MetaData, ForeignKey
+from sqlalchemy.engine import Engine
+from contextlib import contextmanager
 import datetime as dt
 import pandas as pd
+import argparse
+import atexit
+import os
+import sqlite3
+
+import activity
+import instrument
+import summary
+
+DB_FILE = 'inglewood.db'
 
 # Create Database called 'inglewood.db'
-engine = create_engine('sqlite:///inglewood.db') 
+engine = create_engine('sqlite:///' + DB_FILE)
 
 # Create tables within the Database
 metadata = MetaData()
@@ -48,20 +60,411 @@ ways_nodes = Table('ways_nodes', metadata,
     Column('position', Integer, nullable=False)
 )
 
-metadata.create_all(engine)
+relations = Table('relations', metadata,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('user', String),
+    Column('uid', Integer),
+    Column('version', String),
+    Column('changeset', Integer),
+    Column('timestamp', String)
+)
+
+relations_tags = Table('relations_tags', metadata,
+    Column('id', Integer, ForeignKey('relations.id'), nullable=False),
+    Column('key', String),
+    Column('value', String),
+    Column('type', String),
+)
+
+# member_id refers to nodes, ways or relations depending on member_type, and
+# often to elements outside the extract, so it has no foreign key
+relations_members = Table('relations_members', metadata,
+    Column('id', Integer, ForeignKey('relations.id'), nullable=False),
+    Column('member_id', Integer, nullable=False),
+    Column('member_type', String, nullable=False),
+    Column('role', String),
+    Column('position', Integer, nullable=False)
+)
+
+# Bounding box and hex WKB geometry of each way, from ing_import.py --geometry
+ways_geometry = Table('ways_geometry', metadata,
+    Column('id', Integer, ForeignKey('ways.id'), primary_key=True, nullable=False),
+    Column('min_lat', Float),
+    Column('min_lon', Float),
+    Column('max_lat', Float),
+    Column('max_lon', Float),
+    Column('missing_nodes', Integer),
+    Column('geometry', String)
+)
+
+# Node, way and relation tags in one table, so cross-type tag queries need no UNION ALL
+tags = Table('tags', metadata,
+    Column('id', Integer, nullable=False),
+    Column('key', String),
+    Column('value', String),
+    Column('type', String),
+    Column('element_type', String, nullable=False)
+)
+
+# Counts kept up to date with every append, answering the notebook's aggregate
+# questions without scanning the element and tag tables (see summary.py)
+element_totals = Table('element_totals', metadata,
+    Column('element_type', String, nullable=False),
+    Column('count', Integer, nullable=False),
+    Index('element_totals_key', 'element_type')
+)
+
+user_summary = Table('user_summary', metadata,
+    Column('element_type', String, nullable=False),
+    Column('uid', Integer),
+    Column('user', String),
+    Column('count', Integer, nullable=False),
+    Index('user_summary_key', 'uid', 'user', 'element_type')
+)
+
+tag_summary = Table('tag_summary', metadata,
+    Column('element_type', String, nullable=False),
+    Column('type', String),
+    Column('key', String),
+    Column('value', String),
+    Column('count', Integer, nullable=False),
+    Index('tag_summary_key', 'key', 'element_type', 'value', 'type')
+)
+
+# Users, integer edit metadata and per-user and per-changeset activity,
+# filled with every append (see activity.py); timestamps are epoch seconds
+users = Table('users', metadata,
+    Column('uid', Integer, primary_key=True, nullable=False),
+    Column('user', String),
+    Column('seen', Integer)
+)
+
+edits = Table('edits', metadata,
+    Column('element_type', String, nullable=False),
+    Column('id', Integer, nullable=False),
+    Column('uid', Integer),
+    Column('changeset', Integer),
+    Column('version', Integer),
+    Column('timestamp', Integer)
+)
+
+user_activity = Table('user_activity', metadata,
+    Column('uid', Integer, primary_key=True, nullable=False),
+    Column('nodes', Integer),
+    Column('ways', Integer),
+    Column('relations', Integer),
+    Column('first_edit', Integer),
+    Column('last_edit', Integer)
+)
+
+changesets = Table('changesets', metadata,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('uid', Integer),
+    Column('nodes', Integer),
+    Column('ways', Integer),
+    Column('relations', Integer),
+    Column('first_edit', Integer),
+    Column('last_edit', Integer),
+    Column('min_lat', Float),
+    Column('min_lon', Float),
+    Column('max_lat', Float),
+    Column('max_lon', Float)
+)
+
+# Rows of each table loaded so far, committed with every chunk so an
+# interrupted load can be resumed with --resume
+import_checkpoints = Table('import_checkpoints', metadata,
+    Column('table_name', String, primary_key=True, nullable=False),
+    Column('rows', Integer),
+    Column('done', Integer)
+)
+
+# csv file and table of each load, in load order
+CSV_TABLES = [('nodes.csv', 'nodes'),
+              ('nodes_tags.csv', 'nodes_tags'),
+              ('ways.csv', 'ways'),
+              ('ways_tags.csv', 'ways_tags'),
+              ('ways_nodes.csv', 'ways_nodes'),
+              ('relations.csv', 'relations'),
+              ('relations_tags.csv', 'relations_tags'),
+              ('relations_members.csv', 'relations_members'),
+              ('ways_geometry.csv', 'ways_geometry')]
+
+# csv files that are only written on request and skipped when missing
+OPTIONAL_CSV = ['ways_geometry.csv']
+
+# Secondary indexes (name, table, columns), built once the data is in.
+# The notebook queries filter the tag tables on key or value and join back on
+# id, so (key, value, id) and (value, id) cover them without touching the table.
+INDEXES = [('nodes_tags_id', 'nodes_tags', ['id']),
+           ('nodes_tags_key_value', 'nodes_tags', ['key', 'value', 'id']),
+           ('nodes_tags_value', 'nodes_tags', ['value', 'id']),
+           ('ways_tags_id', 'ways_tags', ['id']),
+           ('ways_tags_key_value', 'ways_tags', ['key', 'value', 'id']),
+           ('ways_tags_value', 'ways_tags', ['value', 'id']),
+           ('ways_nodes_id', 'ways_nodes', ['id', 'position']),
+           ('ways_nodes_node_id', 'ways_nodes', ['node_id']),
+           ('relations_tags_id', 'relations_tags', ['id']),
+           ('relations_tags_key_value', 'relations_tags', ['key', 'value', 'id']),
+           ('relations_tags_value', 'relations_tags', ['value', 'id']),
+           ('relations_members_id', 'relations_members', ['id', 'position']),
+           ('relations_members_member', 'relations_members', ['member_type', 'member_id']),
+           ('tags_key_value', 'tags', ['key', 'value', 'element_type']),
+           ('tags_element', 'tags', ['element_type', 'id']),
+           ('edits_element', 'edits', ['element_type', 'id']),
+           ('edits_timestamp', 'edits', ['timestamp']),
+           ('edits_uid', 'edits', ['uid', 'timestamp']),
+           ('edits_changeset', 'edits', ['changeset']),
+           ('user_activity_last_edit', 'user_activity', ['last_edit']),
+           ('changesets_uid', 'changesets', ['uid', 'first_edit']),
+           ('changesets_first_edit', 'changesets', ['first_edit'])]
+
+# Per-type tag table -> element_type of its rows in the unified tags table
+TAG_TABLES = {'nodes_tags': 'node',
+              'ways_tags': 'way',
+              'relations_tags': 'relation'}
+
+# R-tree virtual tables of node points and way bounding boxes, rebuilt by
+# create_rtree() once the tables are loaded
+RTREE_TABLES = [
+    ('nodes_rtree',
+     'SELECT id, lat, lat, lon, lon FROM nodes WHERE lat IS NOT NULL AND lon IS NOT NULL'),
+    ('ways_rtree',
+     'SELECT ways_nodes.id, MIN(lat), MAX(lat), MIN(lon), MAX(lon) '
+     'FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id GROUP BY ways_nodes.id')]
+
+# Fast, unsafe settings for the duration of a bulk load: a crash mid-load
+# can corrupt the database, which is then simply rebuilt from the csv files.
+BULK_PRAGMAS = ['PRAGMA journal_mode=WAL',
+                'PRAGMA synchronous=OFF',
+                'PRAGMA cache_size=-1048576',  # 1 GB
+                'PRAGMA temp_store=MEMORY',
+                'PRAGMA foreign_keys=OFF']
+
+# SQLite defaults, restored once the bulk load is done
+SAFE_PRAGMAS = ['PRAGMA journal_mode=DELETE',
+                'PRAGMA synchronous=FULL',
+                'PRAGMA cache_size=-2000',
+                'PRAGMA temp_store=DEFAULT']
+
+@contextmanager
+def transaction(con):
+    """Run a block in one transaction of an SQLAlchemy engine or connection, yielding the connection."""
+    if isinstance(con, Engine):
+        with con.begin() as conn:
+            yield conn
+    else:
+        with con.begin():
+            yield con
+
+
+def read_checkpoint(con, table):
+    """Rows of a table loaded so far and whether its csv file was loaded completely."""
+    with transaction(con) as conn:
+        row = conn.execute(select(import_checkpoints.c.rows, import_checkpoints.c.done)
+                           .where(import_checkpoints.c.table_name == table)).fetchone()
+    if row is None:
+        return 0, False
+    return row[0], bool(row[1])
+
+
+def save_checkpoint(conn, table, rows, done=False):
+    """Record the rows loaded into a table, within the caller's transaction."""
+    conn.execute(import_checkpoints.delete().where(import_checkpoints.c.table_name == table))
+    conn.execute(import_checkpoints.insert().values(table_name=table, rows=rows, done=int(done)))
+
 
 # Load csv files into Python Pandas DataFrames, then load them into SQLite database 
-def csv_to_db(csvfile, table):
+def csv_to_db(csvfile, table, con=engine, resume=False, metrics=None):
+    """Load a csv file into a table in chunks, each committed with its checkpoint.
+    The summary and activity tables are updated in the same transactions.
+    metrics (an instrument.Metrics) times the read_csv, to_sql, tags, summary,
+    activity and commit stages and counts rows and bytes read.  Returns (rows, seconds).
+    """
     print('Loading {}'.format(csvfile))
     start = dt.datetime.now()
     chunksize = 200000
     j = 0
-    for df in pd.read_csv(csvfile, chunksize=chunksize, iterator=True, encoding='utf-8'):
-        j+=1
-        df.to_sql(table, engine, if_exists='append', index=False)
-
-csv_to_db('nodes.csv', 'nodes')
-csv_to_db('nodes_tags.csv', 'nodes_tags')
-csv_to_db('ways.csv', 'ways')
-csv_to_db('ways_tags.csv', 'ways_tags')
-csv_to_db('ways_nodes.csv', 'ways_nodes')
\ No newline at end of file
+    loaded, done = read_checkpoint(con, table) if resume else (0, False)
+    if done:
+        print('{0}: already loaded ({1} rows)'.format(table, loaded))
+        return 0, 0.0
+    # Checkpoints fall on chunk boundaries, so a resumed load reads the same chunks
+    skip = None
+    if loaded:
+        print('{0}: resuming after {1} rows'.format(table, loaded))
+        skip = lambda i: 0 < i <= loaded
+    rows = 0
+    delta = summary.Delta()
+    source = open(csvfile, 'rb')
+    try:
+        reader = source if metrics is None else instrument.CountingReader(source, metrics)
+        chunks = pd.read_csv(reader, chunksize=chunksize, iterator=True, encoding='utf-8', skiprows=skip)
+        if metrics is not None:
+            chunks = metrics.timed('read_csv', chunks)
+        for df in chunks:
+            j+=1
+            # Each chunk, its unified tags rows and the checkpoint are committed together
+            with instrument.stage(metrics, 'commit'), transaction(con) as conn:
+                with instrument.stage(metrics, 'to_sql'):
+                    df.to_sql(table, conn, if_exists='append', index=False)
+                # Keep the unified tags table in step with every append
+                if table in TAG_TABLES:
+                    with instrument.stage(metrics, 'tags'):
+                        df.assign(element_type=TAG_TABLES[table]).to_sql('tags', conn, if_exists='append',
+                                                                         index=False)
+                if table in summary.SOURCES:
+                    with instrument.stage(metrics, 'summary'):
+                        delta.add_frame(table, df)
+                        delta.apply(conn.connection.dbapi_connection)
+                if table in activity.ELEMENT_TABLES:
+                    with instrument.stage(metrics, 'activity'):
+                        activity.stage_frame(conn.connection.dbapi_connection, table, df)
+                        activity.merge(conn.connection.dbapi_connection)
+                rows += len(df)
+                save_checkpoint(conn, table, loaded + rows)
+            if metrics is not None:
+                metrics.count('rows', len(df))
+                metrics.count(table + '_rows', len(df))
+                metrics.tick()
+    finally:
+        source.close()
+    with transaction(con) as conn:
+        save_checkpoint(conn, table, loaded + rows, done=True)
+    seconds = (dt.datetime.now() - start).total_seconds()
+    print('{0}: {1} rows in {2} chunks, {3:.1f}s ({4:.0f} rows/s)'.format(
+        table, rows, j, seconds, rows / seconds if seconds else 0))
+    return rows, seconds
+
+
+def set_pragmas(conn, pragmas):
+    """Run each PRAGMA statement on a sqlite3 connection."""
+    for pragma in pragmas:
+        conn.execute(pragma)
+
+
+def create_indexes(conn, indexes=INDEXES):
+    """Build the secondary indexes on a sqlite3 connection."""
+    for name, table, columns in indexes:
+        start = dt.datetime.now()
+        conn.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'.format(
+            name, table, ', '.join('"{0}"'.format(column) for column in columns)))
+        print('Index {0}: {1:.1f}s'.format(name, (dt.datetime.now() - start).total_seconds()))
+    conn.commit()
+
+
+def create_rtree(conn, rtree_tables=RTREE_TABLES):
+    """Rebuild the R-tree spatial indexes on a sqlite3 connection.
+    Each R-tree holds (id, min_lat, max_lat, min_lon, max_lon) with the box
+    rounded outwards to 32 bit floats, so lookups must re-check exact coordinates.
+    """
+    for name, select in rtree_tables:
+        start = dt.datetime.now()
+        conn.execute('DROP TABLE IF EXISTS {0}'.format(name))
+        conn.execute('CREATE VIRTUAL TABLE {0} USING rtree(id, min_lat, max_lat, min_lon, max_lon)'.format(name))
+        conn.execute('INSERT INTO {0} {1}'.format(name, select))
+        print('R-tree {0}: {1:.1f}s'.format(name, (dt.datetime.now() - start).total_seconds()))
+    conn.commit()
+
+
+def refresh_tags(conn):
+    """Rebuild the unified tags table from the per-type tag tables."""
+    conn.execute('DELETE FROM tags')
+    for table, element_type in sorted(TAG_TABLES.items()):
+        conn.execute('INSERT INTO tags (id, key, value, type, element_type) '
+                     'SELECT id, key, value, type, ? FROM {0}'.format(table), (element_type,))
+    conn.commit()
+
+
+def present_tables(csv_tables=CSV_TABLES):
+    """The (csv file, table) pairs to load: all but the optional csv files not written."""
+    return [(csvfile, table) for csvfile, table in csv_tables
+            if csvfile not in OPTIONAL_CSV or os.path.exists(csvfile)]
+
+
+def bulk_load(csv_tables=CSV_TABLES, db_file=DB_FILE, resume=False, metrics=None):
+    """Load the csv files with fast SQLite settings, then index and analyze.
+    Args:
+        csv_tables (list): (csv file, table) pairs, in load order.
+        db_file (str): SQLite database file.
+        resume (bool): if True, will carry on from the checkpoints of an interrupted load.
+        metrics (instrument.Metrics): if given, times the load, index, rtree and analyze stages.
+    Returns:
+        stats (dict): (rows, seconds) loaded into each table.
+    """
+    # One connection throughout, since the pragmas only apply to it
+    load_engine = create_engine('sqlite:///' + db_file)
+    stats = {}
+    csv_tables = present_tables(csv_tables)
+    if metrics is not None and metrics.total_bytes is None:
+        metrics.total_bytes = sum(os.path.getsize(csvfile) for csvfile, _ in csv_tables)
+    with load_engine.connect() as load_conn:
+        conn = load_conn.connection.dbapi_connection
+        try:
+            set_pragmas(conn, BULK_PRAGMAS)
+            for csvfile, table in csv_tables:
+                stats[table] = csv_to_db(csvfile, table, load_conn, resume, metrics)
+            with instrument.stage(metrics, 'index'):
+                create_indexes(conn)
+            with instrument.stage(metrics, 'rtree'):
+                create_rtree(conn)
+            with instrument.stage(metrics, 'analyze'):
+                conn.execute('ANALYZE')
+                conn.commit()
+        finally:
+            set_pragmas(conn, SAFE_PRAGMAS)
+    load_engine.dispose()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load the csv files into the SQLite database.')
+    parser.add_argument('--bulk', action='store_true',
+                        help='load with WAL, synchronous=OFF and a large cache, then index and ANALYZE')
+    parser.add_argument('--index-only', action='store_true',
+                        help='only build the indexes and R-trees of an existing database and ANALYZE it')
+    parser.add_argument('--refresh-tags', action='store_true',
+                        help='rebuild the unified tags table of an existing database, then index it')
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the checkpoints of an interrupted load')
+    parser.add_argument('--progress', action='store_true',
+                        help='print rows loaded, rows/s and ETA every few seconds')
+    parser.add_argument('--metrics', help='write the per-stage timings and counters to this JSON file')
+    parser.add_argument('--profile', help='write cProfile statistics of the load to this file')
+    parser.add_argument('--sample-profile', help='write collapsed stacks of a sampling profiler to this file')
+    args = parser.parse_args()
+
+    metrics = instrument.Metrics('load', progress=args.progress)
+    if args.metrics:
+        # Also written when the load is interrupted
+        atexit.register(metrics.dump, args.metrics)
+
+    metadata.create_all(engine)
+
+    if args.index_only or args.refresh_tags:
+        conn = sqlite3.connect(DB_FILE)
+        if args.refresh_tags:
+            refresh_tags(conn)
+        create_indexes(conn)
+        create_rtree(conn)
+        conn.execute('ANALYZE')
+        conn.commit()
+        conn.close()
+    elif args.bulk:
+        with instrument.profiled(args.profile, args.sample_profile):
+            bulk_load(resume=args.resume, metrics=metrics)
+    else:
+        csv_tables = present_tables()
+        metrics.total_bytes = sum(os.path.getsize(csvfile) for csvfile, _ in csv_tables)
+        with instrument.profiled(args.profile, args.sample_profile):
+            for csvfile, table in csv_tables:
+                csv_to_db(csvfile, table, resume=args.resume, metrics=metrics)
+            conn = sqlite3.connect(DB_FILE)
+            with metrics.stage('index'):
+                create_indexes(conn)
+            with metrics.stage('rtree'):
+                create_rtree(conn)
+            conn.close()
+    if metrics.timers:
+        print(metrics.progress_line())
+        print(metrics.report())
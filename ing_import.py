@@ -12,12 +12,29 @@ import re
 import csv
 from collections import defaultdict
 import schema
-import cerberus
+import schema_validator
+import cleaning
+import instrument
+import node_index
+import osm_io
+import parsers
+import pbf_reader
+import pipeline
 import codecs
 import datetime as dt
 from sqlalchemy import create_engine, Table, Column, Integer, Float, String, MetaData, ForeignKey
 import sqlite3
 import unicodecsv
+import argparse
+import atexit
+import json
+import multiprocessing
+import operator
+import os
+import random
+import shutil
+import tempfile
+import time
 
 OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
 
@@ -179,6 +196,11 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_TAGS_PATH = "relations_tags.csv"
+RELATION_MEMBERS_PATH = "relations_members.csv"
+WAYS_GEOMETRY_PATH = "ways_geometry.csv"
+CHECKPOINT_PATH = "import_checkpoint.json"
 
 LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
 PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
@@ -243,6 +265,42 @@ SCHEMA = {
                 'type': {'required': True, 'type': 'string'}
             }
         }
+    },
+    'relation': {
+        'type': 'dict',
+        'schema': {
+            'id': {'required': True, 'type': 'integer', 'coerce': int},
+            'user': {'required': True, 'type': 'string'},
+            'uid': {'required': True, 'type': 'integer', 'coerce': int},
+            'version': {'required': True, 'type': 'string'},
+            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
+            'timestamp': {'required': True, 'type': 'string'}
+        }
+    },
+    'relation_members': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'member_id': {'required': True, 'type': 'integer', 'coerce': int},
+                'member_type': {'required': True, 'type': 'string'},
+                'role': {'required': True, 'type': 'string'},
+                'position': {'required': True, 'type': 'integer', 'coerce': int}
+            }
+        }
+    },
+    'relation_tags': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'required': True, 'type': 'integer', 'coerce': int},
+                'key': {'required': True, 'type': 'string'},
+                'value': {'required': True, 'type': 'string'},
+                'type': {'required': True, 'type': 'string'}
+            }
+        }
     }
 }
 
@@ -253,60 +311,76 @@ NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'member_type', 'role', 'position']
 
+# Shaped element key, csv path and field order of each output table
+TABLES = [('node', NODES_PATH, NODE_FIELDS),
+          ('node_tags', NODE_TAGS_PATH, NODE_TAGS_FIELDS),
+          ('way', WAYS_PATH, WAY_FIELDS),
+          ('way_nodes', WAY_NODES_PATH, WAY_NODES_FIELDS),
+          ('way_tags', WAY_TAGS_PATH, WAY_TAGS_FIELDS),
+          ('relation', RELATIONS_PATH, RELATION_FIELDS),
+          ('relation_members', RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS),
+          ('relation_tags', RELATION_TAGS_PATH, RELATION_TAGS_FIELDS)]
 
-# Regex to match correct street name types  
-street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+# Shaped element keys holding a single row; the other keys hold lists of rows
+ELEMENT_KEYS = ('node', 'way', 'relation')
 
-# List of valid street names
-expected_street_types = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square", "Lane", "Road",
-            "Trail", "Parkway", "Commons", "Northeast", "South", "Southeast", "Southwest","Northwest",
-            "East", "West", "North", "Highway", "Way", "Terrace", "Freeway", "Highway", "Point", 
-           "Alley", "Circle", "426", "Ic"]
+# Top level elements converted by process_map
+ELEMENT_TAGS = ('node', 'way', 'relation')
 
-street_type_mapping = { "Ave": "Avenue",
-            "Blvd": "Boulevard",
-            "Bld.": "Boulevard",
-            "Blv.": "Boulevard",
-            "St": "Street"
-          }
+# Byte ranges handed to worker processes are at most this large
+CHUNK_SIZE = 64 * 1024 * 1024
 
-def update_street_name(value):
-    """update street name values based on mapping.
-    Args:
-        value (str): original street name value.
-    Returns:
-        value (str): cleaned street name value.
-        None if data does not match expected format.
-    """
-    m = street_type_re.search(value)
-    if m:
-        if m.group() in street_type_mapping:
-            startpos = value.find(m.group())
-            value = value[:startpos] + street_type_mapping[m.group()]
-        return value
-    else:
-        return None
+# Input bytes shaped between checkpoints of a checkpointed serial run
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+
+ELEMENT_START_RE = re.compile(br'<(?:node|way|relation)[\s/>]')
+"""Regular expression to recognise the start of a top level element"""
 
 
-def update_postcode(bad_postcode):
-    """update postcode based on format.  
+CLEANER = cleaning.Cleaner()
+"""Tag cleaning stage used by shape_tag(), with the rules of tag_rules.json.
+CLEANER.stats() has its memo counters.
+"""
+
+
+def shape_tag(value_k, value_v, problem_chars=PROBLEMCHARS, default_tag_type='regular', cleaner=CLEANER):
+    """Split and clean one secondary tag.
     Args:
-        bad_postcode (str): bad postcode to be split at the "-"
+        value_k (str): the tag "k" attribute value.
+        value_v (str): the tag "v" attribute value.
+        problem_chars (regex): regular expression to recognise problem characters
+        default_tag_type (str): type of tags whose "k" has no colon
+        cleaner (obj): cleaning.Cleaner applied to the value
     Returns:
-        postcode: cleaned postcode.  only the first five digits
+        (key, value, type) tuple, or None if "k" contains problematic characters.
     """
-    postcode = bad_postcode.split("-")[0]
-    return postcode
+    if problem_chars.search(value_k):
+        return None
+    # If the k attribute contains ":" - Take the first part as type, and the remainder as key.
+    if LOWER_COLON.search(value_k):
+        tag_type, key = value_k.split(':', 1)
+    else:
+        tag_type, key = default_tag_type, value_k
+
+    # Update Tags for street names and postal codes
+    if value_k in cleaner.rules:
+        value_v = cleaner.clean(value_k, value_v)
+    return key, value_v, tag_type
 
     
 def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict.
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular',
+                  relation_attr_fields=RELATION_FIELDS):
+    """Clean and shape node, way or relation XML element to Python dict.
     Args:
         element (obj): element found using ET.iterparse().
         node_attr_fields (list): node attribute fields to be passed to output dict
         way_attr_fields (list): way attribute fields to be passed to output dict
+        relation_attr_fields (list): relation attribute fields to be passed to output dict
         problem_chars (regex): regular expression to recognise problem characters
         default_tag_category (str): default value to be passed to the 'category' 
             field in output dict
@@ -314,6 +388,8 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
         dict of node/way element attributes and attributes of child elements (tags)
         format if node: {'node': node_attribs, 'node_tags': tags}
         format if way: {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+        format if relation: {'relation': relation_attribs, 'relation_members': members,
+                             'relation_tags': tags}
     """
     
     node_attribs = {}
@@ -328,34 +404,13 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
             node_attribs[field] = element.attrib[field]
            
         for child in element: 
-            # Create dictionary for child tag
-            child_tag = {}
-            value_k = child.attrib['k']
-            child_tag['id'] = node_attribs['id']
-            
+            shaped = shape_tag(child.attrib['k'], child.attrib['v'], problem_chars, default_tag_type)
             # If tag "k" contains problematic characters, ignore it
-            if PROBLEMCHARS.search(value_k): 
+            if shaped is None:
                 continue
-            # If the k attribute contains ":" - Take the first part as type, and the remainder as key.
-            elif LOWER_COLON.search(value_k):
-                value_k_split = value_k.split(':', 1)
-                child_tag['type'] = value_k_split[0]
-                child_tag['key'] = value_k_split[1]
-                child_tag['value'] = child.attrib['v']
-            # Else assign the attribute value to the keys
-            else: 
-                child_tag['key'] = value_k
-                child_tag['value'] = child.attrib['v']
-                child_tag['type'] = default_tag_type
-
-            # Update Tags for street names and postal codes
-            if value_k == "addr:street":
-                child_tag['value']= update_street_name(child_tag['value'])
-            elif value_k == "addr:postcode":
-                child_tag['value'] = update_postcode(child_tag['value'])
-        
+
             # Append dictionary tag to list tags
-            tags.append(child_tag) 
+            tags.append({'id': node_attribs['id'], 'key': shaped[0], 'value': shaped[1], 'type': shaped[2]})
         
         return {'node': node_attribs, 'node_tags': tags}
         
@@ -367,35 +422,14 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
         
         counter = 0
         for child in element:
-            # Create dictionary for child tag
-            child_tag = {}
             if child.tag == 'tag':  
-                value_k = child.attrib['k']
-                child_tag['id'] = way_attribs['id']
-                                
+                shaped = shape_tag(child.attrib['k'], child.attrib['v'], problem_chars, default_tag_type)
                 # If tag "k" contains problematic characters, ignore it
-                if PROBLEMCHARS.search(value_k): 
+                if shaped is None:
                     continue
-                # If the k attribute contains ":" - Take the first part as type, and the remainder as key.
-                elif LOWER_COLON.search(value_k): 
-                    value_k_split = value_k.split(':', 1)
-                    child_tag['type'] = value_k_split[0]
-                    child_tag['key'] = value_k_split[1]
-                    child_tag['value'] = child.attrib['v']
-                # Else assign the attribute value to the keys
-                else: 
-                    child_tag['key'] = value_k
-                    child_tag['value'] = child.attrib['v']
-                    child_tag['type'] = default_tag_type
-                    
-                 # Update Tags for street names and postal codes
-                if value_k == "addr:street":
-                    child_tag['value']= update_street_name(child_tag['value'])
-                elif value_k == "addr:postcode":
-                    child_tag['value'] = update_postcode(child_tag['value'])
 
                 # Append dictionary tag to list tags
-                tags.append(child_tag) 
+                tags.append({'id': way_attribs['id'], 'key': shaped[0], 'value': shaped[1], 'type': shaped[2]})
             
             if child.tag =='nd': #
                 way_node = {}
@@ -407,24 +441,150 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
                 
         return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
 
+    # Write the value of each relation element attribute into a dictionary.
+    elif element.tag == 'relation':
+        relation_attribs = {}
+        for field in relation_attr_fields:
+            relation_attribs[field] = element.attrib[field]
+
+        members = []
+        for child in element:
+            if child.tag == 'tag':
+                shaped = shape_tag(child.attrib['k'], child.attrib['v'], problem_chars, default_tag_type)
+                # If tag "k" contains problematic characters, ignore it
+                if shaped is None:
+                    continue
+                tags.append({'id': relation_attribs['id'], 'key': shaped[0], 'value': shaped[1], 'type': shaped[2]})
+
+            elif child.tag == 'member':
+                members.append({'id': relation_attribs['id'],
+                                'member_id': child.attrib['ref'],
+                                'member_type': child.attrib['type'],
+                                'role': child.attrib['role'],
+                                'position': len(members)})
+
+        return {'relation': relation_attribs, 'relation_members': members, 'relation_tags': tags}
+
+
+node_row = operator.itemgetter(*NODE_FIELDS)
+way_row = operator.itemgetter(*WAY_FIELDS)
+relation_row = operator.itemgetter(*RELATION_FIELDS)
+
+
+def shape_element_rows(element, problem_chars=PROBLEMCHARS, default_tag_type='regular'):
+    """Clean and shape node, way or relation XML element to tuples in csv column order.
+    Allocation-light alternative to shape_element(): no dict is built per tag
+    or per nd, and the tuples can be written with a positional csv writer.
+    Args:
+        element (obj): element found using ET.iterparse().
+        problem_chars (regex): regular expression to recognise problem characters
+        default_tag_type (str): type of tags whose "k" has no colon
+    Returns:
+        format if node: {'node': node_row, 'node_tags': [tag_row, ...]}
+        format if way: {'way': way_row, 'way_nodes': [way_node_row, ...], 'way_tags': [tag_row, ...]}
+        format if relation: {'relation': relation_row, 'relation_members': [member_row, ...],
+                             'relation_tags': [tag_row, ...]}
+        with rows ordered like NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, ...
+    """
+    if element.tag == 'node':
+        row = node_row(element.attrib)
+        element_id = row[0]
+        tags = []
+        for child in element:
+            shaped = shape_tag(child.attrib['k'], child.attrib['v'], problem_chars, default_tag_type)
+            if shaped is not None:
+                tags.append((element_id,) + shaped)
+        return {'node': row, 'node_tags': tags}
+
+    elif element.tag == 'way':
+        row = way_row(element.attrib)
+        element_id = row[0]
+        tags = []
+        way_nodes = []
+        for child in element:
+            if child.tag == 'tag':
+                shaped = shape_tag(child.attrib['k'], child.attrib['v'], problem_chars, default_tag_type)
+                if shaped is not None:
+                    tags.append((element_id,) + shaped)
+            elif child.tag == 'nd':
+                way_nodes.append((element_id, child.attrib['ref'], len(way_nodes)))
+        return {'way': row, 'way_nodes': way_nodes, 'way_tags': tags}
+
+    elif element.tag == 'relation':
+        row = relation_row(element.attrib)
+        element_id = row[0]
+        tags = []
+        members = []
+        for child in element:
+            if child.tag == 'tag':
+                shaped = shape_tag(child.attrib['k'], child.attrib['v'], problem_chars, default_tag_type)
+                if shaped is not None:
+                    tags.append((element_id,) + shaped)
+            elif child.tag == 'member':
+                attrib = child.attrib
+                members.append((element_id, attrib['ref'], attrib['type'], attrib['role'], len(members)))
+        return {'relation': row, 'relation_members': members, 'relation_tags': tags}
+
+
+def index_geometry(element, index):
+    """Geometry stage: add a node's coordinates to the node index, or resolve a
+    way's nodes into a ways_geometry row.
+    Args:
+        element (obj): element found using ET.iterparse().
+        index (obj): node index from node_index.open_index().
+    Returns:
+        dict with node_index.WAYS_GEOMETRY_FIELDS for a resolvable way, else None.
+    """
+    if element.tag == 'node':
+        index.add(element.attrib['id'], element.attrib['lat'], element.attrib['lon'])
+    elif element.tag == 'way':
+        return node_index.way_geometry(element.attrib['id'],
+                                       [nd.attrib['ref'] for nd in element.iter('nd')], index)
+    return None
+
+
+def rows_to_dicts(el):
+    """Convert shape_element_rows() output to the shape_element() format."""
+    shaped = {}
+    for key, _, fields in TABLES:
+        if key in el:
+            rows = el[key]
+            if isinstance(rows, tuple):
+                shaped[key] = dict(zip(fields, rows))
+            else:
+                shaped[key] = [dict(zip(fields, row)) for row in rows]
+    return shaped
+
 # ================================================== #
 #               Helper Functions                     #
 # ================================================== #
-def get_element(osm_file, tags=('node', 'way', 'relation')):
+def get_element(osm_file, tags=('node', 'way', 'relation'), parser='etree', metrics=None, read_ahead=False):
     """Yield element if it is the right type of tag.
     Args:
-        osmfile (obj): XML file to audit.
+        osmfile (obj): XML file to audit, plain or .gz/.bz2 compressed (see osm_io),
+            or an OSM PBF file.
         tags (list): element types to be yielded,
+        parser (str): XML parser backend, see parsers.PARSERS
+        metrics (obj): instrument.Metrics counting the bytes read, for progress
+        read_ahead (bool): if True, will read the file on a background thread
+            ahead of the parser (see pipeline.py)
     Yields:
-        elem (obj): element found using ET.iterparse().
+        elem (obj): element found using ET.iterparse(), or built alike by the
+            other parsers and pbf_reader.
     """
    
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
+    if osm_io.is_pbf(osm_file):
+        for elem in pbf_reader.iter_elements(osm_file, tags):
+            yield elem
+        return
+    source = osm_io.open_osm(osm_file, read_ahead=read_ahead)
+    try:
+        reader = source if metrics is None else instrument.CountingReader(source, metrics)
+        for elem in parsers.iter_elements(reader, tags, parser):
             yield elem
-            root.clear()
+    finally:
+        if source is not osm_file:
+            source.close()
 
 
 def validate_element(element, validator, schema=SCHEMA):
@@ -432,63 +592,570 @@ def validate_element(element, validator, schema=SCHEMA):
     Args:
         element (dict): dict of node/way element attributes and attributes of child elements
             returned by shape_element()
-        validator (obj): cerberus.validator object
+        validator (obj): schema_validator.Validator (or cerberus.Validator) object
         schema (dict): schema of desired data structure
     Raises:
         exception if element structure does not match schema
     """
     
     if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
+        field, errors = next(iter(validator.errors.items()))
         message_string = "\nElement of type '{0}' has the following errors:\n{1}"
         error_string = pprint.pformat(errors)
         
         raise Exception(message_string.format(field, error_string))
 
 
+class RangeReader(object):
+    """File-like object reading one byte range of an OSM file.
+    The range is wrapped in an <osm> root so it can be handed to ET.iterparse().
+    Args:
+        osm_file (str): path of the OSM (XML) file.
+        start (int): offset of the first byte of the range.
+        end (int): offset just past the last byte of the range.
+    """
+
+    def __init__(self, osm_file, start, end):
+        self._file = open(osm_file, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+        self._pending = [b'<osm>']
+        self._tail = b'</osm>'
+
+    def read(self, size=-1):
+        if self._pending:
+            return self._pending.pop()
+        if self._remaining > 0:
+            if size is None or size < 0 or size > self._remaining:
+                size = self._remaining
+            data = self._file.read(size)
+            self._remaining -= len(data)
+            if data:
+                return data
+            self._remaining = 0
+        data, self._tail = self._tail, b''
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def find_element_start(osm_file, offset, limit, block_size=1024 * 1024):
+    """Find the first top level element starting at or after offset.
+    Args:
+        osm_file (obj): OSM (XML) file opened in binary mode.
+        offset (int): byte offset to start searching from.
+        limit (int): byte offset to stop searching at.
+        block_size (int): number of bytes read per step.
+    Returns:
+        byte offset of the element start, or None if there is none before limit.
+    """
+    overlap = 16
+    while offset < limit:
+        osm_file.seek(offset)
+        block = osm_file.read(min(block_size, limit - offset))
+        if not block:
+            break
+        m = ELEMENT_START_RE.search(block)
+        if m:
+            return offset + m.start()
+        offset += max(len(block) - overlap, 1)
+    return None
+
+
+def find_chunks(file_in, chunk_size=CHUNK_SIZE, offset=0):
+    """Split an OSM file into byte ranges aligned on top level elements.
+    Args:
+        file_in (str): path of the OSM (XML) file.
+        chunk_size (int): approximate size in bytes of each range.
+        offset (int): byte offset to start from, e.g. a checkpointed range end.
+    Returns:
+        list of (start, end) byte offsets, in document order.
+    """
+    size = os.path.getsize(file_in)
+    with open(file_in, 'rb') as osm_file:
+        # Ranges stop at the closing root tag so it is not parsed twice
+        osm_file.seek(max(size - 4096, 0))
+        tail = osm_file.read()
+        close_pos = tail.rfind(b'</osm>')
+        end = size - len(tail) + close_pos if close_pos != -1 else size
+
+        start = find_element_start(osm_file, offset, end)
+        if start is None:
+            return []
+        boundaries = [start]
+        while True:
+            start = find_element_start(osm_file, boundaries[-1] + chunk_size, end)
+            if start is None:
+                break
+            boundaries.append(start)
+        boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def write_elements(elements, paths, validate=False, header=True, output_format='csv',
+                   row_group_size=None, validate_fraction=1.0, fast=False, geometry_path=None,
+                   node_index_kind='sparse', node_index_path=None, append=False, metrics=None,
+                   pipelined=False):
+    """Shape each element and write it to the csv (or Parquet) files.
+    Args:
+        elements (iterable): elements found using ET.iterparse().
+        paths (list): output path of each table, in the order of TABLES.
+        validate (bool): if True, will validate each element using validate_element()
+        header (bool): if True, will write the csv header rows
+        output_format (str): 'csv' or 'parquet'
+        row_group_size (int): rows per Parquet row group, defaults to
+            parquet_writer.ROW_GROUP_SIZE
+        validate_fraction (float): fraction of elements validated when validate is
+            True, picked with a fixed seed so runs are repeatable
+        fast (bool): if True, will shape with shape_element_rows() and write the
+            tuples positionally; the output is the same
+        geometry_path (str): if given, will index node coordinates and write each
+            way's bounding box and WKB geometry to this csv file (csv output only)
+        node_index_kind (str): 'sparse' or 'dense', see node_index.open_index()
+        node_index_path (str): backing file or spill directory of the node index
+        append (bool): if True, will append to the csv files instead of replacing them
+        metrics (obj): instrument.Metrics timing the parse, shape, validate, write
+            and geometry stages and counting elements and rows
+        pipelined (bool): if True, each table is written by its own thread from a
+            bounded queue of row batches, see pipeline.py
+    Returns:
+        count (int): number of elements written.
+    """
+    writers = {}
+    if output_format == 'parquet':
+        # pyarrow is only needed for Parquet output
+        import parquet_writer
+        row_group_size = row_group_size or parquet_writer.ROW_GROUP_SIZE
+        for (key, _, fields), path in zip(TABLES, paths):
+            writers[key] = parquet_writer.ParquetTableWriter(path, key, fields, row_group_size)
+        files = list(writers.values())
+    else:
+        buffering = pipeline.WRITE_BUFFER if pipelined else -1
+        files = [open(path, 'ab' if append else 'wb', buffering) for path in paths]
+        for (key, _, fields), f in zip(TABLES, files):
+            if fast:
+                writers[key] = unicodecsv.writer(f)
+                if header:
+                    writers[key].writerow(fields)
+            else:
+                writers[key] = unicodecsv.DictWriter(f, fields)
+                if header:
+                    writers[key].writeheader()
+
+    index = None
+    if geometry_path is not None:
+        files.append(open(geometry_path, 'wb'))
+        geometry_writer = unicodecsv.DictWriter(files[-1], node_index.WAYS_GEOMETRY_FIELDS)
+        if header:
+            geometry_writer.writeheader()
+        index = node_index.open_index(node_index_kind, node_index_path)
+    threaded = []
+    if pipelined:
+        threaded = [pipeline.ThreadedWriter(writers[key]) for key, _, _ in TABLES]
+        writers = dict((key, writer) for (key, _, _), writer in zip(TABLES, threaded))
+        if index is not None:
+            geometry_writer = pipeline.ThreadedWriter(geometry_writer)
+            threaded.append(geometry_writer)
+    try:
+        validator = schema_validator.Validator()
+        sampler = random.Random(0)
+        shape = shape_element_rows if fast else shape_element
+
+        count = 0
+        if metrics is not None:
+            elements = metrics.timed('parse', elements)
+            clock = instrument.clock
+        for element in elements:
+            if metrics is not None:
+                began = clock()
+            el = shape(element)
+            if metrics is not None:
+                now = clock()
+                metrics.add('shape', now - began)
+                began = now
+            if el:
+                if validate is True and (validate_fraction >= 1 or sampler.random() < validate_fraction):
+                    validate_element(rows_to_dicts(el) if fast else el, validator)
+                    if metrics is not None:
+                        now = clock()
+                        metrics.add('validate', now - began)
+                        began = now
+
+                for key, rows in el.items():
+                    if key in ELEMENT_KEYS:
+                        writers[key].writerow(rows)
+                    else:
+                        writers[key].writerows(rows)
+                if metrics is not None:
+                    now = clock()
+                    metrics.add('write', now - began)
+                    began = now
+                if index is not None:
+                    geometry = index_geometry(element, index)
+                    if geometry is not None:
+                        geometry_writer.writerow(geometry)
+                    if metrics is not None:
+                        metrics.add('geometry', clock() - began)
+                count += 1
+                if metrics is not None:
+                    metrics.count('elements')
+                    metrics.count('rows', sum(1 if key in ELEMENT_KEYS else len(rows) for key, rows in el.items()))
+                    metrics.tick()
+    finally:
+        try:
+            # The writer threads finish their queued rows before the files close
+            pipeline.close_all(threaded, metrics)
+        finally:
+            for f in files:
+                f.close()
+            if index is not None:
+                index.close()
+    return count
+
+
+def process_chunk(task):
+    """Shape one byte range of the OSM file into partial csv files (worker process).
+    Args:
+        task (tuple): (file_in, start, end, index, out_dir, parser, options, instrumented)
+            where options are keyword arguments for write_elements() and
+            instrumented asks for the stage timers and counters of the range
+    Returns:
+        (index, worker pid, elements written, seconds taken, (timers, counters) or None)
+    """
+    file_in, start, end, index, out_dir, parser, options, instrumented = task
+    metrics = instrument.Metrics() if instrumented else None
+    began = time.time()
+    paths = [partial_path(out_dir, path, index) for _, path, _ in TABLES]
+    reader = RangeReader(file_in, start, end)
+    try:
+        count = write_elements(get_element(reader, tags=ELEMENT_TAGS, parser=parser,
+                                           read_ahead=options.get('pipelined', False)), paths,
+                               header=False, metrics=metrics, **options)
+    finally:
+        reader.close()
+    stats = (dict(metrics.timers), dict(metrics.counters)) if metrics else None
+    return index, os.getpid(), count, time.time() - began, stats
+
+
+def partial_path(out_dir, path, index):
+    """Path of the partial csv written for one byte range."""
+    return os.path.join(out_dir, '{0}.{1:06d}'.format(os.path.basename(path), index))
+
+
+def merge_partials(out_dir, count):
+    """Concatenate the partial csv files in document order behind a header row.
+    Args:
+        out_dir (str): directory holding the partial csv files.
+        count (int): number of byte ranges processed.
+    """
+    for _, path, fields in TABLES:
+        with open(path, 'wb') as out:
+            unicodecsv.DictWriter(out, fields).writeheader()
+            for index in range(count):
+                with open(partial_path(out_dir, path, index), 'rb') as partial:
+                    shutil.copyfileobj(partial, out, 1024 * 1024)
+
+
+def print_throughput(results, seconds):
+    """Print elements/s for each worker process and for the whole run.
+    Args:
+        results (list): (index, worker pid, elements, seconds, ...) for each byte range.
+        seconds (float): wall clock time of the whole run.
+    """
+    workers = defaultdict(lambda: [0, 0.0])
+    for _, pid, count, taken in (result[:4] for result in results):
+        workers[pid][0] += count
+        workers[pid][1] += taken
+    for pid in sorted(workers):
+        count, taken = workers[pid]
+        print('worker {0}: {1} elements in {2:.1f}s ({3:.0f} elements/s)'.format(
+            pid, count, taken, count / taken if taken else 0))
+    total = sum(count for count, _ in workers.values())
+    print('total: {0} elements in {1:.1f}s ({2:.0f} elements/s)'.format(
+        total, seconds, total / seconds if seconds else 0))
+
+
+def read_checkpoint(checkpoint_path, file_in, mode):
+    """Load the checkpoint of an earlier run over the same input.
+    Args:
+        checkpoint_path (str): checkpoint (JSON) file.
+        file_in (str): path of the OSM (XML) file.
+        mode (str): 'serial' or 'parallel'; a checkpoint only resumes a run of its mode.
+    Returns:
+        state (dict), or None if there is no checkpoint.
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        state = json.load(f)
+    if (state['input'] != os.path.abspath(file_in) or state['size'] != os.path.getsize(file_in)
+            or state['mode'] != mode):
+        raise ValueError('{0} is the checkpoint of another run ({1} {2}); remove it to start over'.format(
+            checkpoint_path, state['mode'], state['input']))
+    return state
+
+
+def write_checkpoint(checkpoint_path, state):
+    """Replace the checkpoint file atomically, so a crash leaves the old or the new one."""
+    tmp = checkpoint_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, checkpoint_path)
+
+
+def new_checkpoint(file_in, mode):
+    return {'input': os.path.abspath(file_in), 'size': os.path.getsize(file_in), 'mode': mode,
+            'complete': False}
+
+
+def process_checkpointed(file_in, paths, options, resume, checkpoint_path=CHECKPOINT_PATH,
+                         chunk_size=CHECKPOINT_BYTES, parser='etree', metrics=None):
+    """Serial run over byte ranges, checkpointing after each range.
+    The checkpoint holds the input offset reached, the elements written and the
+    size of each csv file at that point.  Resuming truncates the csv files to
+    those sizes, dropping rows written after the checkpoint, and carries on
+    from the offset.
+    Args:
+        file_in (str): path of the OSM (XML) file.
+        paths (list): output csv path of each table, in the order of TABLES.
+        options (dict): keyword arguments for write_elements().
+        resume (bool): if True, will carry on from an existing checkpoint.
+        checkpoint_path (str): checkpoint (JSON) file.
+        chunk_size (int): approximate input bytes between checkpoints.
+        parser (str): XML parser backend, see parsers.PARSERS
+        metrics (obj): instrument.Metrics of the run.
+    """
+    state = read_checkpoint(checkpoint_path, file_in, 'serial') if resume else None
+    if state is not None and state['complete']:
+        print('{0} was already processed, see {1}'.format(file_in, checkpoint_path))
+        return
+    if state is not None:
+        for path, size in state['outputs'].items():
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+        print('Resuming at byte {0} after {1} elements'.format(state['offset'], state['elements']))
+    else:
+        state = new_checkpoint(file_in, 'serial')
+        state.update(offset=0, elements=0)
+
+    fresh = state['offset'] == 0
+    began = time.time()
+    for start, end in find_chunks(file_in, chunk_size, state['offset']):
+        reader = RangeReader(file_in, start, end)
+        if metrics is not None:
+            metrics.counters['bytes_read'] = start
+        try:
+            count = write_elements(get_element(reader, tags=ELEMENT_TAGS, parser=parser, metrics=metrics,
+                                               read_ahead=options.get('pipelined', False)), paths,
+                                   header=fresh, append=not fresh, metrics=metrics, **options)
+        finally:
+            reader.close()
+        fresh = False
+        state.update(offset=end, elements=state['elements'] + count,
+                     outputs=dict((path, os.path.getsize(path)) for path in paths))
+        write_checkpoint(checkpoint_path, state)
+    if fresh:
+        # No elements at all: still leave empty csv files behind
+        write_elements([], paths, **options)
+    state['complete'] = True
+    write_checkpoint(checkpoint_path, state)
+    seconds = time.time() - began
+    print('{0} elements, checkpointed every {1} bytes, in {2:.1f}s'.format(
+        state['elements'], chunk_size, seconds))
+
+
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
-def process_map(file_in, validate=False):
+def parquet_path(path):
+    """Parquet file written in place of a csv file."""
+    return os.path.splitext(path)[0] + '.parquet'
+
+
+def process_map(file_in, validate=False, workers=1, output_format='csv', row_group_size=None,
+                validate_fraction=1.0, fast=False, geometry=False, node_index_kind='sparse',
+                node_index_path=None, checkpoint=False, resume=False, checkpoint_path=CHECKPOINT_PATH,
+                parser='etree', metrics=None, pipelined=False):
     """Iteratively process each XML element and write to csv(s).
     Args:
         file_in (obj): XML file to audit.
         validate (bool): if True, will validate each element using validate_element()
+        workers (int): number of worker processes.  With more than one, the file is
+            split into byte ranges that are shaped in parallel and merged in
+            document order, giving the same csv files as a serial run.
+        output_format (str): 'csv', or 'parquet' for typed columnar files named
+            like the csv files (serial runs only).
+        row_group_size (int): rows per Parquet row group.
+        validate_fraction (float): fraction of elements to validate when validate is True.
+        fast (bool): if True, will use the tuple based shape_element_rows() path.
+        geometry (bool): if True, will also write ways_geometry.csv (serial csv runs only).
+        node_index_kind (str): 'sparse' or 'dense' node coordinate index for geometry.
+        node_index_path (str): backing file or spill directory of the node index.
+        checkpoint (bool): if True, will record progress in checkpoint_path as it
+            goes (csv output only).  Serial runs checkpoint every CHECKPOINT_BYTES of
+            input, parallel runs after every byte range.
+        resume (bool): if True, will carry on from the checkpoint of an interrupted
+            run instead of starting over; implies checkpoint.
+        checkpoint_path (str): checkpoint (JSON) file.
+        parser (str): XML parser backend, see parsers.PARSERS.
+        metrics (obj): instrument.Metrics collecting stage timers and counters and
+            printing progress; workers send back their stage timers.
+        pipelined (bool): if True, will read ahead of the parser and write each
+            table on its own thread, overlapping the I/O with parsing and shaping
+            (see pipeline.py).  The csv files are the same.
     Returns:
-        five CSV files:  nodes, nodes_tags, ways, ways_tags and ways_nodes 
+        eight CSV files:  nodes, nodes_tags, ways, ways_tags, ways_nodes, relations,
+        relations_tags and relations_members
     """
-    with open(NODES_PATH, 'wb') as nodes_file, \
-         open(NODE_TAGS_PATH, 'wb') as nodes_tags_file, \
-         open(WAYS_PATH, 'wb') as ways_file, \
-         open(WAY_NODES_PATH, 'wb') as way_nodes_file, \
-         open(WAY_TAGS_PATH, 'wb') as way_tags_file:
-
-        nodes_writer = unicodecsv.DictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = unicodecsv.DictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = unicodecsv.DictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = unicodecsv.DictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = unicodecsv.DictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
-                    
-process_map(OSM_FILE)
\ No newline at end of file
+    options = {'validate': validate, 'validate_fraction': validate_fraction, 'fast': fast,
+               'pipelined': pipelined}
+    checkpoint = checkpoint or resume
+    if (osm_io.is_compressed(file_in) or osm_io.is_pbf(file_in)) and (workers > 1 or checkpoint):
+        # Byte ranges and offsets refer to the plain XML; PBF blobs are decoded in parallel anyway
+        raise ValueError('Compressed and PBF input is read in one stream; use neither workers nor checkpoints')
+    if geometry:
+        # Ways need the coordinates of every node before them in the file
+        if workers > 1 or output_format != 'csv':
+            raise ValueError('Way geometries are only built by serial csv runs')
+        if checkpoint:
+            raise ValueError('Way geometries cannot be checkpointed, the node index is not saved')
+        options.update(geometry_path=WAYS_GEOMETRY_PATH, node_index_kind=node_index_kind,
+                       node_index_path=node_index_path)
+    if checkpoint and output_format != 'csv':
+        raise ValueError('Only csv output can be checkpointed')
+    if metrics is not None and metrics.total_bytes is None and not (
+            osm_io.is_compressed(file_in) or osm_io.is_pbf(file_in)):
+        # Progress is measured in bytes of XML read, so the size is only known for plain files
+        metrics.total_bytes = os.path.getsize(file_in)
+
+    if output_format == 'parquet':
+        if workers > 1:
+            raise ValueError('Parquet output is only written by serial runs')
+        write_elements(get_element(file_in, tags=ELEMENT_TAGS, parser=parser, metrics=metrics,
+                                   read_ahead=pipelined),
+                       [parquet_path(path) for _, path, _ in TABLES], output_format=output_format,
+                       row_group_size=row_group_size, metrics=metrics, **options)
+        return
+
+    if workers <= 1:
+        paths = [path for _, path, _ in TABLES]
+        if checkpoint:
+            process_checkpointed(file_in, paths, options, resume, checkpoint_path, parser=parser, metrics=metrics)
+        else:
+            write_elements(get_element(file_in, tags=ELEMENT_TAGS, parser=parser, metrics=metrics,
+                                       read_ahead=pipelined), paths,
+                           metrics=metrics, **options)
+        return
+
+    began = time.time()
+    state = read_checkpoint(checkpoint_path, file_in, 'parallel') if resume else None
+    if state is not None and state['complete']:
+        print('{0} was already processed, see {1}'.format(file_in, checkpoint_path))
+        return
+    if state is not None:
+        # Partial files of finished ranges were kept; only the rest is redone
+        chunks, out_dir = state['chunks'], state['out_dir']
+        print('Resuming with {0} of {1} byte ranges done'.format(len(state['done']), len(chunks)))
+    else:
+        # Several ranges per worker keep the pool busy when elements are unevenly sized
+        chunk_size = max(min(CHUNK_SIZE, os.path.getsize(file_in) // (workers * 4)), 1024 * 1024)
+        chunks = find_chunks(file_in, chunk_size)
+        out_dir = tempfile.mkdtemp(prefix='osm_chunks_', dir=os.path.dirname(os.path.abspath(NODES_PATH)))
+        if checkpoint:
+            state = new_checkpoint(file_in, 'parallel')
+            state.update(chunks=chunks, out_dir=out_dir, done=[])
+            write_checkpoint(checkpoint_path, state)
+    done = set(state['done']) if state is not None else set()
+    pool = multiprocessing.Pool(workers)
+    finished = False
+    try:
+        tasks = [(file_in, start, end, index, out_dir, parser, options, metrics is not None)
+                 for index, (start, end) in enumerate(chunks) if index not in done]
+        if metrics is not None:
+            metrics.counters['bytes_read'] = sum(end - start for index, (start, end) in enumerate(chunks)
+                                                 if index in done)
+        results = []
+        for result in pool.imap_unordered(process_chunk, tasks):
+            results.append(result)
+            if metrics is not None:
+                start, end = chunks[result[0]]
+                metrics.merge(*result[4])
+                metrics.count('bytes_read', end - start)
+                metrics.tick()
+            if checkpoint:
+                state['done'].append(result[0])
+                write_checkpoint(checkpoint_path, state)
+        pool.close()
+        merge_partials(out_dir, len(chunks))
+        finished = True
+    finally:
+        pool.terminate()
+        pool.join()
+        # A checkpointed run keeps its partial files until the csv files are merged
+        if finished or not checkpoint:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    if checkpoint:
+        state['complete'] = True
+        write_checkpoint(checkpoint_path, state)
+    print_throughput(results, time.time() - began)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert an OSM XML file to csv files.')
+    parser.add_argument('osm_file', nargs='?', default=OSM_FILE, help='OSM (XML) file to process')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--validate', action='store_true', help='validate each element against SCHEMA')
+    parser.add_argument('--validate-fraction', type=float, default=1.0,
+                        help='fraction of elements to validate with --validate')
+    parser.add_argument('--fast', action='store_true', help='shape elements to tuples instead of dicts')
+    parser.add_argument('--geometry', action='store_true',
+                        help='also write way bounding boxes and geometries to ways_geometry.csv')
+    parser.add_argument('--node-index', choices=['sparse', 'dense'], default='sparse',
+                        help='node coordinate index used by --geometry')
+    parser.add_argument('--node-index-path', help='backing file (dense) or spill directory (sparse)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='record progress in {0} so an interrupted run can be resumed'.format(CHECKPOINT_PATH))
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the checkpoint of an interrupted run (implies --checkpoint)')
+    parser.add_argument('--parser', choices=parsers.PARSERS, default='etree', help='XML parser backend')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='read ahead and write each table on its own thread, overlapping I/O with shaping')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='output file format')
+    parser.add_argument('--row-group-size', type=int, help='rows per Parquet row group')
+    parser.add_argument('--progress', action='store_true', help='print a progress line with ETA every few seconds')
+    parser.add_argument('--metrics', help='write stage timers and counters to this JSON file at exit')
+    parser.add_argument('--profile', help='write cProfile statistics of the run to this file')
+    parser.add_argument('--sample-profile', help='write sampled collapsed stacks of the run to this file')
+    args = parser.parse_args()
+    if args.format == 'parquet' and args.workers > 1:
+        parser.error('--format parquet cannot be combined with --workers')
+    if args.geometry and (args.workers > 1 or args.format != 'csv'):
+        parser.error('--geometry needs a serial csv run')
+    if (args.checkpoint or args.resume) and (args.geometry or args.format != 'csv'):
+        parser.error('--checkpoint and --resume need csv output without --geometry')
+    if ((osm_io.is_compressed(args.osm_file) or osm_io.is_pbf(args.osm_file)) and
+            (args.workers > 1 or args.checkpoint or args.resume)):
+        parser.error('compressed and PBF input cannot be combined with --workers, --checkpoint or --resume')
+    metrics = None
+    if args.progress or args.metrics:
+        metrics = instrument.Metrics('import', progress=args.progress)
+        if args.metrics:
+            # Also written when the run fails or is interrupted
+            atexit.register(metrics.dump, args.metrics)
+    with instrument.profiled(args.profile, args.sample_profile):
+        process_map(args.osm_file, validate=args.validate, workers=args.workers,
+                    output_format=args.format, row_group_size=args.row_group_size,
+                    validate_fraction=args.validate_fraction, fast=args.fast, geometry=args.geometry,
+                    node_index_kind=args.node_index, node_index_path=args.node_index_path,
+                    checkpoint=args.checkpoint, resume=args.resume, parser=args.parser, metrics=metrics,
+                    pipelined=args.pipeline)
+    if metrics is not None:
+        if args.workers <= 1:
+            # The memos of a parallel run live and die in the workers
+            stats = CLEANER.stats()
+            for counter in ('hits', 'misses', 'evictions'):
+                metrics.count('memo_' + counter, stats[counter])
+            print(CLEANER.report())
+        print(metrics.progress_line())
+        print(metrics.report())
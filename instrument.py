@@ -0,0 +1,298 @@
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import signal
+except ImportError:
+    signal = None
+
+"""
+Instrumentation of the import (ing_import.py) and load (create_db.py) paths.
+
+A Metrics object collects cumulative time per stage (parse, shape, validate,
+write, read_csv, to_sql, ...) and counters (elements, rows, bytes read).  With
+progress on, tick() prints a progress line at most every progress_seconds, with
+an ETA when the input size is known: the bytes read so far are counted by a
+CountingReader around the input file.  snapshot() gives all of it as a dict and
+dump() writes it as JSON, e.g. from atexit so interrupted runs leave their
+metrics too.
+
+profiled() wraps the hot loop in cProfile, and/or a sampling profiler that
+records the Python stack on a CPU timer and writes collapsed stacks (one
+'frame;frame;frame count' line per stack, the flame graph input format).
+"""
+
+PROGRESS_SECONDS = 5.0
+"""Minimum seconds between two progress lines."""
+
+SAMPLE_INTERVAL = 0.005
+"""Seconds of CPU time between two stack samples."""
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unknown."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+def traced_peak_mb(function, *args, **kwargs):
+    """Call function with tracemalloc on.
+    Returns:
+        (result, peak MB of the Python memory allocated during the call)
+    Unlike the peak RSS, the peak counts only the call's own allocations, so
+    it tells apart paths whose footprints differ by far less than the
+    interpreter's.  Tracing slows the call down, so time it separately.
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, peak / (1024.0 * 1024.0)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class CountingReader(object):
+    """File-like wrapper adding the bytes read from source to a Metrics counter."""
+
+    def __init__(self, source, metrics, counter='bytes_read'):
+        self._source = source
+        self._metrics = metrics
+        self._counter = counter
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        self._metrics.counters[self._counter] += len(data)
+        return data
+
+    def read1(self, size=-1):
+        data = self._source.read1(size)
+        self._metrics.counters[self._counter] += len(data)
+        return data
+
+    def readinto(self, buffer):
+        size = self._source.readinto(buffer)
+        self._metrics.counters[self._counter] += size or 0
+        return size
+
+    def readline(self, size=-1):
+        line = self._source.readline(size)
+        self._metrics.counters[self._counter] += len(line)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, self._source.read(0))
+
+    def close(self):
+        self._source.close()
+
+    def __getattr__(self, name):
+        return getattr(self._source, name)
+
+
+class Metrics(object):
+    """Stage timers, counters and progress reporting of one run.
+    Args:
+        name (str): name of the run, shown in the progress line.
+        total_bytes (int): input size, for the percentage and ETA; None if unknown.
+        progress (bool): if True, tick() prints progress lines.
+        progress_seconds (float): minimum seconds between progress lines.
+        stream (obj): where progress lines go; sys.stderr by default.
+    """
+
+    def __init__(self, name='import', total_bytes=None, progress=False, progress_seconds=PROGRESS_SECONDS,
+                 stream=None):
+        self.name = name
+        self.total_bytes = total_bytes
+        self.progress = progress
+        self.progress_seconds = progress_seconds
+        self.stream = stream
+        self.timers = collections.defaultdict(float)
+        self.counters = collections.defaultdict(int)
+        self.began = clock()
+        self.last_progress = self.began
+
+    def add(self, stage, seconds):
+        """Add seconds to the cumulative time of a stage."""
+        self.timers[stage] += seconds
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Time a block of code as part of a stage."""
+        began = clock()
+        try:
+            yield
+        finally:
+            self.timers[stage] += clock() - began
+
+    def timed(self, stage, iterable):
+        """Yield the items of iterable, timing each next() as part of a stage."""
+        iterator = iter(iterable)
+        while True:
+            began = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.timers[stage] += clock() - began
+                return
+            self.timers[stage] += clock() - began
+            yield item
+
+    def merge(self, timers=None, counters=None):
+        """Add the timers and counters of another run, e.g. a worker process."""
+        for stage, seconds in (timers or {}).items():
+            self.timers[stage] += seconds
+        for counter, amount in (counters or {}).items():
+            self.counters[counter] += amount
+
+    def tick(self):
+        """Print a progress line if one is due.  Cheap enough to call per element."""
+        if self.progress:
+            now = clock()
+            if now - self.last_progress >= self.progress_seconds:
+                self.last_progress = now
+                self.print_progress(now)
+
+    def progress_line(self, now=None):
+        elapsed = (now or clock()) - self.began
+        parts = ['[{0}] {1}'.format(self.name, format_duration(elapsed))]
+        done = self.counters.get('bytes_read', 0)
+        megabytes = done / (1024.0 * 1024.0)
+        if self.total_bytes:
+            fraction = min(done / float(self.total_bytes), 1.0)
+            parts.append('{0:.1%} of {1:.1f} MB'.format(fraction, self.total_bytes / (1024.0 * 1024.0)))
+        elif done:
+            parts.append('{0:.1f} MB'.format(megabytes))
+        for counter in ('elements', 'rows'):
+            if counter in self.counters:
+                amount = self.counters[counter]
+                parts.append('{0} {1} ({2:.0f}/s)'.format(amount, counter, amount / elapsed if elapsed else 0))
+        if self.total_bytes and done:
+            parts.append('ETA {0}'.format(format_duration(elapsed * (self.total_bytes - done) / float(done))))
+        return ', '.join(parts)
+
+    def print_progress(self, now=None):
+        stream = self.stream or sys.stderr
+        stream.write(self.progress_line(now) + '\n')
+        stream.flush()
+
+    def snapshot(self):
+        """The metrics as a JSON serializable dict."""
+        elapsed = clock() - self.began
+        counters = dict(self.counters)
+        rates = {}
+        for stage, seconds in self.timers.items():
+            if seconds:
+                rates[stage] = dict(('{0}_per_s'.format(counter), counters[counter] / seconds)
+                                    for counter in ('elements', 'rows') if counter in counters)
+        return {'name': self.name, 'elapsed': elapsed, 'total_bytes': self.total_bytes,
+                'timers': dict(self.timers), 'counters': counters, 'rates': rates,
+                'peak_rss_mb': peak_rss_mb(), 'pid': os.getpid()}
+
+    def dump(self, path):
+        """Write snapshot() to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+    def report(self):
+        """One line per stage: cumulative seconds and share of the elapsed time."""
+        elapsed = clock() - self.began
+        lines = []
+        for stage, seconds in sorted(self.timers.items(), key=lambda item: -item[1]):
+            lines.append('{0:<10}{1:>9.2f}s {2:>6.1%}'.format(stage, seconds, seconds / elapsed if elapsed else 0))
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def stage(metrics, name):
+    """metrics.stage(name), or no timing at all when metrics is None."""
+    if metrics is None:
+        yield
+    else:
+        with metrics.stage(name):
+            yield
+
+
+class StackSampler(object):
+    """Sampling profiler counting the Python stacks seen on a CPU time interval timer.
+    Unix only; samples the main thread.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        if signal is None or not hasattr(signal, 'setitimer'):
+            raise ValueError('The sampling profiler needs signal.setitimer (Unix)')
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+
+    def dump(self, path):
+        """Write the collapsed stacks, most frequent first."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{0} {1}\n'.format(stack, count))
+
+
+@contextlib.contextmanager
+def profiled(profile_path=None, sample_path=None, sample_interval=SAMPLE_INTERVAL):
+    """Profile a block of code.
+    Args:
+        profile_path (str): if given, cProfile statistics are written there
+            (read them with pstats or snakeviz).
+        sample_path (str): if given, the collapsed stacks of a StackSampler are
+            written there.
+        sample_interval (float): CPU seconds between two stack samples.
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    sampler = StackSampler(sample_interval) if sample_path else None
+    if sampler is not None:
+        sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if sampler is not None:
+            sampler.stop()
+            sampler.dump(sample_path)
@@ -0,0 +1,257 @@
+# Node id -> coordinate index for assembling way geometries
+# File = node_index.py
+
+import array
+import binascii
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+"""
+Compact node id -> (lat, lon) indexes used to resolve ways into geometries in
+the same pass that reads the nodes.
+
+Coordinates are kept as 32 bit integers in units of 1e-7 degrees, the
+precision OSM stores them in, so every node costs 8 bytes of coordinates.
+
+- DenseNodeIndex: a memory-mapped file addressed by node id.  Best for planet
+  style extracts where ids are dense; the file grows (sparsely) with the
+  largest id and the operating system pages it to disk as needed.
+- SparseNodeIndex: sorted id and coordinate arrays, searched with bisect.
+  Best for city extracts whose ids are spread thinly over a huge range.  Once
+  more than max_memory_nodes are held in memory the arrays are spilled to a
+  memory-mapped segment file, so the index scales past RAM.
+"""
+
+SCALE = 10000000
+"""Coordinate units per degree."""
+
+# Stored coordinates are offset so that 0 means "no node"
+LAT_OFFSET = 900000001
+LON_OFFSET = 1800000001
+
+MAX_MEMORY_NODES = 20000000
+"""Nodes a SparseNodeIndex keeps in memory before spilling to disk."""
+
+ENTRY = struct.Struct('<II')
+# Spilled segments are written from arrays, so they use native byte order
+NODE_ID = struct.Struct('=q')
+COORDS = struct.Struct('=ii')
+
+
+def to_fixed(value):
+    """Convert a coordinate string or float to 1e-7 degree units."""
+    return int(round(float(value) * SCALE))
+
+
+class DenseNodeIndex(object):
+    """Memory-mapped array of coordinates addressed by node id.
+    Args:
+        path (str): file backing the array; a temporary file if None.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='node_index_', suffix='.bin')
+            os.close(fd)
+            self._remove = True
+        else:
+            self._remove = False
+        self.path = path
+        self._file = open(path, 'w+b')
+        self._size = 0
+        self._map = None
+        self._grow(ENTRY.size * 1024 * 1024)
+
+    def _grow(self, size):
+        if self._map is not None:
+            self._map.close()
+        self._file.truncate(size)
+        self._size = size
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def add(self, node_id, lat, lon):
+        offset = int(node_id) * ENTRY.size
+        if offset < 0:
+            raise ValueError('A dense node index needs non-negative node ids')
+        if offset + ENTRY.size > self._size:
+            self._grow(max(offset + ENTRY.size, self._size * 2))
+        ENTRY.pack_into(self._map, offset, to_fixed(lat) + LAT_OFFSET, to_fixed(lon) + LON_OFFSET)
+
+    def get(self, node_id):
+        """Return (lat, lon) of a node, or None if it is not in the index."""
+        offset = int(node_id) * ENTRY.size
+        if offset < 0 or offset + ENTRY.size > self._size:
+            return None
+        lat, lon = ENTRY.unpack_from(self._map, offset)
+        if lat == 0:
+            return None
+        return (lat - LAT_OFFSET) / float(SCALE), (lon - LON_OFFSET) / float(SCALE)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+        if self._remove:
+            os.remove(self.path)
+
+
+def reordered(values, order):
+    """A copy of an array.array with its items in the order of a numpy index array."""
+    result = array.array(values.typecode)
+    result.frombytes(np.frombuffer(values, dtype=values.typecode)[order].tobytes())
+    return result
+
+
+class SparseNodeIndex(object):
+    """Sorted arrays of node ids and coordinates, spilled to disk when large.
+    Args:
+        spill_dir (str): directory for spilled segment files; the system
+            temporary directory if None.
+        max_memory_nodes (int): nodes kept in memory before spilling.
+    """
+
+    def __init__(self, spill_dir=None, max_memory_nodes=MAX_MEMORY_NODES):
+        self.spill_dir = spill_dir
+        self.max_memory_nodes = max_memory_nodes
+        self._segments = []  # (first id, last id, count, file, mmap)
+        self._reset()
+
+    def _reset(self):
+        self._ids = array.array('q')
+        self._lats = array.array('i')
+        self._lons = array.array('i')
+        self._sorted = True
+
+    def add(self, node_id, lat, lon):
+        node_id = int(node_id)
+        if self._ids and node_id < self._ids[-1]:
+            self._sorted = False
+        self._ids.append(node_id)
+        self._lats.append(to_fixed(lat))
+        self._lons.append(to_fixed(lon))
+        if len(self._ids) >= self.max_memory_nodes:
+            self._spill()
+
+    def _sort(self):
+        # numpy views of the arrays: the order costs 8 bytes per node, not a Python int
+        order = np.argsort(np.frombuffer(self._ids, dtype=self._ids.typecode), kind='stable')
+        self._ids, self._lats, self._lons = [reordered(values, order)
+                                             for values in (self._ids, self._lats, self._lons)]
+        self._sorted = True
+
+    def _spill(self):
+        """Write the in-memory arrays to a memory-mapped segment file."""
+        if not self._sorted:
+            self._sort()
+        count = len(self._ids)
+        f = tempfile.TemporaryFile(prefix='node_index_', dir=self.spill_dir)
+        f.write(self._ids.tobytes())
+        # lat, lon pairs
+        f.write(np.column_stack((np.frombuffer(self._lats, dtype=self._lats.typecode),
+                                 np.frombuffer(self._lons, dtype=self._lons.typecode))).tobytes())
+        f.flush()
+        segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._segments.append((self._ids[0], self._ids[-1], count, f, segment_map))
+        self._reset()
+
+    def _get_segment(self, node_id, segment):
+        first, last, count, _, segment_map = segment
+        if node_id < first or node_id > last:
+            return None
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if NODE_ID.unpack_from(segment_map, mid * NODE_ID.size)[0] < node_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < count and NODE_ID.unpack_from(segment_map, lo * NODE_ID.size)[0] == node_id:
+            return COORDS.unpack_from(segment_map, count * NODE_ID.size + lo * COORDS.size)
+        return None
+
+    def get(self, node_id):
+        """Return (lat, lon) of a node, or None if it is not in the index."""
+        node_id = int(node_id)
+        if not self._sorted:
+            self._sort()
+        fixed = None
+        i = bisect.bisect_left(self._ids, node_id)
+        if i < len(self._ids) and self._ids[i] == node_id:
+            fixed = self._lats[i], self._lons[i]
+        else:
+            for segment in self._segments:
+                fixed = self._get_segment(node_id, segment)
+                if fixed is not None:
+                    break
+        if fixed is None:
+            return None
+        return fixed[0] / float(SCALE), fixed[1] / float(SCALE)
+
+    def close(self):
+        for _, _, _, f, segment_map in self._segments:
+            segment_map.close()
+            f.close()
+        self._segments = []
+        self._reset()
+
+
+def open_index(kind='sparse', path=None, max_memory_nodes=MAX_MEMORY_NODES):
+    """Create a node index.
+    Args:
+        kind (str): 'dense' or 'sparse'
+        path (str): backing file of a dense index, or spill directory of a
+            sparse index; temporary if None.
+        max_memory_nodes (int): nodes a sparse index keeps in memory.
+    """
+    if kind == 'dense':
+        return DenseNodeIndex(path)
+    if kind == 'sparse':
+        return SparseNodeIndex(path, max_memory_nodes)
+    raise ValueError('Unknown node index kind: {0}'.format(kind))
+
+
+# ================================================== #
+#               Way geometries                       #
+# ================================================== #
+WAYS_GEOMETRY_FIELDS = ['id', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'missing_nodes', 'geometry']
+
+
+def to_wkb(coords):
+    """Encode (lat, lon) pairs as hex WKB: a LineString, or a Point if there is one pair."""
+    if len(coords) == 1:
+        lat, lon = coords[0]
+        data = struct.pack('<BIdd', 1, 1, lon, lat)
+    else:
+        data = struct.pack('<BII', 1, 2, len(coords))
+        data += b''.join(struct.pack('<dd', lon, lat) for lat, lon in coords)
+    return binascii.hexlify(data).decode('ascii')
+
+
+def way_geometry(way_id, node_ids, index):
+    """Resolve a way's nodes into a geometry row.
+    Args:
+        way_id (str): the way id attribute value.
+        node_ids (list): the ref attribute value of each nd tag, in order.
+        index (obj): node index holding the coordinates of the nodes seen so far.
+    Returns:
+        dict with WAYS_GEOMETRY_FIELDS, or None if none of the nodes are known.
+        Nodes outside the extract are skipped and counted in 'missing_nodes'.
+    """
+    coords = []
+    for node_id in node_ids:
+        coord = index.get(node_id)
+        if coord is not None:
+            coords.append(coord)
+    if not coords:
+        return None
+    lats = [lat for lat, _ in coords]
+    lons = [lon for _, lon in coords]
+    return {'id': way_id,
+            'min_lat': min(lats), 'min_lon': min(lons),
+            'max_lat': max(lats), 'max_lon': max(lons),
+            'missing_nodes': len(node_ids) - len(coords),
+            'geometry': to_wkb(coords)}
@@ -0,0 +1,289 @@
+import xml.etree.cElementTree as ET
+import argparse
+import sqlite3
+import time
+
+import activity
+import create_db
+import node_index
+import osm_io
+import summary
+from ing_import import ELEMENT_TAGS, TABLES, shape_element
+from osm_to_db import DB_TABLES, UNIFIED_TAGS, insert_sql, row_converters, to_row
+
+"""
+Apply an osmChange (.osc) file to an existing database instead of rebuilding it.
+
+The file's create, modify and delete blocks are streamed in order.  Created and
+modified elements go through the same shape_element() cleaning as a full import
+and replace the element's row, its tags (also in the unified tags table) and its
+way nodes or relation members.  Deleted elements are removed with their child
+rows.  The R-tree tables, and ways_geometry if it is filled, are kept in step:
+the boxes of changed ways, and of ways using moved nodes, are recomputed before
+each commit, and so are the summary tables: the old rows of a modified or
+deleted element are subtracted and its new rows added, and the activity of the
+users and changesets of its old version is recomputed (see activity.py).
+Changes are committed every commit_elements elements.
+"""
+
+ACTIONS = ('create', 'modify', 'delete')
+
+COMMIT_ELEMENTS = 10000
+"""Changed elements applied per transaction."""
+
+# SQLite's default limit on the number of ? parameters is 999
+MAX_PARAMS = 900
+
+# Element tag -> shaped keys of its child rows
+CHILD_KEYS = {'node': ['node_tags'],
+              'way': ['way_nodes', 'way_tags'],
+              'relation': ['relation_members', 'relation_tags']}
+
+WAY_BOX_SQL = '''
+SELECT ways_nodes.id, MIN(lat), MAX(lat), MIN(lon), MAX(lon)
+FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id
+WHERE ways_nodes.id IN ({0})
+GROUP BY ways_nodes.id
+'''
+
+
+def iter_changes(osc_file):
+    """Yield (action, element) for each node, way and relation of an osmChange file.
+    The file may be gzip or bzip2 compressed, like the published .osc.gz diffs.
+    Elements are cleared and removed from their action block once they have
+    been applied, so memory does not grow with the size of a block.
+    """
+    source = osm_io.open_osm(osc_file)
+    try:
+        action = None
+        block = None
+        depth = 0
+        context = ET.iterparse(source, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    block = elem
+                    if elem.tag in ACTIONS:
+                        action = elem.tag
+                continue
+            depth -= 1
+            if depth == 1:
+                if action is not None and elem.tag in ELEMENT_TAGS:
+                    yield action, elem
+                elem.clear()
+                # Each child is removed as it ends, so the block only ever holds this one
+                block.remove(elem)
+            elif depth == 0:
+                action = None
+                block = None
+                root.clear()
+    finally:
+        if source is not osc_file:
+            source.close()
+
+
+class NodeTable(object):
+    """Node coordinate lookups from the nodes table, for node_index.way_geometry().
+    Coordinates are rounded to the node index precision, so geometries match a
+    full import.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self, node_id):
+        row = self.conn.execute('SELECT lat, lon FROM nodes WHERE id = ?', (int(node_id),)).fetchone()
+        if row is None:
+            return None
+        return tuple(node_index.to_fixed(value) / float(node_index.SCALE) for value in row)
+
+
+def in_chunks(ids):
+    """Split ids into lists small enough for an IN (...) clause."""
+    ids = list(ids)
+    for i in range(0, len(ids), MAX_PARAMS):
+        yield ids[i:i + MAX_PARAMS]
+
+
+class Updater(object):
+    """Apply changes to an open database.
+    Args:
+        conn (obj): sqlite3 connection to a database made by create_db or osm_to_db.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        tables = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+        self.rtree = 'nodes_rtree' in tables and 'ways_rtree' in tables
+        self.geometry = ('ways_geometry' in tables and
+                         conn.execute('SELECT 1 FROM ways_geometry LIMIT 1').fetchone() is not None)
+
+        self.fields = {}
+        self.converters = {}
+        self.inserts = {}
+        for key, _, fields in TABLES:
+            self.fields[key] = fields
+            self.converters[key] = row_converters(key, fields)
+            self.inserts[key] = insert_sql(DB_TABLES[key], fields)
+            if key in ELEMENT_TAGS:
+                self.inserts[key] = self.inserts[key].replace('INSERT', 'INSERT OR REPLACE', 1)
+        self.tags_insert = insert_sql('tags', ['id', 'key', 'value', 'type', 'element_type'])
+        self.summaries = summary.has_summaries(conn)
+        self.delta = summary.Delta()
+        self.activity = activity.has_activity(conn)
+        self.stale_uids = set()
+        self.stale_changesets = set()
+        self.moved_nodes = set()
+        self.changed_ways = set()
+        self.counts = dict(((action, tag), 0) for action in ACTIONS for tag in ELEMENT_TAGS)
+
+    def subtract(self, tag, element_id):
+        """Take the rows an element has now out of the summaries."""
+        table = DB_TABLES[tag]
+        self.delta.add_rows(table, ('uid', 'user'), self.conn.execute(
+            'SELECT uid, user FROM {0} WHERE id = ?'.format(table), (element_id,)).fetchall(), -1)
+        tags_table = DB_TABLES[tag + '_tags']
+        self.delta.add_rows(tags_table, ('type', 'key', 'value'), self.conn.execute(
+            'SELECT type, key, value FROM {0} WHERE id = ?'.format(tags_table), (element_id,)).fetchall(), -1)
+
+    def delete_children(self, tag, element_id):
+        if self.summaries:
+            self.subtract(tag, element_id)
+        if self.activity:
+            stale = activity.forget(self.conn, tag, element_id)
+            if stale is not None:
+                self.stale_uids.add(stale[0])
+                self.stale_changesets.add(stale[1])
+        for key in CHILD_KEYS[tag]:
+            self.conn.execute('DELETE FROM {0} WHERE id = ?'.format(DB_TABLES[key]), (element_id,))
+        self.conn.execute('DELETE FROM tags WHERE element_type = ? AND id = ?', (tag, element_id))
+
+    def upsert(self, element):
+        """Shape an element and replace its rows.  Returns False if it did not shape."""
+        el = shape_element(element)
+        if not el:
+            return False
+        tag = element.tag
+        row = to_row(el[tag], self.fields[tag], self.converters[tag])
+        element_id = row[0]
+        self.delete_children(tag, element_id)
+        self.conn.execute(self.inserts[tag], row)
+        if self.summaries:
+            self.delta.add_rows(DB_TABLES[tag], self.fields[tag], [row])
+        if self.activity:
+            activity.stage_rows(self.conn, DB_TABLES[tag], self.fields[tag], [row])
+        for key in CHILD_KEYS[tag]:
+            rows = [to_row(r, self.fields[key], self.converters[key]) for r in el[key]]
+            self.conn.executemany(self.inserts[key], rows)
+            if self.summaries:
+                self.delta.add_rows(DB_TABLES[key], self.fields[key], rows)
+            if key in UNIFIED_TAGS:
+                self.conn.executemany(self.tags_insert, [r + (UNIFIED_TAGS[key],) for r in rows])
+        if tag == 'node':
+            if self.rtree:
+                self.conn.execute('INSERT OR REPLACE INTO nodes_rtree VALUES (?, ?, ?, ?, ?)',
+                                  (element_id, row[1], row[1], row[2], row[2]))
+            self.moved_nodes.add(element_id)
+        elif tag == 'way':
+            self.changed_ways.add(element_id)
+        return True
+
+    def delete(self, element):
+        tag = element.tag
+        element_id = int(element.attrib['id'])
+        self.delete_children(tag, element_id)
+        self.conn.execute('DELETE FROM {0} WHERE id = ?'.format(DB_TABLES[tag]), (element_id,))
+        if tag == 'node':
+            if self.rtree:
+                self.conn.execute('DELETE FROM nodes_rtree WHERE id = ?', (element_id,))
+            self.moved_nodes.add(element_id)
+        elif tag == 'way':
+            self.changed_ways.add(element_id)
+
+    def apply(self, action, element):
+        if action == 'delete':
+            self.delete(element)
+        elif not self.upsert(element):
+            return
+        self.counts[(action, element.tag)] += 1
+
+    def refresh_ways(self):
+        """Recompute the boxes (and geometries) of changed ways and of ways using changed nodes."""
+        ways = set(self.changed_ways)
+        for chunk in in_chunks(self.moved_nodes):
+            ways.update(row[0] for row in self.conn.execute(
+                'SELECT DISTINCT id FROM ways_nodes WHERE node_id IN ({0})'.format(', '.join('?' * len(chunk))),
+                chunk))
+        self.moved_nodes = set()
+        self.changed_ways = set()
+        for chunk in in_chunks(ways):
+            params = ', '.join('?' * len(chunk))
+            if self.rtree:
+                self.conn.execute('DELETE FROM ways_rtree WHERE id IN ({0})'.format(params), chunk)
+                self.conn.execute('INSERT INTO ways_rtree ' + WAY_BOX_SQL.format(params), chunk)
+            if self.geometry:
+                self.conn.execute('DELETE FROM ways_geometry WHERE id IN ({0})'.format(params), chunk)
+        if self.geometry:
+            nodes = NodeTable(self.conn)
+            insert = insert_sql('ways_geometry', node_index.WAYS_GEOMETRY_FIELDS)
+            for way_id in ways:
+                node_ids = [row[0] for row in self.conn.execute(
+                    'SELECT node_id FROM ways_nodes WHERE id = ? ORDER BY position', (way_id,))]
+                row = node_index.way_geometry(way_id, node_ids, nodes)
+                if row is not None:
+                    self.conn.execute(insert, [row[field] for field in node_index.WAYS_GEOMETRY_FIELDS])
+
+    def commit(self):
+        self.refresh_ways()
+        self.delta.apply(self.conn)
+        if self.activity:
+            activity.merge(self.conn)
+            activity.recompute(self.conn, self.stale_uids, self.stale_changesets)
+            self.stale_uids = set()
+            self.stale_changesets = set()
+        self.conn.commit()
+
+
+def apply_osc(osc_file, db_file=create_db.DB_FILE, commit_elements=COMMIT_ELEMENTS):
+    """Apply an osmChange file to the database.
+    Args:
+        osc_file (obj): osmChange (XML) file.
+        db_file (str): SQLite database built by create_db.py or osm_to_db.py.
+        commit_elements (int): changed elements applied per transaction.
+    Returns:
+        counts (dict): (action, element tag) -> elements applied.
+    """
+    conn = sqlite3.connect(db_file)
+    updater = Updater(conn)
+    began = time.time()
+    pending = 0
+    try:
+        for action, element in iter_changes(osc_file):
+            updater.apply(action, element)
+            pending += 1
+            if pending >= commit_elements:
+                updater.commit()
+                pending = 0
+        updater.commit()
+    finally:
+        conn.close()
+
+    seconds = time.time() - began
+    for action in ACTIONS:
+        print('{0}: {1}'.format(action, ', '.join('{0} {1}s'.format(updater.counts[(action, tag)], tag)
+                                                  for tag in ELEMENT_TAGS)))
+    total = sum(updater.counts.values())
+    print('{0} changes in {1:.1f}s ({2:.0f} changes/s)'.format(total, seconds, total / seconds if seconds else 0))
+    return updater.counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply an osmChange (.osc) file to the SQLite database.')
+    parser.add_argument('osc_file', help='osmChange (XML) file')
+    parser.add_argument('--db', default=create_db.DB_FILE, help='SQLite database file')
+    parser.add_argument('--commit-elements', type=int, default=COMMIT_ELEMENTS,
+                        help='changed elements applied per transaction')
+    args = parser.parse_args()
+    apply_osc(args.osc_file, args.db, args.commit_elements)
@@ -0,0 +1,295 @@
+# Opening plain and compressed OSM files for streaming
+# File = osm_io.py
+
+import bz2
+import collections
+import gzip
+import multiprocessing
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+"""
+open_osm() opens an OSM file for ET.iterparse(), decompressing .gz and .bz2
+files on the fly so they never have to be unpacked to disk.  The format is
+recognised from the first bytes of the file, not its name.
+
+- gzip streams cannot be split, so they are decompressed on a background
+  thread that reads ahead of the parser (zlib releases the GIL while it works).
+- bzip2 files are made of independent blocks of up to 900 kB.  The blocks are
+  located by their 48 bit magic numbers, which are bit aligned, and each block
+  is rebuilt into a one block bzip2 stream that is decompressed in a worker
+  process.  At most 'window' blocks are in flight, and they are returned in
+  file order, so memory stays bounded and the parser sees the plain XML.  This
+  covers single stream files as well as the multi-stream files written by
+  pbzip2.  bz2 checks every block's CRC, so a mis-detected block fails loudly.
+"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+# A PBF file starts with the length of its first blob header, of type 'OSMHeader'
+PBF_MAGIC = b'\x0a\x09OSMHeader'
+
+BLOCK_MAGIC = 0x314159265359  # start of every bzip2 block
+EOS_MAGIC = 0x177245385090    # end of every bzip2 stream
+# A block size of 9 lets the decoder accept blocks written at any level
+STREAM_HEADER = 0x425a6839    # 'BZh9'
+
+SCAN_SIZE = 4 * 1024 * 1024
+"""Compressed bytes scanned for block boundaries at a time."""
+
+READ_AHEAD_SIZE = 1024 * 1024
+READ_AHEAD_DEPTH = 8
+"""Chunks of READ_AHEAD_SIZE bytes a ReadAheadReader decompresses ahead of the parser."""
+
+
+def compression(path):
+    """Return 'gzip', 'bzip2' or None for a plain file, from the file's magic bytes."""
+    with open(path, 'rb') as f:
+        head = f.read(3)
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(BZIP2_MAGIC):
+        return 'bzip2'
+    return None
+
+
+def is_compressed(osm_file):
+    """True if osm_file is a path to a gzip or bzip2 compressed file."""
+    return not hasattr(osm_file, 'read') and compression(osm_file) is not None
+
+
+def is_pbf(osm_file):
+    """True if osm_file is a path to an OSM PBF file (read with pbf_reader)."""
+    if hasattr(osm_file, 'read'):
+        return False
+    with open(osm_file, 'rb') as f:
+        head = f.read(4 + len(PBF_MAGIC))
+    return head[4:] == PBF_MAGIC
+
+
+def open_osm(osm_file, workers=None, read_ahead=False):
+    """Open an OSM file for streaming.
+    Args:
+        osm_file (obj): path of a plain, .gz or .bz2 OSM file; file-like objects
+            are returned unchanged.
+        workers (int): processes decompressing bzip2 blocks; defaults to the
+            number of CPUs, 1 decompresses on a background thread instead.
+        read_ahead (bool): if True, plain files and file-like objects are also
+            read on a background thread (a file-like object is then closed with
+            the reader).  Compressed files always are.
+    Returns:
+        file-like object with read() and close().
+    """
+    if hasattr(osm_file, 'read'):
+        return ReadAheadReader(osm_file) if read_ahead else osm_file
+    kind = compression(osm_file)
+    if kind == 'gzip':
+        return ReadAheadReader(gzip.open(osm_file, 'rb'))
+    if kind == 'bzip2':
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers > 1:
+            return ParallelBZ2Reader(osm_file, workers)
+        return ReadAheadReader(bz2.BZ2File(osm_file, 'rb'))
+    if read_ahead:
+        return ReadAheadReader(open(osm_file, 'rb'))
+    return open(osm_file, 'rb')
+
+
+class ReadAheadReader(object):
+    """Read a file-like object on a background thread, a few chunks ahead.
+    Args:
+        source (obj): file-like object to read, closed with the reader.
+        chunk_size (int): bytes per read of the source.
+        depth (int): chunks read ahead.
+    """
+
+    def __init__(self, source, chunk_size=READ_AHEAD_SIZE, depth=READ_AHEAD_DEPTH):
+        self._source = source
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(depth)
+        self._data = b''
+        self._offset = 0
+        self._eof = False
+        self._stop = False
+        self._thread = threading.Thread(target=self._read_ahead)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read_ahead(self):
+        try:
+            while not self._stop:
+                chunk = self._source.read(self._chunk_size)
+                self._queue.put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self._queue.put(e)
+
+    def read(self, size=-1):
+        parts = []
+        while size is None or size < 0 or size > 0:
+            if self._offset >= len(self._data):
+                if self._eof:
+                    break
+                chunk = self._queue.get()
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if not chunk:
+                    self._eof = True
+                    break
+                self._data, self._offset = chunk, 0
+            end = len(self._data) if size is None or size < 0 else self._offset + size
+            part = self._data[self._offset:end]
+            self._offset += len(part)
+            parts.append(part)
+            if size is not None and size >= 0:
+                size -= len(part)
+        return b''.join(parts)
+
+    def close(self):
+        self._stop = True
+        # Unblock the thread if it is waiting for room in the queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._source.close()
+
+
+# ================================================== #
+#               Parallel bzip2                       #
+# ================================================== #
+def bits(data, start, end):
+    """Bits [start, end) of a byte string, as an integer."""
+    first, last = start // 8, (end + 7) // 8
+    value = int.from_bytes(data[first:last], 'big') >> (last * 8 - end)
+    return value & ((1 << (end - start)) - 1)
+
+
+def magic_needles(magic):
+    """Byte strings to search for to find a 48 bit magic at each bit alignment.
+    Returns:
+        list of (needle, shift): a needle found at byte i means the magic may
+        start at bit 8 * i - 8 + shift, or 8 * i when shift is 0.
+    """
+    needles = []
+    for shift in range(8):
+        window = (magic << (8 - shift)).to_bytes(7, 'big')
+        # Only the bytes entirely covered by the magic are fixed
+        needles.append((window[:6] if shift == 0 else window[1:6], shift))
+    return needles
+
+
+NEEDLES = [(needle, shift, magic) for magic in (BLOCK_MAGIC, EOS_MAGIC)
+           for needle, shift in magic_needles(magic)]
+
+
+def find_markers(f, scan_size=SCAN_SIZE):
+    """Yield (bit offset, magic) of every block and end of stream marker, in file order."""
+    base = 0          # file offset of data[0]
+    data = b''
+    reported = -1     # bit offset of the last marker yielded
+    while True:
+        chunk = f.read(scan_size)
+        if not chunk:
+            break
+        data = data[-8:] + chunk
+        base_bits = (base - (len(data) - len(chunk))) * 8
+        found = []
+        for needle, shift, magic in NEEDLES:
+            i = data.find(needle)
+            while i != -1:
+                start = i * 8 if shift == 0 else (i - 1) * 8 + shift
+                if start >= 0 and start + 48 <= len(data) * 8 and bits(data, start, start + 48) == magic:
+                    found.append((base_bits + start, magic))
+                i = data.find(needle, i + 1)
+        for position, magic in sorted(found):
+            if position > reported:
+                reported = position
+                yield position, magic
+        base += len(chunk)
+
+
+def iter_blocks(f, scan_size=SCAN_SIZE):
+    """Yield the (start, end) bit range of each bzip2 block, from its magic to the next marker."""
+    start = None
+    for position, magic in find_markers(f, scan_size):
+        if start is not None:
+            yield start, position
+        start = position if magic == BLOCK_MAGIC else None
+
+
+def decompress_block(task):
+    """Decompress one bzip2 block (worker process).
+    Args:
+        task (tuple): (path, start bit, end bit) of the block.
+    Returns:
+        the decompressed bytes.
+    """
+    path, start, end = task
+    with open(path, 'rb') as f:
+        f.seek(start // 8)
+        data = f.read((end + 7) // 8 - start // 8)
+    count = end - start
+    block = bits(data, start % 8, start % 8 + count)
+    # The block CRC follows the block magic; a one block stream's CRC equals it
+    crc = (block >> (count - 80)) & 0xffffffff
+    stream = (((STREAM_HEADER << count | block) << 48 | EOS_MAGIC) << 32) | crc
+    length = 32 + count + 80
+    padding = -length % 8
+    return bz2.decompress((stream << padding).to_bytes((length + padding) // 8, 'big'))
+
+
+class ParallelBZ2Reader(object):
+    """Decompress the blocks of a bzip2 file in a process pool, in file order.
+    Args:
+        path (str): bzip2 compressed file.
+        workers (int): worker processes.
+        window (int): blocks in flight at once; defaults to 4 per worker.
+    """
+
+    def __init__(self, path, workers, window=None):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._blocks = iter_blocks(self._file)
+        self._pool = multiprocessing.Pool(workers)
+        self._window = window or workers * 4
+        self._pending = collections.deque()
+        self._data = b''
+        self._offset = 0
+        self._fill()
+
+    def _fill(self):
+        while len(self._pending) < self._window:
+            block = next(self._blocks, None)
+            if block is None:
+                break
+            self._pending.append(self._pool.apply_async(decompress_block, ((self.path,) + block,)))
+
+    def read(self, size=-1):
+        parts = []
+        while size is None or size < 0 or size > 0:
+            if self._offset >= len(self._data):
+                if not self._pending:
+                    break
+                self._data, self._offset = self._pending.popleft().get(), 0
+                self._fill()
+                continue
+            end = len(self._data) if size is None or size < 0 else self._offset + size
+            part = self._data[self._offset:end]
+            self._offset += len(part)
+            parts.append(part)
+            if size is not None and size >= 0:
+                size -= len(part)
+        return b''.join(parts)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._file.close()
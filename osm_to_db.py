@@ -0,0 +1,218 @@
+# Loading the map straight into the SQLite database
+# File = osm_to_db.py
+
+import argparse
+import sqlite3
+import time
+import unicodecsv
+from sqlalchemy import create_engine
+
+import activity
+import create_db
+import node_index
+import parsers
+import summary
+from ing_import import (ELEMENT_KEYS, ELEMENT_TAGS, OSM_FILE, SCHEMA, TABLES, WAYS_GEOMETRY_PATH,
+                        get_element, index_geometry, shape_element)
+
+"""
+Stream shaped elements from shape_element() straight into the SQLite database,
+skipping the csv files and pandas.  Rows are buffered per table, inserted with
+executemany() and committed in large transactions, each with the counts of
+its rows added to the summary and activity tables.  The csv files written by
+ing_import.process_map() can still be produced on the side for archiving.
+"""
+
+# Shaped element key -> database table
+DB_TABLES = {'node': 'nodes',
+             'node_tags': 'nodes_tags',
+             'way': 'ways',
+             'way_nodes': 'ways_nodes',
+             'way_tags': 'ways_tags',
+             'relation': 'relations',
+             'relation_members': 'relations_members',
+             'relation_tags': 'relations_tags'}
+
+# Tag key -> element_type of its rows in the unified tags table
+UNIFIED_TAGS = {'node_tags': 'node',
+                'way_tags': 'way',
+                'relation_tags': 'relation'}
+TAGS_FIELDS = ['id', 'key', 'value', 'type', 'element_type']
+
+BATCH_SIZE = 50000
+"""Rows buffered per table before they are inserted with executemany()."""
+
+COMMIT_ROWS = 1000000
+"""Rows inserted per transaction."""
+
+
+def insert_sql(table, fields):
+    """Build a parametrised INSERT statement for the table."""
+    return 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+        table, ', '.join('"{0}"'.format(field) for field in fields),
+        ', '.join('?' * len(fields)))
+
+
+def row_converters(key, fields, schema=SCHEMA):
+    """Look up the SCHEMA coercion of each field, so numbers are parsed by Python
+    the same way pandas parses them from the csv files, rather than by SQLite.
+    Args:
+        key (str): shaped element key, e.g. 'node' or 'way_tags'.
+        fields (list): field order of the table.
+        schema (dict): schema of desired data structure
+    Returns:
+        list of coercion functions (or None) in field order.
+    """
+    rules = schema[key]['schema']
+    if schema[key]['type'] == 'list':
+        rules = rules['schema']
+    return [rules[field].get('coerce') for field in fields]
+
+
+def to_row(row, fields, converters):
+    """Turn a shaped dict into a tuple in table column order."""
+    return tuple(row[field] if convert is None or row[field] is None else convert(row[field])
+                 for field, convert in zip(fields, converters))
+
+
+def load_osm(osm_file, db_file=create_db.DB_FILE, csv_output=False, bulk=False,
+             batch_size=BATCH_SIZE, commit_rows=COMMIT_ROWS, geometry=False,
+             node_index_kind='sparse', node_index_path=None, parser='etree'):
+    """Shape each element of the OSM file and insert it into the database.
+    Args:
+        osm_file (obj): OSM (XML) file to load.
+        db_file (str): SQLite database to load into.  Tables are created if missing.
+        csv_output (bool): if True, will also write the csv files.
+        bulk (bool): if True, will load with create_db.BULK_PRAGMAS and run ANALYZE.
+        batch_size (int): rows buffered per table before each executemany().
+        commit_rows (int): rows inserted per transaction.
+        geometry (bool): if True, will also fill the ways_geometry table.
+        node_index_kind (str): 'sparse' or 'dense' node coordinate index for geometry.
+        node_index_path (str): backing file or spill directory of the node index.
+        parser (str): XML parser backend, see parsers.PARSERS.
+    Returns:
+        counts (dict): rows inserted into each table.
+    """
+    create_db.metadata.create_all(create_engine('sqlite:///' + db_file))
+
+    statements = {}
+    fields = {}
+    converters = {}
+    for key, _, table_fields in TABLES:
+        statements[key] = insert_sql(DB_TABLES[key], table_fields)
+        fields[key] = table_fields
+        converters[key] = row_converters(key, table_fields)
+    statements['tags'] = insert_sql('tags', TAGS_FIELDS)
+    index = None
+    if geometry:
+        statements['ways_geometry'] = insert_sql('ways_geometry', node_index.WAYS_GEOMETRY_FIELDS)
+        index = node_index.open_index(node_index_kind, node_index_path)
+    buffers = dict((key, []) for key in statements)
+    counts = dict((key, 0) for key in statements)
+    delta = summary.Delta()
+
+    files = []
+    writers = {}
+    if csv_output:
+        for key, path, table_fields in TABLES:
+            files.append(open(path, 'wb'))
+            writers[key] = unicodecsv.DictWriter(files[-1], table_fields)
+            writers[key].writeheader()
+        if geometry:
+            files.append(open(WAYS_GEOMETRY_PATH, 'wb'))
+            writers['ways_geometry'] = unicodecsv.DictWriter(files[-1], node_index.WAYS_GEOMETRY_FIELDS)
+            writers['ways_geometry'].writeheader()
+
+    conn = sqlite3.connect(db_file)
+    if bulk:
+        create_db.set_pragmas(conn, create_db.BULK_PRAGMAS)
+    began = time.time()
+    elements = 0
+    uncommitted = 0
+    try:
+        for element in get_element(osm_file, tags=ELEMENT_TAGS, parser=parser):
+            el = shape_element(element)
+            if not el:
+                continue
+            elements += 1
+            for key, rows in el.items():
+                if key in ELEMENT_KEYS:
+                    rows = [rows]
+                if writers:
+                    writers[key].writerows(rows)
+                buf = buffers[key]
+                names, convert = fields[key], converters[key]
+                shaped = [to_row(row, names, convert) for row in rows]
+                buf.extend(shaped)
+                if key in UNIFIED_TAGS:
+                    buffers['tags'].extend(row + (UNIFIED_TAGS[key],) for row in shaped)
+            if index is not None:
+                row = index_geometry(element, index)
+                if row is not None:
+                    if writers:
+                        writers['ways_geometry'].writerow(row)
+                    row['id'] = int(row['id'])
+                    buffers['ways_geometry'].append(tuple(row[field] for field in node_index.WAYS_GEOMETRY_FIELDS))
+            for key, buf in buffers.items():
+                if len(buf) >= batch_size:
+                    conn.executemany(statements[key], buf)
+                    delta.add_rows(DB_TABLES.get(key), fields.get(key), buf)
+                    activity.stage_rows(conn, DB_TABLES.get(key), fields.get(key), buf)
+                    counts[key] += len(buf)
+                    uncommitted += len(buf)
+                    del buf[:]
+            if uncommitted >= commit_rows:
+                delta.apply(conn)
+                activity.merge(conn)
+                conn.commit()
+                uncommitted = 0
+
+        for key, buf in buffers.items():
+            if buf:
+                conn.executemany(statements[key], buf)
+                delta.add_rows(DB_TABLES.get(key), fields.get(key), buf)
+                activity.stage_rows(conn, DB_TABLES.get(key), fields.get(key), buf)
+                counts[key] += len(buf)
+        delta.apply(conn)
+        activity.merge(conn)
+        conn.commit()
+        create_db.create_indexes(conn)
+        create_db.create_rtree(conn)
+        if bulk:
+            conn.execute('ANALYZE')
+            conn.commit()
+    finally:
+        if bulk:
+            create_db.set_pragmas(conn, create_db.SAFE_PRAGMAS)
+        conn.close()
+        for f in files:
+            f.close()
+        if index is not None:
+            index.close()
+
+    seconds = time.time() - began
+    for key, _, _ in TABLES:
+        print('{0}: {1} rows'.format(DB_TABLES[key], counts[key]))
+    print('tags: {0} rows'.format(counts['tags']))
+    if geometry:
+        print('ways_geometry: {0} rows'.format(counts['ways_geometry']))
+    print('{0} elements in {1:.1f}s ({2:.0f} elements/s)'.format(
+        elements, seconds, elements / seconds if seconds else 0))
+    return dict((DB_TABLES.get(key, key), count) for key, count in counts.items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load an OSM XML file into the SQLite database.')
+    parser.add_argument('osm_file', nargs='?', default=OSM_FILE, help='OSM (XML) file to load')
+    parser.add_argument('--db', default=create_db.DB_FILE, help='SQLite database file')
+    parser.add_argument('--csv', action='store_true', help='also write the csv files for archiving')
+    parser.add_argument('--bulk', action='store_true', help='load with the create_db bulk-load settings')
+    parser.add_argument('--geometry', action='store_true', help='also fill the ways_geometry table')
+    parser.add_argument('--node-index', choices=['sparse', 'dense'], default='sparse',
+                        help='node coordinate index used by --geometry')
+    parser.add_argument('--node-index-path', help='backing file (dense) or spill directory (sparse)')
+    parser.add_argument('--parser', choices=parsers.PARSERS, default='etree', help='XML parser backend')
+    args = parser.parse_args()
+    load_osm(args.osm_file, db_file=args.db, csv_output=args.csv, bulk=args.bulk,
+             geometry=args.geometry, node_index_kind=args.node_index,
+             node_index_path=args.node_index_path, parser=args.parser)
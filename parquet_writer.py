@@ -0,0 +1,100 @@
+# Writing the shaped tables as typed columnar (Parquet) files
+# File = parquet_writer.py
+
+import calendar
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+"""
+Typed Parquet output for ing_import.process_map(output_format='parquet').
+Ids are int64, coordinates float64, timestamps are parsed to UTC seconds, and
+the heavily repeated user, key, type and role strings are dictionary encoded, so
+downstream analysis can read only the columns it needs without re-parsing text.
+
+pyarrow is only needed when Parquet output is requested.
+"""
+
+ROW_GROUP_SIZE = 500000
+"""Rows buffered per table before they are written as one row group."""
+
+DICT_STRING = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp('s', tz='UTC')
+
+# Arrow type of each field, by shaped element key
+ARROW_TYPES = {
+    'node': {'id': pa.int64(), 'lat': pa.float64(), 'lon': pa.float64(), 'user': DICT_STRING,
+             'uid': pa.int64(), 'version': pa.int64(), 'changeset': pa.int64(), 'timestamp': TIMESTAMP},
+    'node_tags': {'id': pa.int64(), 'key': DICT_STRING, 'value': pa.string(), 'type': DICT_STRING},
+    'way': {'id': pa.int64(), 'user': DICT_STRING, 'uid': pa.int64(), 'version': pa.int64(),
+            'changeset': pa.int64(), 'timestamp': TIMESTAMP},
+    'way_nodes': {'id': pa.int64(), 'node_id': pa.int64(), 'position': pa.int32()},
+    'way_tags': {'id': pa.int64(), 'key': DICT_STRING, 'value': pa.string(), 'type': DICT_STRING},
+    'relation': {'id': pa.int64(), 'user': DICT_STRING, 'uid': pa.int64(), 'version': pa.int64(),
+                 'changeset': pa.int64(), 'timestamp': TIMESTAMP},
+    'relation_members': {'id': pa.int64(), 'member_id': pa.int64(), 'member_type': DICT_STRING,
+                         'role': DICT_STRING, 'position': pa.int32()},
+    'relation_tags': {'id': pa.int64(), 'key': DICT_STRING, 'value': pa.string(), 'type': DICT_STRING},
+}
+
+
+def parse_timestamp(value):
+    """Convert an OSM timestamp such as '2010-07-22T16:16:51Z' to epoch seconds."""
+    return calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19])))
+
+
+def to_array(values, arrow_type):
+    """Build an Arrow array of the given type from shaped (string) values."""
+    if arrow_type == TIMESTAMP:
+        return pa.array([None if v is None else parse_timestamp(v) for v in values], pa.int64()).cast(TIMESTAMP)
+    if arrow_type == DICT_STRING:
+        return pa.array(values, pa.string()).dictionary_encode()
+    if pa.types.is_integer(arrow_type):
+        return pa.array([None if v is None else int(v) for v in values], arrow_type)
+    if pa.types.is_floating(arrow_type):
+        return pa.array([None if v is None else float(v) for v in values], arrow_type)
+    return pa.array(values, arrow_type)
+
+
+class ParquetTableWriter(object):
+    """Write shaped rows of one table to a Parquet file, one row group at a time.
+    Offers writerow()/writerows() like unicodecsv.DictWriter; rows may be dicts
+    or tuples in field order.
+    Args:
+        path (str): Parquet file to write.
+        key (str): shaped element key of the table, e.g. 'node' or 'way_tags'.
+        fields (list): field order of the table.
+        row_group_size (int): rows per row group.
+    """
+
+    def __init__(self, path, key, fields, row_group_size=ROW_GROUP_SIZE):
+        self.fields = fields
+        self.types = [ARROW_TYPES[key][field] for field in fields]
+        self.schema = pa.schema(list(zip(fields, self.types)))
+        self.row_group_size = row_group_size
+        self.columns = [[] for _ in fields]
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def writerow(self, row):
+        if not isinstance(row, tuple):
+            row = [row[field] for field in self.fields]
+        for value, column in zip(row, self.columns):
+            column.append(value)
+        if len(self.columns[0]) >= self.row_group_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if not self.columns[0]:
+            return
+        arrays = [to_array(column, arrow_type) for column, arrow_type in zip(self.columns, self.types)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = [[] for _ in self.fields]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
@@ -0,0 +1,118 @@
+# Selectable XML parser backends for streaming OSM elements
+# File = parsers.py
+
+import xml.etree.cElementTree as ET
+from xml.parsers import expat
+
+"""
+Streaming parsers yielding the top level elements of an OSM XML file.  All
+backends give elements shape_element() accepts (attrib, iteration over child
+tag/nd/member elements), so they can be swapped freely:
+
+- 'etree': ET.iterparse() with start and end events, clearing the root after
+  each element.  The reference backend.
+- 'lxml': lxml's iterparse with tag= filtering, so only the end events of the
+  wanted elements reach Python; earlier siblings are deleted as it goes.
+  Needs lxml.
+- 'expat': a pyexpat handler that builds each element directly from the start
+  tags, without the event queue.  Repeated attribute values (users, tag keys,
+  member types and roles, versions) are interned, so the elements of a large
+  file share one string object per distinct value.
+"""
+
+PARSERS = ('etree', 'lxml', 'expat')
+
+# Attributes whose values repeat heavily and are interned by the expat backend
+INTERNED_ATTRIBUTES = frozenset(['user', 'uid', 'version', 'k', 'type', 'role'])
+
+READ_SIZE = 64 * 1024
+
+
+def iter_etree(source, tags):
+    context = ET.iterparse(source, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            yield elem
+            root.clear()
+
+
+def iter_lxml(source, tags):
+    # lxml is only needed when this backend is chosen
+    from lxml import etree
+    for _, elem in etree.iterparse(source, events=('end',), tag=tuple(tags)):
+        yield elem
+        # Drop the element, and any skipped siblings before it, from the tree
+        elem.clear()
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+class ExpatBuilder(object):
+    """pyexpat handlers building the wanted top level elements and their children.
+    Args:
+        tags (iterable): top level element types to build.
+    """
+
+    def __init__(self, tags):
+        self.tags = frozenset(tags)
+        self.depth = 0
+        self.current = None
+        self.done = []
+        self.strings = {}
+
+    def intern(self, attrs):
+        strings = self.strings
+        for name, value in attrs.items():
+            if name in INTERNED_ATTRIBUTES:
+                attrs[name] = strings.setdefault(value, value)
+        return attrs
+
+    def start(self, name, attrs):
+        self.depth += 1
+        if self.depth == 2:
+            self.current = ET.Element(name, self.intern(attrs)) if name in self.tags else None
+        elif self.depth == 3 and self.current is not None:
+            ET.SubElement(self.current, name, self.intern(attrs))
+
+    def end(self, name):
+        if self.depth == 2 and self.current is not None:
+            self.done.append(self.current)
+            self.current = None
+        self.depth -= 1
+
+
+def iter_expat(source, tags, read_size=READ_SIZE):
+    builder = ExpatBuilder(tags)
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = builder.end
+    while True:
+        data = source.read(read_size)
+        parser.Parse(data, not data)
+        if builder.done:
+            done, builder.done = builder.done, []
+            for elem in done:
+                yield elem
+        if not data:
+            break
+
+
+BACKENDS = {'etree': iter_etree,
+            'lxml': iter_lxml,
+            'expat': iter_expat}
+
+
+def iter_elements(source, tags=('node', 'way', 'relation'), parser='etree'):
+    """Yield the top level elements of an OSM XML file.
+    Args:
+        source (obj): OSM (XML) file opened in binary mode, or any file-like object.
+        tags (tuple): element types to yield.
+        parser (str): backend, one of PARSERS.
+    Yields:
+        elem (obj): element with attrib and child elements, as from ET.iterparse().
+    """
+    if parser not in BACKENDS:
+        raise ValueError('Unknown parser: {0}'.format(parser))
+    return BACKENDS[parser](source, tags)
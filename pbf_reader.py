@@ -0,0 +1,455 @@
+# Reading OSM PBF files into the same elements as the XML iterparse
+# File = pbf_reader.py
+
+import xml.etree.cElementTree as ET
+import collections
+import itertools
+import multiprocessing
+import struct
+import time
+import zlib
+
+"""
+Pure Python reader for the OSM PBF format (https://wiki.openstreetmap.org/wiki/PBF_Format).
+
+iter_elements() yields node, way and relation elements built like the ones
+ET.iterparse() gives for the XML: the same attributes as strings, <tag k v>
+children, <nd ref> children of ways and <member type ref role> children of
+relations.  shape_element(), the audits and the samplers use them unchanged.
+
+The file is a sequence of blobs.  Each blob is read only when it is needed,
+and is inflated with zlib and decoded in a worker process; at most 'window'
+blobs are in flight and their elements are yielded in file order.  Dense
+nodes are delta decoded.  Coordinates are written with 7 decimals and
+timestamps as ISO 8601, like the OSM API.
+
+Only the protobuf wire format features the OSM schema uses are decoded, so no
+protobuf library is needed.
+"""
+
+# Features a reader may be asked for in the header; anything else is refused
+SUPPORTED_FEATURES = set(['OsmSchema-V0.6', 'DenseNodes', 'HistoricalInformation'])
+
+MAX_BLOB_HEADER_SIZE = 64 * 1024
+MAX_BLOB_SIZE = 32 * 1024 * 1024
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+# Coordinates are printed in units of 1e-7 degrees, i.e. 100 nanodegrees
+COORD_UNIT = 100
+
+Block = collections.namedtuple('Block', ['strings', 'granularity', 'lat_offset', 'lon_offset',
+                                         'date_granularity'])
+
+
+# ================================================== #
+#               Protobuf wire format                 #
+# ================================================== #
+def read_varint(data, pos):
+    """Decode the varint at data[pos]; returns (value, position after it)."""
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def signed(value):
+    """Reinterpret an unsigned 64 bit varint as a two's complement int64/int32."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def zigzag(value):
+    """Decode a sint32/sint64 value."""
+    return (value >> 1) ^ -(value & 1)
+
+
+def fields(data):
+    """Yield (field number, value) for each field of a message.
+    Varints are returned as ints, length delimited fields as bytes.
+    """
+    pos = 0
+    end = len(data)
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            size, pos = read_varint(data, pos)
+            value = data[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = struct.unpack_from('<q', data, pos)[0]
+            pos += 8
+        elif wire_type == 5:
+            value = struct.unpack_from('<i', data, pos)[0]
+            pos += 4
+        else:
+            raise ValueError('Unsupported protobuf wire type {0}'.format(wire_type))
+        yield key >> 3, value
+
+
+def packed(value):
+    """Decode a repeated varint field, packed (bytes) or not (a single int)."""
+    if isinstance(value, int):
+        return [value]
+    out = []
+    pos = 0
+    end = len(value)
+    while pos < end:
+        b = value[pos]
+        pos += 1
+        if b < 0x80:
+            out.append(b)
+            continue
+        result = b & 0x7f
+        shift = 7
+        while True:
+            b = value[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        out.append(result)
+    return out
+
+
+def packed_sint(value):
+    return [zigzag(v) for v in packed(value)]
+
+
+def packed_delta(value):
+    """Decode a packed, delta coded sint32/sint64 field."""
+    return list(itertools.accumulate(zigzag(v) for v in packed(value)))
+
+
+# ================================================== #
+#               OSM entities                         #
+# ================================================== #
+def format_coord(nanodegrees):
+    """Print a coordinate like the OSM API, with 7 decimals."""
+    units = (nanodegrees + COORD_UNIT // 2) // COORD_UNIT
+    sign = '-' if units < 0 else ''
+    units = abs(units)
+    return '{0}{1}.{2:07d}'.format(sign, units // 10000000, units % 10000000)
+
+
+def format_timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def info_attrib(attrib, block, version, timestamp, changeset, uid, user_sid):
+    """Add the metadata attributes of an element."""
+    attrib['version'] = str(version)
+    attrib['timestamp'] = format_timestamp(timestamp * block.date_granularity // 1000)
+    attrib['changeset'] = str(changeset)
+    attrib['uid'] = str(uid)
+    attrib['user'] = block.strings[user_sid]
+
+
+# Info/DenseInfo field number -> value when the field is missing: version,
+# timestamp, changeset, uid and user string
+INFO_DEFAULTS = collections.OrderedDict([(1, -1), (2, 0), (3, 0), (4, 0), (5, 0)])
+
+
+def decode_info(data, attrib, block):
+    info = dict(INFO_DEFAULTS)
+    for number, value in fields(data):
+        info[number] = value
+    info_attrib(attrib, block, signed(info[1]), signed(info[2]), signed(info[3]), signed(info[4]), info[5])
+
+
+def decode_common(data, block):
+    """Decode the fields shared by nodes, ways and relations.
+    Returns:
+        (attrib, tags, other fields by number)
+    """
+    attrib = {}
+    keys = []
+    values = []
+    other = collections.defaultdict(list)
+    for number, value in fields(data):
+        if number == 1:
+            attrib['id'] = value
+        elif number == 2:
+            keys.extend(packed(value))
+        elif number == 3:
+            values.extend(packed(value))
+        elif number == 4:
+            decode_info(value, attrib, block)
+        else:
+            other[number].append(value)
+    strings = block.strings
+    return attrib, [(strings[k], strings[v]) for k, v in zip(keys, values)], other
+
+
+def decode_node(data, block):
+    attrib, tags, other = decode_common(data, block)
+    attrib['id'] = str(zigzag(attrib['id']))
+    attrib['lat'] = format_coord(block.lat_offset + block.granularity * zigzag(other[8][0]))
+    attrib['lon'] = format_coord(block.lon_offset + block.granularity * zigzag(other[9][0]))
+    return 'node', attrib, tags, None
+
+
+def decode_dense(data, block):
+    """Decode a DenseNodes group; yields node records."""
+    ids = lats = lons = []
+    keys_vals = []
+    info = None
+    for number, value in fields(data):
+        if number == 1:
+            ids = packed_delta(value)
+        elif number == 5:
+            info = dict((n, v) for n, v in fields(value))
+        elif number == 8:
+            lats = packed_delta(value)
+        elif number == 9:
+            lons = packed_delta(value)
+        elif number == 10:
+            keys_vals.extend(packed(value))
+    if info is not None:
+        # Writers may leave out any of the arrays, e.g. keep versions and
+        # timestamps only; missing values default like in decode_info()
+        columns = [packed(info.get(1, b''))] + [packed_delta(info.get(n, b'')) for n in (2, 3, 4, 5)]
+        defaults = list(INFO_DEFAULTS.values())
+
+    strings = block.strings
+    kv = 0
+    for i, node_id in enumerate(ids):
+        attrib = {'id': str(node_id),
+                  'lat': format_coord(block.lat_offset + block.granularity * lats[i]),
+                  'lon': format_coord(block.lon_offset + block.granularity * lons[i])}
+        if info is not None:
+            info_attrib(attrib, block, *[column[i] if i < len(column) else default
+                                         for column, default in zip(columns, defaults)])
+        tags = []
+        # keys_vals holds k, v, k, v, ..., 0 for each node, or nothing if no node has tags
+        if keys_vals:
+            while keys_vals[kv]:
+                tags.append((strings[keys_vals[kv]], strings[keys_vals[kv + 1]]))
+                kv += 2
+            kv += 1
+        yield 'node', attrib, tags, None
+
+
+def decode_way(data, block):
+    attrib, tags, other = decode_common(data, block)
+    attrib['id'] = str(signed(attrib['id']))
+    refs = []
+    for value in other[8]:
+        refs.extend(packed_sint(value))
+    return 'way', attrib, tags, [str(ref) for ref in itertools.accumulate(refs)]
+
+
+def decode_relation(data, block):
+    attrib, tags, other = decode_common(data, block)
+    attrib['id'] = str(signed(attrib['id']))
+    roles, memids, types = [], [], []
+    for value in other[8]:
+        roles.extend(packed(value))
+    for value in other[9]:
+        memids.extend(packed_sint(value))
+    for value in other[10]:
+        types.extend(packed(value))
+    strings = block.strings
+    members = [(MEMBER_TYPES[member_type], str(ref), strings[role])
+               for member_type, ref, role in zip(types, itertools.accumulate(memids), roles)]
+    return 'relation', attrib, tags, members
+
+
+def decode_block(data, tags):
+    """Decode a PrimitiveBlock.
+    Args:
+        data (bytes): the inflated block.
+        tags (tuple): element types to decode.
+    Returns:
+        records (list): (tag, attrib, tags, nds or members) in block order.
+    """
+    strings = []
+    groups = []
+    options = {17: 100, 18: 1000, 19: 0, 20: 0}
+    for number, value in fields(data):
+        if number == 1:
+            strings = [s.decode('utf-8') for n, s in fields(value) if n == 1]
+        elif number == 2:
+            groups.append(value)
+        elif number in options:
+            options[number] = signed(value)
+    block = Block(strings, options[17], options[19], options[20], options[18])
+
+    records = []
+    for group in groups:
+        for number, value in fields(group):
+            if number == 1 and 'node' in tags:
+                records.append(decode_node(value, block))
+            elif number == 2 and 'node' in tags:
+                records.extend(decode_dense(value, block))
+            elif number == 3 and 'way' in tags:
+                records.append(decode_way(value, block))
+            elif number == 4 and 'relation' in tags:
+                records.append(decode_relation(value, block))
+    return records
+
+
+# ================================================== #
+#               Blobs                                #
+# ================================================== #
+def inflate(blob):
+    """Return the uncompressed data of a Blob message."""
+    raw_size = None
+    for number, value in fields(blob):
+        if number == 1:
+            return value
+        if number == 2:
+            raw_size = value
+        elif number == 3:
+            data = zlib.decompress(value)
+            if raw_size is not None and len(data) != raw_size:
+                raise IOError('Corrupt PBF blob: {0} bytes instead of {1}'.format(len(data), raw_size))
+            return data
+        elif number in (4, 5, 6, 7):
+            raise IOError('Unsupported PBF blob compression (field {0}); only zlib is read'.format(number))
+    raise IOError('Empty PBF blob')
+
+
+def decode_blob(task):
+    """Inflate and decode one OSMData blob (worker process).
+    Args:
+        task (tuple): (blob bytes, element types to decode).
+    """
+    blob, tags = task
+    return decode_block(inflate(blob), tags)
+
+
+def read_blobs(f):
+    """Yield (type, blob bytes) for each blob of the file, reading one blob at a time."""
+    while True:
+        head = f.read(4)
+        if not head:
+            return
+        if len(head) < 4:
+            raise IOError('Truncated PBF file')
+        size = struct.unpack('>I', head)[0]
+        if size > MAX_BLOB_HEADER_SIZE:
+            raise IOError('PBF blob header of {0} bytes is too large'.format(size))
+        blob_type, data_size = None, 0
+        for number, value in fields(f.read(size)):
+            if number == 1:
+                blob_type = value.decode('utf-8')
+            elif number == 3:
+                data_size = value
+        if data_size > MAX_BLOB_SIZE:
+            raise IOError('PBF blob of {0} bytes is too large'.format(data_size))
+        blob = f.read(data_size)
+        if len(blob) < data_size:
+            raise IOError('Truncated PBF file')
+        yield blob_type, blob
+
+
+def decode_header(data):
+    """Decode a HeaderBlock into a dict with the 'bbox' (if any), features and source."""
+    header = {'required_features': [], 'optional_features': []}
+    for number, value in fields(data):
+        if number == 1:
+            bbox = dict(fields(value))
+            # left, right, top and bottom in nanodegrees
+            header['bbox'] = dict((name, format_coord(zigzag(bbox.get(n, 0))))
+                                  for name, n in (('minlon', 1), ('maxlon', 2), ('maxlat', 3), ('minlat', 4)))
+        elif number == 4:
+            header['required_features'].append(value.decode('utf-8'))
+        elif number == 5:
+            header['optional_features'].append(value.decode('utf-8'))
+        elif number == 16:
+            header['writingprogram'] = value.decode('utf-8')
+        elif number == 17:
+            header['source'] = value.decode('utf-8')
+    unsupported = set(header['required_features']) - SUPPORTED_FEATURES
+    if unsupported:
+        raise IOError('PBF file needs unsupported features: {0}'.format(', '.join(sorted(unsupported))))
+    return header
+
+
+def read_header(path):
+    """Read the header block of a PBF file, see decode_header()."""
+    with open(path, 'rb') as f:
+        for blob_type, blob in read_blobs(f):
+            if blob_type == 'OSMHeader':
+                return decode_header(inflate(blob))
+    raise IOError('{0} has no OSMHeader block'.format(path))
+
+
+def to_element(record):
+    """Build an element like ET.iterparse() gives from a decoded record."""
+    tag, attrib, tags, children = record
+    elem = ET.Element(tag, attrib)
+    if tag == 'way':
+        for ref in children:
+            ET.SubElement(elem, 'nd', {'ref': ref})
+    elif tag == 'relation':
+        for member_type, ref, role in children:
+            ET.SubElement(elem, 'member', {'type': member_type, 'ref': ref, 'role': role})
+    for k, v in tags:
+        ET.SubElement(elem, 'tag', {'k': k, 'v': v})
+    return elem
+
+
+def iter_elements(path, tags=('node', 'way', 'relation'), workers=None, window=None):
+    """Yield the elements of a PBF file in file order.
+    Args:
+        path (str): OSM PBF file.
+        tags (tuple): element types to yield; include 'bounds' to get the
+            header's bounding box first, like the XML <bounds> element.
+        workers (int): processes decoding blobs; defaults to the number of
+            CPUs, 1 decodes in this process.
+        window (int): blobs in flight at once; defaults to 4 per worker.
+    Yields:
+        elem (obj): an ET.Element per node, way and relation.
+    """
+    tags = tuple(tags)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    window = window or (workers * 4 if pool is not None else 1)
+    pending = collections.deque()
+
+    def submit(blob_type, blob):
+        if blob_type == 'OSMHeader':
+            pending.append(decode_header(inflate(blob)))
+        elif blob_type == 'OSMData':
+            if pool is not None:
+                pending.append(pool.apply_async(decode_blob, ((blob, tags),)))
+            else:
+                pending.append(decode_blob((blob, tags)))
+
+    f = open(path, 'rb')
+    try:
+        blobs = read_blobs(f)
+        while True:
+            # Keep the window full of blobs being decoded
+            while len(pending) < window:
+                item = next(blobs, None)
+                if item is None:
+                    break
+                submit(*item)
+            if not pending:
+                break
+            result = pending.popleft()
+            if isinstance(result, dict):
+                if 'bounds' in tags and 'bbox' in result:
+                    yield ET.Element('bounds', result['bbox'])
+                continue
+            if pool is not None:
+                result = result.get()
+            for record in result:
+                yield to_element(record)
+    finally:
+        f.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
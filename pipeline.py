@@ -0,0 +1,138 @@
+# Overlapping the parse, shape and write stages of a single file import
+# File = pipeline.py
+
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+"""
+A serial import reads, parses, shapes and writes on one thread, so each stage
+waits for the others.  With ing_import.py --pipeline the stages overlap:
+
+    read thread -> [bounded queue of blocks] -> parse + shape (main thread)
+        -> [bounded queue of row batches per table] -> one writer thread per table
+
+- read: osm_io.ReadAheadReader reads (and decompresses) the input a few blocks
+  ahead of the parser.
+- parse + shape: the main thread, as before.  They stay together because the
+  lxml and expat backends reuse an element once the parser moves on, and
+  because under the GIL two Python stages on two threads would not run at the
+  same time anyway.  The shaped rows are plain dicts and tuples, safe to hand
+  over.
+- write: a ThreadedWriter per table collects rows into batches and a thread
+  serializes and writes them, with a large file buffer.
+
+Every queue is bounded, so a slow stage blocks the one feeding it instead of
+letting memory grow: at most READ_AHEAD_DEPTH blocks and, per table,
+QUEUE_DEPTH batches of BATCH_ROWS rows are in flight.  File reads and writes and
+zlib/bz2 release the GIL, so the I/O overlaps with the Python work; the Python
+parts of the stages still share one core.  Use --workers to spread shaping over
+several cores.  Each table's rows are written in order, so the csv files are the
+same as a serial run's.
+"""
+
+BATCH_ROWS = 2000
+"""Rows handed to a writer thread at a time."""
+
+QUEUE_DEPTH = 8
+"""Batches queued per writer thread before the shaping stage blocks."""
+
+WRITE_BUFFER = 1024 * 1024
+"""Buffer size of the files written by the writer threads."""
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class ThreadedWriter(object):
+    """Hand the rows of a csv (or Parquet) writer to a background thread in batches.
+    Offers writerow()/writerows() like the wrapped writer.  close() writes the
+    rows still queued and re-raises any error of the thread; it does not close
+    the writer or its file.
+    Args:
+        writer (obj): writer with writerows(), used only by the thread.
+        batch_size (int): rows per batch.
+        depth (int): batches queued before writerow() blocks.
+    Attributes:
+        busy (float): seconds the thread spent writing.
+        blocked (float): seconds the caller waited for room in the queue.
+    """
+
+    def __init__(self, writer, batch_size=BATCH_ROWS, depth=QUEUE_DEPTH):
+        self._writer = writer
+        self._batch_size = batch_size
+        self._batch = []
+        self._queue = queue.Queue(depth)
+        self._error = None
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _write(self):
+        try:
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    break
+                began = clock()
+                self._writer.writerows(batch)
+                self.busy += clock() - began
+        except Exception as e:
+            # Batches still queued are dropped; the next put() raises e
+            self._error = e
+
+    def _put(self, item):
+        began = clock()
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.blocked += clock() - began
+
+    def writerow(self, row):
+        self._batch.append(row)
+        if len(self._batch) >= self._batch_size:
+            self._put(self._batch)
+            self._batch = []
+
+    def writerows(self, rows):
+        self._batch.extend(rows)
+        if len(self._batch) >= self._batch_size:
+            self._put(self._batch)
+            self._batch = []
+
+    def close(self):
+        if self._thread.is_alive():
+            if self._batch:
+                self._put(self._batch)
+                self._batch = []
+            self._put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def close_all(writers, metrics=None):
+    """Close ThreadedWriters, adding their 'write_threads' and 'write_wait' time to metrics.
+    Every writer is closed even if one fails; the first error is raised.
+    """
+    error = None
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            error = error or e
+        if metrics is not None:
+            metrics.add('write_threads', writer.busy)
+            metrics.add('write_wait', writer.blocked)
+    if error is not None:
+        raise error
@@ -1,22 +1,23 @@
 '''
 The following functions are performed to audit the postal codes 
-vs 'postcode_re'.
+vs the addr:postcode rule of tag_rules.json.
 Print the postal codes that do not match
 '''
 
 import unicodecsv
 import pprint  
 import re
-import xml.etree.cElementTree as ET
 import cerberus
 import schema
 from collections import defaultdict
 
+import audit_engine
+import tag_rules
+
 OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
 
-post_code_re = re.compile(r'^\d{5}$')
-"""Regular expression to recognise valid post codes.
-"""
+# Valid post codes match the 'valid' regex of the addr:postcode rule in tag_rules.json
+POST_CODE_RULE = tag_rules.RULES['addr:postcode']
 
 def audit_post_codes(bad_post_codes, post_code):
     """Build a set of bad post codes.
@@ -24,8 +25,7 @@ def audit_post_codes(bad_post_codes, post_code):
         bad_post_codes (set): bad post codes.
         post_code (str): post code data.
     """
-    m = post_code_re.match(post_code)
-    if not m:
+    if POST_CODE_RULE.check(post_code) is not None:
         bad_post_codes.add(post_code)
 
 def is_post_code(elem):
@@ -38,6 +38,24 @@ def is_post_code(elem):
     return (elem.attrib['k'] == "addr:postcode")
 
 
+@audit_engine.register
+class PostCodeAudit(object):
+    """Audit plugin collecting bad post codes."""
+    name = 'post_codes'
+
+    def __init__(self):
+        self.bad_post_codes = set()
+
+    def process(self, elem):
+        if elem.tag == "node" or elem.tag == "way":
+            for tag in elem.iter("tag"):
+                if is_post_code(tag):
+                    audit_post_codes(self.bad_post_codes, tag.attrib['v'])
+
+    def result(self):
+        return self.bad_post_codes
+
+
 def audit(osmfile):
     """Audit post code data.
     Args:
@@ -45,18 +63,9 @@ def audit(osmfile):
     Returns:
         bad_post_codes (set): bad post codes.
     """
-    osm_file = open(osmfile, "rb")
-    bad_post_codes = set()
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_post_code(tag):
-                    audit_post_codes(bad_post_codes, tag.attrib['v'])
-
-    osm_file.close()
-    return bad_post_codes
-
+    return audit_engine.run_audits(osmfile, [PostCodeAudit()])[PostCodeAudit.name]
 
 
-postal_types = audit(OSM_FILE)
-pprint.pprint(postal_types)
\ No newline at end of file
+if __name__ == '__main__':
+    postal_types = audit(OSM_FILE)
+    pprint.pprint(postal_types)
@@ -0,0 +1,82 @@
+# SQL queries from OpenStreetMap_Final.ipynb, shared by the benchmarks.
+
+# (name, query) in notebook order
+NOTEBOOK_QUERIES = [
+    ('nodes', '''
+SELECT COUNT(*) AS "Number of Nodes" FROM nodes
+'''),
+    ('ways', '''
+SELECT COUNT(*) AS "Number of Ways" FROM ways
+'''),
+    ('unique_users', '''
+SELECT COUNT(DISTINCT uid) AS "Number of Unique Users" 
+FROM
+(SELECT uid FROM nodes 
+UNION
+SELECT DISTINCT uid FROM ways);
+'''),
+    ('postcodes', '''
+SELECT tags.value, COUNT(*) as count 
+FROM (SELECT * FROM nodes_tags 
+UNION ALL 
+SELECT * FROM ways_tags) tags
+WHERE tags.key='postcode'
+GROUP BY tags.value
+ORDER BY count DESC
+'''),
+    ('top_users', '''
+SELECT e.user as User, COUNT(*) as Count
+FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) e
+GROUP BY e.user
+ORDER BY Count DESC
+LIMIT 10;'''),
+    ('top_amenities', '''
+select value, count(distinct id) 
+from nodes_tags 
+where key = 'amenity' 
+group by 1 
+order by 2 desc 
+limit 10;
+'''),
+    ('restaurant_cuisines', '''
+SELECT nodes_tags.value, COUNT(*) as num
+FROM nodes_tags 
+    JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value='restaurant') i
+    ON nodes_tags.id=i.id
+WHERE nodes_tags.key='cuisine'
+GROUP BY nodes_tags.value
+ORDER BY num DESC;'''),
+    ('religions', '''
+SELECT ways_tags.value as 'Religion', COUNT(*) as Count
+FROM ways_tags
+    JOIN (SELECT DISTINCT(id) FROM ways_tags WHERE value='place_of_worship') a
+    ON ways_tags.id=a.id
+WHERE ways_tags.key='religion'
+GROUP BY ways_tags.value
+ORDER BY Count DESC;'''),
+    ('cities', '''
+SELECT tags.value, COUNT(*) as count 
+FROM (SELECT * FROM nodes_tags UNION ALL 
+      SELECT * FROM ways_tags) tags
+WHERE tags.key = 'city'
+GROUP BY tags.value
+ORDER BY count DESC;'''),
+]
+
+# The notebook's tag queries answered from the unified tags table, which also
+# holds relation tags; like the notebook they count nodes and ways only
+UNIFIED_QUERIES = [
+    ('postcodes_unified', '''
+SELECT value, COUNT(*) as count
+FROM tags
+WHERE key='postcode' AND element_type IN ('node', 'way')
+GROUP BY value
+ORDER BY count DESC
+'''),
+    ('cities_unified', '''
+SELECT value, COUNT(*) as count
+FROM tags
+WHERE key = 'city' AND element_type IN ('node', 'way')
+GROUP BY value
+ORDER BY count DESC;'''),
+]
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import xml.etree.cElementTree as ET
+import argparse
+import random
+
+import osm_io
+import parsers
+import pbf_reader
+
+"""
+Write samples of an OSM file that are small but still referentially intact.
+
+Each sample is made by a sampler choosing top level elements:
+
+- EveryK: every k-th element, like the original small_sample.py.
+- RandomSample: each element with a given probability, from a seeded generator.
+- Reservoir: exactly n elements chosen uniformly at random (reservoir sampling).
+- BBox: nodes inside a bounding box, the ways using any of them, and the
+  relations with any of those members.
+
+The file is read twice.  The first pass runs every sampler over the same
+stream of elements and records the ids they choose; a chosen way also pulls in
+all of its nodes, so ways are complete.  The second pass writes every sample
+at once.  Relations keep only the members that are in their sample, so every
+node reference and member in a sample resolves within it.  Any number of
+samples costs the same two passes.  Random samples with the same seed nest:
+random:0.05 contains random:0.01, as every:5 contains every:80.
+"""
+
+ELEMENT_TAGS = ('node', 'way', 'relation')
+
+
+def get_element(osm_file, tags=ELEMENT_TAGS, parser='etree'):
+    """Yield the top level elements of a plain, .gz, .bz2 or PBF OSM file."""
+    if osm_io.is_pbf(osm_file):
+        for elem in pbf_reader.iter_elements(osm_file, tags):
+            yield elem
+        return
+    source = osm_io.open_osm(osm_file)
+    try:
+        for elem in parsers.iter_elements(source, tags, parser):
+            yield elem
+    finally:
+        if source is not osm_file:
+            source.close()
+
+
+def references(element):
+    """(tag, id) of the elements an element refers to: way nodes and relation members."""
+    if element.tag == 'way':
+        return [('node', int(nd.attrib['ref'])) for nd in element.iter('nd')]
+    if element.tag == 'relation':
+        return [(member.attrib['type'], int(member.attrib['ref'])) for member in element.iter('member')]
+    return []
+
+
+class Sampler(object):
+    """Base sampler.  Subclasses decide in choose() whether to keep an element.
+    Attributes:
+        ids (dict): element tag -> set of the ids in the sample.
+    """
+
+    def __init__(self):
+        self.ids = dict((tag, set()) for tag in ELEMENT_TAGS)
+
+    def choose(self, index, element):
+        """True to keep the index-th element of the file."""
+        raise NotImplementedError
+
+    def keep(self, tag, element_id, nodes=()):
+        """Add an element, and the nodes of a way, to the sample."""
+        self.ids[tag].add(element_id)
+        self.ids['node'].update(nodes)
+
+    def offer(self, index, element):
+        """First pass: see one element."""
+        if self.choose(index, element):
+            nodes = [ref for _, ref in references(element)] if element.tag == 'way' else ()
+            self.keep(element.tag, int(element.attrib['id']), nodes)
+
+    def finish(self):
+        """Called after the first pass."""
+        pass
+
+    def contains(self, tag, element_id):
+        return element_id in self.ids[tag]
+
+    def bounds(self):
+        """The <bounds> element of the sample, or None to copy the file's."""
+        return None
+
+
+class EveryK(Sampler):
+    """Keep every k-th top level element."""
+
+    def __init__(self, k):
+        Sampler.__init__(self)
+        self.k = k
+
+    def choose(self, index, element):
+        return index % self.k == 0
+
+
+class RandomSample(Sampler):
+    """Keep each element with probability fraction."""
+
+    def __init__(self, fraction, seed=0):
+        Sampler.__init__(self)
+        self.fraction = fraction
+        self.random = random.Random(seed)
+
+    def choose(self, index, element):
+        return self.random.random() < self.fraction
+
+
+class Reservoir(Sampler):
+    """Keep exactly size elements chosen uniformly at random, with Algorithm R.
+    The nodes of the chosen ways come on top of size.
+    """
+
+    def __init__(self, size, seed=0):
+        Sampler.__init__(self)
+        self.size = size
+        self.random = random.Random(seed)
+        self.seen = 0
+        self.reservoir = []
+
+    def offer(self, index, element):
+        nodes = [ref for _, ref in references(element)] if element.tag == 'way' else ()
+        item = (element.tag, int(element.attrib['id']), nodes)
+        if len(self.reservoir) < self.size:
+            self.reservoir.append(item)
+        else:
+            slot = self.random.randint(0, self.seen)
+            if slot < self.size:
+                self.reservoir[slot] = item
+        self.seen += 1
+
+    def finish(self):
+        for tag, element_id, nodes in self.reservoir:
+            self.keep(tag, element_id, nodes)
+        self.reservoir = []
+
+
+class BBox(Sampler):
+    """Keep the nodes inside a bounding box, the ways using any of them and the
+    relations with any member in the sample.
+    """
+
+    def __init__(self, min_lat, min_lon, max_lat, max_lon):
+        Sampler.__init__(self)
+        self.box = (min_lat, min_lon, max_lat, max_lon)
+        self.inside = set()
+
+    def choose(self, index, element):
+        if element.tag == 'node':
+            if 'lat' not in element.attrib:
+                return False
+            lat, lon = float(element.attrib['lat']), float(element.attrib['lon'])
+            min_lat, min_lon, max_lat, max_lon = self.box
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                self.inside.add(int(element.attrib['id']))
+                return True
+            return False
+        if element.tag == 'way':
+            return any(ref in self.inside for _, ref in references(element))
+        return any(self.contains(tag, ref) for tag, ref in references(element) if tag in self.ids)
+
+    def finish(self):
+        self.inside = set()
+
+    def bounds(self):
+        min_lat, min_lon, max_lat, max_lon = self.box
+        return ET.Element('bounds', {'minlat': repr(min_lat), 'minlon': repr(min_lon),
+                                     'maxlat': repr(max_lat), 'maxlon': repr(max_lon)})
+
+
+def clipped(element, sampler):
+    """The element, or a copy of a relation without the members outside the sample."""
+    if element.tag != 'relation':
+        return element
+    children = [child for child in element
+                if child.tag != 'member' or
+                (child.attrib['type'] in sampler.ids and
+                 sampler.contains(child.attrib['type'], int(child.attrib['ref'])))]
+    if len(children) == len(element):
+        return element
+    copy = ET.Element(element.tag, element.attrib)
+    copy.text = element.text
+    copy.extend(children)
+    return copy
+
+
+def to_xml(element):
+    """Serialize a top level element as one indented line of the output file."""
+    tail, element.tail = element.tail, None
+    try:
+        return b'  ' + ET.tostring(element, encoding='utf-8') + b'\n'
+    finally:
+        element.tail = tail
+
+
+def sample(osm_file, samples, parser='etree'):
+    """Write samples of an OSM file in two passes over it.
+    Args:
+        osm_file (str): plain, .gz, .bz2 or PBF OSM file.
+        samples (list): (sampler, output file) pairs.
+        parser (str): XML parser backend, 'etree' or 'expat' (see parsers.PARSERS).
+    Returns:
+        counts (list): for each sample, a dict of element tag -> elements written.
+    """
+    for index, element in enumerate(get_element(osm_file, ELEMENT_TAGS, parser)):
+        for sampler, _ in samples:
+            sampler.offer(index, element)
+    for sampler, _ in samples:
+        sampler.finish()
+
+    counts = [dict((tag, 0) for tag in ELEMENT_TAGS) for _ in samples]
+    outputs = [open(out_file, 'wb') for _, out_file in samples]
+    try:
+        for (sampler, _), output in zip(samples, outputs):
+            output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+            output.write(b'<osm>\n')
+            bounds = sampler.bounds()
+            if bounds is not None:
+                output.write(to_xml(bounds))
+
+        for element in get_element(osm_file, ('bounds',) + ELEMENT_TAGS, parser):
+            if element.tag == 'bounds':
+                for (sampler, _), output in zip(samples, outputs):
+                    if sampler.bounds() is None:
+                        output.write(to_xml(element))
+                continue
+            element_id = int(element.attrib['id'])
+            data = None
+            for (sampler, _), output, count in zip(samples, outputs, counts):
+                if not sampler.contains(element.tag, element_id):
+                    continue
+                kept = clipped(element, sampler)
+                if kept is element:
+                    # Serialize once for all the samples keeping the element whole
+                    if data is None:
+                        data = to_xml(element)
+                    output.write(data)
+                else:
+                    output.write(to_xml(kept))
+                count[element.tag] += 1
+
+        for output in outputs:
+            output.write(b'</osm>\n')
+    finally:
+        for output in outputs:
+            output.close()
+
+    for (_, out_file), count in zip(samples, counts):
+        print('{0}: {1}'.format(out_file, ', '.join('{0} {1}s'.format(count[tag], tag) for tag in ELEMENT_TAGS)))
+    return counts
+
+
+def parse_sampler(spec, seed=0):
+    """Build a sampler from 'every:K', 'random:FRACTION', 'reservoir:N' or
+    'bbox:MIN_LAT,MIN_LON,MAX_LAT,MAX_LON'.
+    """
+    mode, _, value = spec.partition(':')
+    if mode == 'every':
+        return EveryK(int(value))
+    if mode == 'random':
+        return RandomSample(float(value), seed)
+    if mode == 'reservoir':
+        return Reservoir(int(value), seed)
+    if mode == 'bbox':
+        box = [float(v) for v in value.split(',')]
+        if len(box) == 4:
+            return BBox(*box)
+    raise ValueError('Unknown sample: {0}'.format(spec))
+
+
+# bzip2 and PBF input is decoded by worker processes, which import this module
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write referentially intact samples of an OSM file.')
+    parser.add_argument('osm_file', help='OSM file to sample (plain, .gz, .bz2 or PBF)')
+    parser.add_argument('--sample', nargs=2, action='append', required=True, metavar=('SAMPLE', 'OUTPUT'),
+                        help="sample and its output file; SAMPLE is every:K, random:FRACTION, reservoir:N "
+                             "or bbox:MIN_LAT,MIN_LON,MAX_LAT,MAX_LON.  Repeat for several samples in one run")
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random and reservoir samples')
+    parser.add_argument('--parser', choices=('etree', 'expat'), default='etree', help='XML parser backend')
+    args = parser.parse_args()
+    sample(args.osm_file, [(parse_sampler(spec, args.seed), out_file) for spec, out_file in args.sample],
+           args.parser)
@@ -40,4 +40,74 @@ CREATE TABLE ways_nodes (
     position INTEGER NOT NULL,
     FOREIGN KEY (id) REFERENCES ways(id),
     FOREIGN KEY (node_id) REFERENCES nodes(id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE ways_geometry (
+    id INTEGER PRIMARY KEY NOT NULL,
+    min_lat REAL,
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    missing_nodes INTEGER,
+    geometry TEXT,
+    FOREIGN KEY (id) REFERENCES ways(id)
+);
+
+CREATE TABLE relations (
+    id INTEGER PRIMARY KEY NOT NULL,
+    user TEXT,
+    uid INTEGER,
+    version TEXT,
+    changeset INTEGER,
+    timestamp TEXT
+);
+
+CREATE TABLE relations_tags (
+    id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    category TEXT,
+    FOREIGN KEY (id) REFERENCES relations(id)
+);
+
+CREATE TABLE relations_members (
+    id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    member_type TEXT NOT NULL,
+    role TEXT,
+    position INTEGER NOT NULL,
+    FOREIGN KEY (id) REFERENCES relations(id)
+);
+
+CREATE TABLE tags (
+    id INTEGER NOT NULL,
+    key TEXT,
+    value TEXT,
+    category TEXT,
+    element_type TEXT NOT NULL
+);
+
+CREATE TABLE import_checkpoints (
+    table_name TEXT PRIMARY KEY NOT NULL,
+    rows INTEGER,
+    done INTEGER
+);
+
+CREATE INDEX nodes_tags_id ON nodes_tags (id);
+CREATE INDEX nodes_tags_key_value ON nodes_tags (key, value, id);
+CREATE INDEX nodes_tags_value ON nodes_tags (value, id);
+CREATE INDEX ways_tags_id ON ways_tags (id);
+CREATE INDEX ways_tags_key_value ON ways_tags (key, value, id);
+CREATE INDEX ways_tags_value ON ways_tags (value, id);
+CREATE INDEX ways_nodes_id ON ways_nodes (id, position);
+CREATE INDEX ways_nodes_node_id ON ways_nodes (node_id);
+CREATE INDEX relations_tags_id ON relations_tags (id);
+CREATE INDEX relations_tags_key_value ON relations_tags (key, value, id);
+CREATE INDEX relations_tags_value ON relations_tags (value, id);
+CREATE INDEX relations_members_id ON relations_members (id, position);
+CREATE INDEX relations_members_member ON relations_members (member_type, member_id);
+CREATE INDEX tags_key_value ON tags (key, value);
+CREATE INDEX tags_element ON tags (element_type, id);
+
+CREATE VIRTUAL TABLE nodes_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+CREATE VIRTUAL TABLE ways_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
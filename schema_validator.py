@@ -0,0 +1,196 @@
+# Fast validation of shaped elements against the schema
+# File = schema_validator.py
+
+"""
+Drop-in replacement for cerberus.Validator for the schema in schema.py.
+
+Each schema is compiled once into one checking function per top level key
+('node', 'way_tags', ...).  A checker walks a precomputed list of
+(field, required, coerce, types) rules, so a valid element costs a handful of
+dict lookups and coercions instead of a trip through cerberus's generic rule
+machinery.  validate() and errors behave like cerberus: the same coercions are
+applied to a copy of the document (see 'document') and the same error
+messages are reported, with error keys sorted the way cerberus sorts them.
+
+Only the rules the project schema uses are supported: 'type' (dict, list,
+integer, float, string), 'schema', 'required' and 'coerce'.
+"""
+
+try:
+    STRING_TYPES = (basestring,)
+    INTEGER_TYPES = (int, long)
+except NameError:
+    STRING_TYPES = (str,)
+    INTEGER_TYPES = (int,)
+
+# cerberus type name -> accepted Python types
+TYPES = {'string': STRING_TYPES,
+         'integer': INTEGER_TYPES,
+         'float': (float,) + INTEGER_TYPES,
+         'dict': (dict,),
+         'list': (list,)}
+
+SUPPORTED_RULES = set(['type', 'schema', 'required', 'coerce'])
+
+NOT_NULLABLE = 'null value not allowed'
+REQUIRED_FIELD = 'required field'
+UNKNOWN_FIELD = 'unknown field'
+BAD_TYPE = 'must be of {0} type'
+COERCION_FAILED = "field '{0}' cannot be coerced: {1}"
+
+
+def check_rules(rule):
+    """Raise ValueError if a rule uses anything the compiler does not support."""
+    unsupported = set(rule) - SUPPORTED_RULES
+    if unsupported:
+        raise ValueError('Unsupported schema rules: {0}'.format(', '.join(sorted(unsupported))))
+    if rule.get('type') not in TYPES:
+        raise ValueError('Unsupported schema type: {0}'.format(rule.get('type')))
+
+
+def compile_fields(fields_schema):
+    """Compile the schema of a dict into a function checking one dict.
+    Args:
+        fields_schema (dict): field name -> leaf rule.
+    Returns:
+        check (function): check(doc) -> (coerced copy of doc, errors dict or None)
+    """
+    rules = []
+    for name, rule in sorted(fields_schema.items()):
+        check_rules(rule)
+        rules.append((name, rule.get('required', False), rule.get('coerce'),
+                      TYPES[rule['type']], BAD_TYPE.format(rule['type'])))
+    names = frozenset(fields_schema)
+
+    def check(doc):
+        out = dict(doc)
+        errors = None
+        for name, required, coerce, types, bad_type in rules:
+            if name not in doc:
+                if required:
+                    errors = errors or {}
+                    errors[name] = [REQUIRED_FIELD]
+                continue
+            value = doc[name]
+            coerce_error = None
+            if coerce is not None:
+                try:
+                    value = out[name] = coerce(value)
+                except Exception as e:
+                    coerce_error = COERCION_FAILED.format(name, e)
+            if value is None:
+                messages = [NOT_NULLABLE]
+            elif not isinstance(value, types):
+                messages = [bad_type]
+            elif coerce_error is None:
+                continue
+            else:
+                messages = []
+            if coerce_error is not None:
+                messages.append(coerce_error)
+            errors = errors or {}
+            errors[name] = messages
+        if len(doc) > len(rules) or not names.issuperset(doc):
+            for name in doc:
+                if name not in names:
+                    errors = errors or {}
+                    errors[name] = [UNKNOWN_FIELD]
+        if errors:
+            errors = dict(sorted(errors.items()))
+        return out, errors
+
+    return check
+
+
+def compile_rule(rule):
+    """Compile the rule of one top level key into a checking function.
+    Args:
+        rule (dict): a 'dict' rule with a fields schema, or a 'list' rule whose
+            items follow such a 'dict' rule.
+    Returns:
+        check (function): check(value) -> (coerced copy of value, error list or None)
+    """
+    check_rules(rule)
+    if rule['type'] == 'dict':
+        check_dict = compile_fields(rule['schema'])
+
+        def check(value):
+            if value is None:
+                return value, [NOT_NULLABLE]
+            if not isinstance(value, dict):
+                return value, [BAD_TYPE.format('dict')]
+            out, errors = check_dict(value)
+            return out, [errors] if errors else None
+
+        return check
+
+    if rule['type'] == 'list':
+        check_item = compile_rule(rule['schema'])
+
+        def check(value):
+            if value is None:
+                return value, [NOT_NULLABLE]
+            if not isinstance(value, list):
+                return value, [BAD_TYPE.format('list')]
+            out = []
+            errors = None
+            for index, item in enumerate(value):
+                item, item_errors = check_item(item)
+                out.append(item)
+                if item_errors:
+                    errors = errors or {}
+                    errors[index] = item_errors
+            return out, [errors] if errors else None
+
+        return check
+
+    raise ValueError('Top level schema rules must be of dict or list type')
+
+
+def compile_schema(schema):
+    """Compile a schema into a checking function per top level key.
+    Returns:
+        checkers (dict): top level key -> check(value) function.
+    """
+    return dict((key, compile_rule(rule)) for key, rule in schema.items())
+
+
+class Validator(object):
+    """Validate documents like cerberus.Validator, with compiled schemas.
+    Schemas are compiled the first time they are seen and cached.
+    """
+
+    def __init__(self):
+        self._compiled = {}
+        self.document = None
+        self.errors = {}
+
+    def validate(self, document, schema):
+        """Validate a document against a schema.
+        Args:
+            document (dict): document to validate, left unchanged.
+            schema (dict): schema of desired data structure
+        Returns:
+            True if the document is valid.  The coerced document is stored in
+            'document' and the errors, if any, in 'errors'.
+        """
+        cached = self._compiled.get(id(schema))
+        if cached is None or cached[0] is not schema:
+            cached = self._compiled[id(schema)] = (schema, compile_schema(schema))
+        checkers = cached[1]
+
+        self.document = {}
+        errors = {}
+        if not isinstance(document, dict):
+            raise TypeError('document must be a dict')
+        for key, value in document.items():
+            check = checkers.get(key)
+            if check is None:
+                self.document[key] = value
+                errors[key] = [UNKNOWN_FIELD]
+                continue
+            self.document[key], key_errors = check(value)
+            if key_errors:
+                errors[key] = key_errors
+        self.errors = dict(sorted(errors.items()))
+        return not self.errors
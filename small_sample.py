@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import xml.etree.ElementTree as ET  # Use cElementTree or lxml if too slow
+import sample_osm
+
+"""
+Every k-th top level element of the map, with the nodes of the ways kept.
+sample_osm.py makes other samples, or several sizes in one run.
+"""
 
 OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
 
@@ -9,26 +14,6 @@ SAMPLE_FILE = "ing_small_sample.osm"
 
 k = 80 # Parameter: take every k-th top level element
 
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag
-    Reference:
-    http://stackoverflow.com/questions/3095434/inserting-newlines-in-xml-file-generated-via-xml-etree-elementtree-in-python
-    """
-    context = iter(ET.iterparse(osm_file, events=('start', 'end')))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
-
-
-with open(SAMPLE_FILE, 'wb') as output:
-    output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
-    output.write(b'<osm>\n  ')
-
-    # Write every kth top level element
-    for i, element in enumerate(get_element(OSM_FILE)):
-        if i % k == 0:
-            output.write(ET.tostring(element, encoding='utf-8'))
-
-    output.write(b'</osm>')
\ No newline at end of file
+# bzip2 input is decompressed by worker processes, which import this module
+if __name__ == '__main__':
+    sample_osm.sample(OSM_FILE, [(sample_osm.EveryK(k), SAMPLE_FILE)])
@@ -0,0 +1,209 @@
+import argparse
+import math
+import sqlite3
+
+import create_db
+
+"""
+Bounding box and radius lookups of nodes and ways, answered from the R-tree
+tables built by create_db.create_rtree() and returned with their tags.
+
+Nodes are matched on their exact coordinates.  Ways are matched when their
+bounding box intersects the query box (or lies within the radius): ways_rtree,
+whose boxes are rounded to 32 bit floats, picks the candidates and their exact
+boxes are computed from their nodes and checked again.  Every lookup can also
+be run as a full table scan (use_rtree=False) for comparison, see
+bench_spatial.py.
+"""
+
+EARTH_RADIUS = 6371008.8
+"""Mean Earth radius in metres."""
+
+# Tag table of each element type
+TAG_TABLES = {'node': 'nodes_tags',
+              'way': 'ways_tags'}
+
+# SQLite's default limit on the number of ? parameters is 999
+MAX_PARAMS = 900
+
+NODES_RTREE_SQL = '''
+SELECT nodes.id, nodes.lat, nodes.lon
+FROM nodes_rtree JOIN nodes ON nodes.id = nodes_rtree.id
+WHERE nodes_rtree.max_lat >= ? AND nodes_rtree.min_lat <= ?
+  AND nodes_rtree.max_lon >= ? AND nodes_rtree.min_lon <= ?
+  AND nodes.lat BETWEEN ? AND ? AND nodes.lon BETWEEN ? AND ?
+'''
+
+NODES_SCAN_SQL = '''
+SELECT id, lat, lon FROM nodes
+WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?
+'''
+
+# The R-tree only picks the candidates; their exact boxes come from their nodes
+WAYS_RTREE_SQL = '''
+SELECT ways_nodes.id, MIN(lat), MIN(lon), MAX(lat), MAX(lon)
+FROM ways_rtree
+JOIN ways_nodes ON ways_nodes.id = ways_rtree.id
+JOIN nodes ON nodes.id = ways_nodes.node_id
+WHERE ways_rtree.max_lat >= ? AND ways_rtree.min_lat <= ?
+  AND ways_rtree.max_lon >= ? AND ways_rtree.min_lon <= ?
+GROUP BY ways_nodes.id
+HAVING MAX(lat) >= ? AND MIN(lat) <= ? AND MAX(lon) >= ? AND MIN(lon) <= ?
+'''
+
+WAYS_SCAN_SQL = '''
+SELECT ways_nodes.id, MIN(lat), MIN(lon), MAX(lat), MAX(lon)
+FROM ways_nodes JOIN nodes ON nodes.id = ways_nodes.node_id
+GROUP BY ways_nodes.id
+HAVING MAX(lat) >= ? AND MIN(lat) <= ? AND MAX(lon) >= ? AND MIN(lon) <= ?
+'''
+
+
+def full_key(key, tag_type):
+    """Rebuild the OSM tag key, e.g. ('street', 'addr') -> 'addr:street'."""
+    if tag_type == 'regular':
+        return key
+    return '{0}:{1}'.format(tag_type, key)
+
+
+def fetch_tags(conn, element_type, ids):
+    """Look up the tags of some elements.
+    Args:
+        conn (obj): sqlite3 connection.
+        element_type (str): 'node' or 'way'.
+        ids (list): element ids.
+    Returns:
+        tags (dict): element id -> {tag key: value}
+    """
+    tags = dict((element_id, {}) for element_id in ids)
+    ids = list(tags)
+    for i in range(0, len(ids), MAX_PARAMS):
+        chunk = ids[i:i + MAX_PARAMS]
+        query = 'SELECT id, key, value, type FROM {0} WHERE id IN ({1})'.format(
+            TAG_TABLES[element_type], ', '.join('?' * len(chunk)))
+        for element_id, key, value, tag_type in conn.execute(query, chunk):
+            tags[element_id][full_key(key, tag_type)] = value
+    return tags
+
+
+def find_nodes(conn, min_lat, min_lon, max_lat, max_lon, use_rtree=True):
+    """Nodes inside the box, as {'type', 'id', 'lat', 'lon'} dicts."""
+    if use_rtree:
+        rows = conn.execute(NODES_RTREE_SQL, (min_lat, max_lat, min_lon, max_lon,
+                                              min_lat, max_lat, min_lon, max_lon))
+    else:
+        rows = conn.execute(NODES_SCAN_SQL, (min_lat, max_lat, min_lon, max_lon))
+    return [{'type': 'node', 'id': node_id, 'lat': lat, 'lon': lon} for node_id, lat, lon in rows]
+
+
+def find_ways(conn, min_lat, min_lon, max_lat, max_lon, use_rtree=True):
+    """Ways whose bounding box intersects the box, as dicts with the way's box."""
+    box = (min_lat, max_lat, min_lon, max_lon)
+    if use_rtree:
+        rows = conn.execute(WAYS_RTREE_SQL, box + box)
+    else:
+        rows = conn.execute(WAYS_SCAN_SQL, box)
+    return [{'type': 'way', 'id': row[0], 'min_lat': row[1], 'min_lon': row[2],
+             'max_lat': row[3], 'max_lon': row[4]} for row in rows]
+
+
+FINDERS = {'node': find_nodes,
+           'way': find_ways}
+
+
+def add_tags(conn, results):
+    """Attach a 'tags' dict to each result."""
+    for element_type in TAG_TABLES:
+        found = [r for r in results if r['type'] == element_type]
+        if found:
+            tags = fetch_tags(conn, element_type, [r['id'] for r in found])
+            for r in found:
+                r['tags'] = tags[r['id']]
+    return results
+
+
+def bbox_query(conn, min_lat, min_lon, max_lat, max_lon, element_types=('node', 'way'),
+               tags=True, use_rtree=True):
+    """Find the nodes and ways in a bounding box.
+    Args:
+        conn (obj): sqlite3 connection.
+        min_lat, min_lon, max_lat, max_lon (float): the box, in degrees.
+        element_types (tuple): any of 'node' and 'way'.
+        tags (bool): if True, will attach each element's tags.
+        use_rtree (bool): if False, will scan the tables instead of using the R-trees.
+    Returns:
+        results (list): one dict per element, nodes first.
+    """
+    results = []
+    for element_type in element_types:
+        results.extend(FINDERS[element_type](conn, min_lat, min_lon, max_lat, max_lon, use_rtree))
+    if tags:
+        add_tags(conn, results)
+    return results
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance between two points, in metres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lon, radius):
+    """Bounding box (min_lat, min_lon, max_lat, max_lon) of a circle of radius metres."""
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-12 else min(180.0, dlat / cos_lat)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def distance_to(result, lat, lon):
+    """Distance from a point to a node, or to the nearest point of a way's box."""
+    if result['type'] == 'node':
+        return haversine(lat, lon, result['lat'], result['lon'])
+    nearest_lat = min(max(lat, result['min_lat']), result['max_lat'])
+    nearest_lon = min(max(lon, result['min_lon']), result['max_lon'])
+    return haversine(lat, lon, nearest_lat, nearest_lon)
+
+
+def radius_query(conn, lat, lon, radius, element_types=('node', 'way'), tags=True, use_rtree=True):
+    """Find the nodes and ways within radius metres of a point.
+    The box around the circle is looked up first, then each candidate is
+    checked by great circle distance.
+    Returns:
+        results (list): dicts as from bbox_query() with a 'distance' in metres,
+        nearest first.
+    """
+    results = []
+    for r in bbox_query(conn, *radius_bbox(lat, lon, radius), element_types=element_types,
+                        tags=False, use_rtree=use_rtree):
+        r['distance'] = distance_to(r, lat, lon)
+        if r['distance'] <= radius:
+            results.append(r)
+    results.sort(key=lambda r: r['distance'])
+    if tags:
+        add_tags(conn, results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find nodes and ways in a box or around a point.')
+    parser.add_argument('--db', default=create_db.DB_FILE, help='SQLite database file')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--bbox', nargs=4, type=float, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    group.add_argument('--radius', nargs=3, type=float, metavar=('LAT', 'LON', 'METRES'))
+    parser.add_argument('--type', choices=['node', 'way'], action='append',
+                        help='element type to return (default: both)')
+    args = parser.parse_args()
+
+    element_types = tuple(args.type or ('node', 'way'))
+    conn = sqlite3.connect(args.db)
+    if args.bbox:
+        found = bbox_query(conn, *args.bbox, element_types=element_types)
+    else:
+        found = radius_query(conn, *args.radius, element_types=element_types)
+    conn.close()
+    for r in found:
+        print('{0} {1} {2}'.format(r['type'], r['id'], r['tags']))
+    print('{0} elements'.format(len(found)))
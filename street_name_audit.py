@@ -1,29 +1,26 @@
 '''
 The following functions are performed to audit the street names 
-vs 'street+type_re and the 'expected_street_types'.
+vs the addr:street rule of tag_rules.json.
 Print the street names that do not match
 '''
 
 import unicodecsv
 import pprint
 import re
-import xml.etree.cElementTree as ET
 import cerberus
 import schema
 from collections import defaultdict
 
-OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
+import audit_engine
+import tag_rules
 
+OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
 
-street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
-"""Regular expression to recognise street type."""
 
-# valid street names
-# Added 'Cienega' and 'Thornburn' because they are valid street names.
-expected_street_types = ["Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square", "Lane", "Road",
-            "Trail", "Parkway", "Commons", "Northeast", "South", "Southeast", "Southwest","Northwest",
-            "East", "West", "North", "Highway", "Way", "Terrace", "Freeway", "Highway", "Point", 
-           "Alley", "Circle", "Cienega", "Thornburn"]
+# The street type regex and valid street types are those of the addr:street
+# rule in tag_rules.json, which the import cleans street names with.
+# 'Cienega' and 'Thornburn' are there because they are valid street names.
+STREET_RULE = tag_rules.RULES['addr:street']
 
 def audit_street_type(street_types, street_name):
     """Build defaultdict of unexpected street types.
@@ -32,11 +29,9 @@ def audit_street_type(street_types, street_name):
         street_name (str): street name data.
     """
 
-    m = street_type_re.search(street_name)
-    if m:
-        street_type = m.group()
-        if street_type not in expected_street_types:
-            street_types[street_type].add(street_name)
+    street_type = STREET_RULE.check(street_name)
+    if street_type is not None:
+        street_types[street_type].add(street_name)
 
 
 def is_street_name(elem):
@@ -48,6 +43,24 @@ def is_street_name(elem):
     """
     return (elem.attrib['k'] == "addr:street")
 
+@audit_engine.register
+class StreetTypeAudit(object):
+    """Audit plugin collecting unexpected street types."""
+    name = 'street_types'
+
+    def __init__(self):
+        self.street_types = defaultdict(set)
+
+    def process(self, elem):
+        if elem.tag == "node" or elem.tag == "way":
+            for tag in elem.iter("tag"):
+                if is_street_name(tag):
+                    audit_street_type(self.street_types, tag.attrib['v'])
+
+    def result(self):
+        return self.street_types
+
+
 def audit(osmfile):
     """Audit street type.
     Args:
@@ -55,16 +68,9 @@ def audit(osmfile):
     Returns:
         street_types (dict): defaultdict(set) of unexpected street types.
     """
-    osm_file = open(osmfile, "rb")
-    street_types = defaultdict(set)
-    for event, elem in ET.iterparse(osm_file, events=("start",)):
-        if elem.tag == "node" or elem.tag == "way":
-            for tag in elem.iter("tag"):
-                if is_street_name(tag):
-                    audit_street_type(street_types, tag.attrib['v'])
-    osm_file.close()
-    return street_types
+    return audit_engine.run_audits(osmfile, [StreetTypeAudit()])[StreetTypeAudit.name]
 
 
-st_types = audit(OSM_FILE)
-pprint.pprint(dict(st_types))
+if __name__ == '__main__':
+    st_types = audit(OSM_FILE)
+    pprint.pprint(dict(st_types))
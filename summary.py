@@ -0,0 +1,266 @@
+# Summary tables answering the notebook's aggregate questions without scanning the tag rows
+# File = summary.py
+
+import argparse
+import collections
+import sqlite3
+import time
+
+"""
+The notebook's counts (nodes, ways, unique users, top contributors, top
+amenities, postcode and city distributions) are aggregates over every row of
+the element and tag tables.  The loaders keep three summary tables (created
+with the rest of the schema in create_db.py) up to date instead:
+
+- element_totals: rows per element type,
+- user_summary: rows per element type, uid and user,
+- tag_summary: tag rows per element type, type, key and value.
+
+Each append adds its counts: create_db.csv_to_db() with every chunk, in the
+same transaction as the chunk and its checkpoint, osm_to_db.py with every
+commit and osc_update.py with every commit, subtracting the old rows of
+modified and deleted elements.  A Delta collects the counts and apply() adds
+them with two executemany() calls per table, so a chunk costs one statement
+per distinct key rather than per row.  Keys are matched with IS, so NULL users
+or values are counted like GROUP BY counts them.
+
+refresh() rebuilds the tables from the base tables, for databases built before
+they existed or changed behind the loaders' back; cleaning.clean_db() does so
+for tag_summary.  The functions at the end answer the notebook questions from
+the summaries, and check() compares them with the notebook queries.
+
+top_amenities counts each node once per value, where tag_summary counts tag
+rows: a node tagged amenity under two tag types ('amenity' and
+'disused:amenity' both have the key amenity) has two rows.  It is answered by
+tag_elements() from the (key, value, id) index of nodes_tags instead, which
+reads only the amenity entries of the index.
+"""
+
+# Summary table -> key columns; each also has a count column
+SUMMARY_KEYS = collections.OrderedDict([
+    ('element_totals', ('element_type',)),
+    ('user_summary', ('element_type', 'uid', 'user')),
+    ('tag_summary', ('element_type', 'type', 'key', 'value'))])
+
+# Base table -> (summary table, element_type, base columns of the rest of the key)
+SOURCES = {'nodes': [('element_totals', 'node', ()), ('user_summary', 'node', ('uid', 'user'))],
+           'ways': [('element_totals', 'way', ()), ('user_summary', 'way', ('uid', 'user'))],
+           'relations': [('element_totals', 'relation', ()), ('user_summary', 'relation', ('uid', 'user'))],
+           'nodes_tags': [('tag_summary', 'node', ('type', 'key', 'value'))],
+           'ways_tags': [('tag_summary', 'way', ('type', 'key', 'value'))],
+           'relations_tags': [('tag_summary', 'relation', ('type', 'key', 'value'))]}
+
+# The notebook counts users and tags of nodes and ways only
+NOTEBOOK_TYPES = ('node', 'way')
+
+
+def plain(value):
+    """numpy scalars as Python values and NaN as None, for sqlite3 parameters."""
+    if value != value:
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+class Delta(object):
+    """Counts to add to (or, negative, subtract from) the summary tables."""
+
+    def __init__(self):
+        self.counts = dict((table, collections.Counter()) for table in SUMMARY_KEYS)
+
+    def __bool__(self):
+        return any(self.counts.values())
+    __nonzero__ = __bool__
+
+    def add_rows(self, table, fields, rows, sign=1):
+        """Count rows of a base table.
+        Args:
+            table (str): base table, e.g. 'nodes' or 'ways_tags'; others are ignored.
+            fields (list): column names of the row tuples.
+            rows (list): row tuples.
+            sign (int): 1 for added rows, -1 for removed ones.
+        """
+        for summary_table, element_type, columns in SOURCES.get(table, ()):
+            counter = self.counts[summary_table]
+            if not columns:
+                counter[(element_type,)] += sign * len(rows)
+                continue
+            positions = [fields.index(column) for column in columns]
+            for row in rows:
+                counter[(element_type,) + tuple(row[i] for i in positions)] += sign
+
+    def add_frame(self, table, frame, sign=1):
+        """Count the rows of a pandas DataFrame of a base table, grouping them first."""
+        for summary_table, element_type, columns in SOURCES.get(table, ()):
+            counter = self.counts[summary_table]
+            if not columns:
+                counter[(element_type,)] += sign * len(frame)
+                continue
+            sizes = frame.groupby(list(columns), dropna=False, sort=False).size()
+            for keys, size in sizes.items():
+                if not isinstance(keys, tuple):
+                    keys = (keys,)
+                counter[(element_type,) + tuple(plain(key) for key in keys)] += sign * int(size)
+
+    def apply(self, conn):
+        """Add the counts to the summary tables within the caller's transaction, then clear them.
+        Args:
+            conn (obj): sqlite3 connection.
+        """
+        for table, keys in SUMMARY_KEYS.items():
+            counter = self.counts[table]
+            changes = [(count,) + key for key, count in counter.items() if count]
+            if not changes:
+                continue
+            match = ' AND '.join('"{0}" IS ?'.format(column) for column in keys)
+            columns = ', '.join('"{0}"'.format(column) for column in keys)
+            conn.executemany('UPDATE {0} SET count = count + ? WHERE {1}'.format(table, match), changes)
+            # Only the keys the UPDATE found no row for are inserted
+            conn.executemany('INSERT INTO {0} ({1}, count) SELECT {2}, ? WHERE NOT EXISTS '
+                             '(SELECT 1 FROM {0} WHERE {3})'.format(table, columns, ', '.join('?' * len(keys)),
+                                                                   match),
+                             [change[1:] + change[:1] + change[1:] for change in changes])
+            removed = [change[1:] for change in changes if change[0] < 0]
+            if removed:
+                conn.executemany('DELETE FROM {0} WHERE {1} AND count <= 0'.format(table, match), removed)
+            counter.clear()
+
+
+def has_summaries(conn):
+    """True if the database has the summary tables."""
+    tables = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+    return all(table in tables for table in SUMMARY_KEYS)
+
+
+def refresh(conn, tables=None):
+    """Rebuild summary tables from the base tables and commit.
+    Args:
+        conn (obj): sqlite3 connection.
+        tables (list): summary tables to rebuild; all of them if None.
+    """
+    tables = tables or list(SUMMARY_KEYS)
+    for table in tables:
+        conn.execute('DELETE FROM {0}'.format(table))
+    for base, sources in sorted(SOURCES.items()):
+        for summary_table, element_type, columns in sources:
+            if summary_table not in tables:
+                continue
+            quoted = ', '.join('"{0}"'.format(column) for column in columns)
+            if columns:
+                conn.execute('INSERT INTO {0} (element_type, {1}, count) SELECT ?, {1}, COUNT(*) '
+                             'FROM {2} GROUP BY {1}'.format(summary_table, quoted, base), (element_type,))
+            else:
+                # No row for an empty table, as apply() leaves none
+                conn.execute('INSERT INTO {0} (element_type, count) SELECT ?, total FROM '
+                             '(SELECT COUNT(*) AS total FROM {1}) WHERE total > 0'.format(summary_table, base),
+                             (element_type,))
+    conn.commit()
+
+
+# ================================================== #
+#               Answers                              #
+# ================================================== #
+def in_types(element_types):
+    return 'element_type IN ({0})'.format(', '.join('?' * len(element_types)))
+
+
+def element_count(conn, element_type):
+    """Number of nodes, ways or relations."""
+    row = conn.execute('SELECT count FROM element_totals WHERE element_type = ?', (element_type,)).fetchone()
+    return row[0] if row else 0
+
+
+def unique_users(conn, element_types=NOTEBOOK_TYPES):
+    """Number of distinct uids that made elements of these types."""
+    return conn.execute('SELECT COUNT(DISTINCT uid) FROM user_summary WHERE ' + in_types(element_types),
+                        element_types).fetchone()[0]
+
+
+def top_users(conn, limit=10, element_types=NOTEBOOK_TYPES):
+    """[(user, elements)] of the users with the most elements of these types."""
+    return conn.execute('SELECT user, SUM(count) AS total FROM user_summary WHERE {0} '
+                        'GROUP BY user ORDER BY total DESC LIMIT ?'.format(in_types(element_types)),
+                        tuple(element_types) + (limit,)).fetchall()
+
+
+def tag_values(conn, key, limit=None, element_types=NOTEBOOK_TYPES):
+    """[(value, tags)] of a tag key (without its type, e.g. 'postcode'), most frequent first."""
+    return conn.execute('SELECT value, SUM(count) AS total FROM tag_summary WHERE key = ? AND {0} '
+                        'GROUP BY value ORDER BY total DESC LIMIT ?'.format(in_types(element_types)),
+                        (key,) + tuple(element_types) + (-1 if limit is None else limit,)).fetchall()
+
+
+def tag_elements(conn, key, limit=None, table='nodes_tags'):
+    """[(value, elements)] of a tag key, counting each element once per value.
+    Args:
+        conn (obj): sqlite3 connection.
+        key (str): tag key without its type, e.g. 'amenity'.
+        limit (int): most frequent values to return; all of them if None.
+        table (str): per-type tag table, indexed on (key, value, id).
+    """
+    return conn.execute('SELECT value, COUNT(DISTINCT id) AS total FROM {0} WHERE key = ? '
+                        'GROUP BY value ORDER BY total DESC LIMIT ?'.format(table),
+                        (key, -1 if limit is None else limit)).fetchall()
+
+
+# Notebook query name (see queries.py) -> answer from the summaries
+ANSWERS = collections.OrderedDict([
+    ('nodes', lambda conn: [(element_count(conn, 'node'),)]),
+    ('ways', lambda conn: [(element_count(conn, 'way'),)]),
+    ('unique_users', lambda conn: [(unique_users(conn),)]),
+    ('postcodes', lambda conn: tag_values(conn, 'postcode')),
+    ('top_users', lambda conn: top_users(conn)),
+    ('top_amenities', lambda conn: tag_elements(conn, 'amenity', 10)),
+    ('cities', lambda conn: tag_values(conn, 'city'))])
+
+
+def check(conn):
+    """Compare each answer with its notebook query.
+    Returns:
+        list of the names of the answers that differ.  Rows tied on their count
+        may come in any order, so the counts are compared in order and the rows
+        as sets (all of them for queries without LIMIT).
+    """
+    from queries import NOTEBOOK_QUERIES
+    queries = dict(NOTEBOOK_QUERIES)
+    differ = []
+    for name, answer in ANSWERS.items():
+        expected = [tuple(row) for row in conn.execute(queries[name]).fetchall()]
+        got = [tuple(row) for row in answer(conn)]
+        same = [row[-1] for row in expected] == [row[-1] for row in got]
+        if 'LIMIT' not in queries[name].upper():
+            same = same and sorted(expected, key=repr) == sorted(got, key=repr)
+        if not same:
+            differ.append(name)
+    return differ
+
+
+if __name__ == '__main__':
+    # Imported here: create_db imports this module
+    import create_db
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description='Answer the notebook questions from the summary tables.')
+    parser.add_argument('--db', default=create_db.DB_FILE, help='SQLite database file')
+    parser.add_argument('--refresh', action='store_true', help='rebuild the summary tables from the base tables')
+    parser.add_argument('--check', action='store_true', help='compare the answers with the notebook queries')
+    args = parser.parse_args()
+
+    if args.refresh:
+        # Creates the summary tables of a database built before they existed
+        create_db.metadata.create_all(create_engine('sqlite:///' + args.db))
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.refresh:
+            began = time.time()
+            refresh(conn)
+            print('Summaries rebuilt in {0:.1f}s'.format(time.time() - began))
+        for name, answer in ANSWERS.items():
+            began = time.time()
+            rows = answer(conn)
+            print('{0} ({1:.1f} ms): {2}'.format(name, (time.time() - began) * 1000, rows[:10]))
+        if args.check:
+            differ = check(conn)
+            print('All answers match the notebook queries' if not differ else
+                  'Differ from the notebook queries: ' + ', '.join(differ))
+    finally:
+        conn.close()
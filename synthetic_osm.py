@@ -0,0 +1,235 @@
+import argparse
+import datetime as dt
+import math
+import random
+from xml.sax.saxutils import quoteattr
+
+"""
+Deterministic synthetic OSM (XML) files for benchmarking the import pipeline at
+any size.  The same parameters and seed always give the same file.
+
+Nodes form random walks inside a bounding box (around Inglewood by default), so
+consecutive node ids are close together as in a real extract.  Ways take runs
+of consecutive nodes; a share of their node references instead reuse a node
+already used by an earlier way, which sets how many ways a node belongs to (the
+intersections).  Relations group random ways and nodes.  Tags are drawn from a
+vocabulary modelled on the Inglewood extract, including the street name and
+postcode variants the cleaning stage fixes and a few keys with problem
+characters.
+"""
+
+BBOX = (33.90, -118.40, 34.00, -118.30)  # min lat, min lon, max lat, max lon
+
+DEFAULTS = {'nodes': 100000,
+            'node_tag_fraction': 0.1,   # share of nodes with tags
+            'tags_per_node': 2.0,       # mean tags of a tagged node
+            'way_ratio': 0.1,           # ways per node
+            'nodes_per_way': 10.0,      # mean node references of a way
+            'shared_fraction': 0.15,    # share of way node references reusing a node of an earlier way
+            'tags_per_way': 3.0,        # mean tags of a way
+            'relation_ratio': 0.01,     # relations per way
+            'members_per_relation': 8.0,
+            'users': 200}
+
+STREETS = ['Market', 'Manchester', 'Florence', 'Crenshaw', 'Century', 'La Brea', 'Prairie',
+           'Hawthorne', 'Arbor Vitae', 'Centinela', 'Hillcrest', 'Kelso', 'Stocker', 'Fairview']
+STREET_TYPES = ['Street', 'St', 'Avenue', 'Ave', 'Boulevard', 'Blvd', 'Blv.', 'Drive', 'Place', 'Way']
+POSTCODES = ['90301', '90302', '90303', '90304', '90305', '90043', '90008', '90301-1234', '90302-4425']
+NAMES = ['Inglewood Park', 'Grace Church', 'Market Cafe', 'City Hall', 'Forum', 'Crenshaw Plaza',
+         'Hollywood Park', 'Edward Vincent Jr. Park', 'Saint John Chrysostom']
+
+NODE_VOCABULARY = [('highway', ['traffic_signals', 'crossing', 'stop', 'bus_stop', 'turning_circle']),
+                   ('amenity', ['restaurant', 'cafe', 'school', 'place_of_worship', 'fast_food', 'bank']),
+                   ('shop', ['convenience', 'supermarket', 'clothes', 'car_repair']),
+                   ('name', NAMES),
+                   ('addr:street', None),
+                   ('addr:housenumber', None),
+                   ('addr:postcode', POSTCODES),
+                   ('addr:city', ['Inglewood', 'Los Angeles']),
+                   ('created_by', ['JOSM', 'Potlatch 0.10f', 'iD']),
+                   ('source', ['survey', 'Bing', 'USGS Geonames']),
+                   ('gnis:feature_id', None),
+                   ('fixme?', ['check name'])]
+WAY_VOCABULARY = [('highway', ['residential', 'service', 'footway', 'primary', 'secondary', 'tertiary']),
+                  ('building', ['yes', 'house', 'commercial', 'garage']),
+                  ('name', None),
+                  ('oneway', ['yes', 'no']),
+                  ('lanes', ['1', '2', '3', '4']),
+                  ('addr:street', None),
+                  ('addr:housenumber', None),
+                  ('addr:postcode', POSTCODES),
+                  ('tiger:cfcc', ['A41', 'A40']),
+                  ('tiger:county', ['Los Angeles, CA']),
+                  ('tiger:name_base', STREETS),
+                  ('lacounty:bld_id', None),
+                  ('height', ['4.5', '7.2', '10.1'])]
+ROLES = ['outer', 'inner', 'from', 'to', 'via', '']
+
+
+def poisson(rng, mean):
+    """Poisson distributed integer (Knuth's method, fine for small means)."""
+    limit, k, p = math.exp(-mean), 0, rng.random()
+    while p > limit:
+        k += 1
+        p *= rng.random()
+    return k
+
+
+def street_name(rng):
+    return '{0} {1}'.format(rng.choice(STREETS), rng.choice(STREET_TYPES))
+
+
+def draw_tags(rng, vocabulary, mean):
+    count = min(max(poisson(rng, mean), 1), len(vocabulary))
+    tags = []
+    for key, values in rng.sample(vocabulary, count):
+        if key.endswith('street') or (key == 'name' and values is None):
+            value = street_name(rng)
+        elif values is None:
+            value = str(rng.randint(1, 99999))
+        else:
+            value = rng.choice(values)
+        tags.append((key, value))
+    return tags
+
+
+class Generator(object):
+    """Write one synthetic OSM file.
+    Args:
+        seed (int): seed of every random choice.
+        bbox (tuple): (min lat, min lon, max lat, max lon) of the nodes.
+        params: overrides of DEFAULTS.
+    """
+
+    def __init__(self, seed=0, bbox=BBOX, **params):
+        unknown = set(params) - set(DEFAULTS)
+        if unknown:
+            raise ValueError('Unknown parameters: {0}'.format(', '.join(sorted(unknown))))
+        self.params = dict(DEFAULTS, **params)
+        self.rng = random.Random(seed)
+        self.bbox = bbox
+        self.epoch = dt.datetime(2008, 1, 1)
+
+    def attributes(self, element_id):
+        rng = self.rng
+        uid = rng.randint(1, self.params['users'])
+        timestamp = self.epoch + dt.timedelta(seconds=rng.randint(0, 10 * 365 * 86400))
+        return 'changeset="{0}" id="{1}"'.format(rng.randint(1, 60000000), element_id), \
+            'timestamp="{0}Z" uid="{1}" user="user_{1}" version="{2}"'.format(
+                timestamp.isoformat(), uid, rng.randint(1, 12))
+
+    def write_tags(self, out, tags):
+        for key, value in tags:
+            out.write('    <tag k={0} v={1} />\n'.format(quoteattr(key), quoteattr(value)))
+
+    def write(self, out):
+        """Write the file to out, a text file object.  Returns element counts."""
+        p, rng = self.params, self.rng
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<osm version="0.6" generator="synthetic_osm.py">\n')
+        out.write('  <bounds minlat="{0}" minlon="{1}" maxlat="{2}" maxlon="{3}" />\n'.format(*self.bbox))
+
+        nodes = p['nodes']
+        lat, lon = min_lat, min_lon
+        for node_id in range(1, nodes + 1):
+            # A new walk every ~50 nodes, small steps in between
+            if node_id % 50 == 1:
+                lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+            else:
+                lat = min(max(lat + rng.uniform(-0.0003, 0.0003), min_lat), max_lat)
+                lon = min(max(lon + rng.uniform(-0.0003, 0.0003), min_lon), max_lon)
+            head, tail = self.attributes(node_id)
+            tags = draw_tags(rng, NODE_VOCABULARY, p['tags_per_node']) if rng.random() < p['node_tag_fraction'] else []
+            out.write('  <node {0} lat="{1:.7f}" lon="{2:.7f}" {3}'.format(head, lat, lon, tail))
+            if tags:
+                out.write('>\n')
+                self.write_tags(out, tags)
+                out.write('  </node>\n')
+            else:
+                out.write(' />\n')
+
+        ways = int(nodes * p['way_ratio'])
+        cursor = 1
+        for way_id in range(1, ways + 1):
+            length = 2 + int(rng.expovariate(1.0 / max(p['nodes_per_way'] - 2, 0.1)))
+            head, tail = self.attributes(way_id)
+            out.write('  <way {0} {1}>\n'.format(head, tail))
+            last = None
+            for _ in range(length):
+                if cursor > nodes or (cursor > 2 and rng.random() < p['shared_fraction']):
+                    ref = rng.randint(1, min(cursor - 1, nodes))
+                    if ref == last:
+                        continue
+                else:
+                    ref = cursor
+                    cursor += 1
+                out.write('    <nd ref="{0}" />\n'.format(ref))
+                last = ref
+            self.write_tags(out, draw_tags(rng, WAY_VOCABULARY, p['tags_per_way']))
+            out.write('  </way>\n')
+
+        relations = int(ways * p['relation_ratio'])
+        for relation_id in range(1, relations + 1):
+            head, tail = self.attributes(relation_id)
+            out.write('  <relation {0} {1}>\n'.format(head, tail))
+            for _ in range(max(poisson(rng, p['members_per_relation']), 1)):
+                if ways and rng.random() < 0.8:
+                    member_type, ref = 'way', rng.randint(1, ways)
+                else:
+                    member_type, ref = 'node', rng.randint(1, nodes)
+                out.write('    <member type="{0}" ref="{1}" role="{2}" />\n'.format(member_type, ref, rng.choice(ROLES)))
+            self.write_tags(out, [('type', rng.choice(['multipolygon', 'restriction', 'route']))] +
+                            draw_tags(rng, WAY_VOCABULARY[:3], 1.0))
+            out.write('  </relation>\n')
+        out.write('</osm>\n')
+        return {'node': nodes, 'way': ways, 'relation': relations}
+
+
+class CountingWriter(object):
+    """Text sink counting the bytes written to it."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text.encode('utf-8'))
+
+
+def nodes_for_size(target_mb, seed=0, sample_nodes=20000, **params):
+    """Node count giving a file of about target_mb MB with the other parameters."""
+    params.pop('nodes', None)
+    sink = CountingWriter()
+    Generator(seed, nodes=sample_nodes, **params).write(sink)
+    return max(int(target_mb * 1024 * 1024 / (sink.size / float(sample_nodes))), 1)
+
+
+def generate(out_file, seed=0, target_mb=None, **params):
+    """Write a synthetic OSM file.
+    Args:
+        out_file (str): output file.
+        seed (int): random seed.
+        target_mb (float): approximate file size; sets the node count.
+        params: overrides of DEFAULTS.
+    Returns:
+        counts (dict): element tag -> elements written.
+    """
+    if target_mb is not None:
+        params['nodes'] = nodes_for_size(target_mb, seed, **params)
+    with open(out_file, 'w') as out:
+        return Generator(seed, **params).write(out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a deterministic synthetic OSM file.')
+    parser.add_argument('out_file', help='OSM (XML) file to write')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--target-mb', type=float, help='approximate file size in MB (sets --nodes)')
+    for name, value in sorted(DEFAULTS.items()):
+        parser.add_argument('--' + name.replace('_', '-'), type=type(value), default=value,
+                            help='default {0}'.format(value))
+    args = vars(parser.parse_args())
+    out_file, seed, target_mb = args.pop('out_file'), args.pop('seed'), args.pop('target_mb')
+    counts = generate(out_file, seed, target_mb, **args)
+    print('{0}: {1}'.format(out_file, ', '.join('{0} {1}s'.format(counts[tag], tag)
+                                                 for tag in ('node', 'way', 'relation'))))
@@ -0,0 +1,152 @@
+import json
+import os
+import re
+
+"""
+Tag normalization rules, declared in tag_rules.json and compiled once into a
+dispatch table keyed by the full tag key ("addr:street").  Keys without a rule
+cost one dict lookup, however many rules there are.
+
+Each rule names a normalizer and its parameters:
+
+- last_word: 'pattern' finds the last word ('ignore_case' optional); a word
+  in 'mapping' is replaced, cutting the value at its first occurrence.  No
+  match gives None.  Street types are cleaned this way.
+- split: the part before the first 'separator'.
+- mapping: the whole value replaced through 'mapping', others unchanged.
+- regex: re.sub() of 'pattern' with 'replacement'.
+- upper, lower, title, strip: the str methods.
+- none: no normalization, the rule is only audited.
+
+and, for the audits, what a good value looks like: 'expected' lists the valid
+values (the last word for last_word) and 'valid' is a regex they must match.
+The import (cleaning.Cleaner) and the audits (street_name_audit.py,
+postalcode_audit.py and tag_rules_audit.py) all use these rules, so they cannot
+drift apart.
+"""
+
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tag_rules.json')
+
+
+def last_word(spec):
+    pattern = re.compile(spec['pattern'], re.IGNORECASE if spec.get('ignore_case') else 0)
+    mapping = spec.get('mapping', {})
+
+    def normalize(value):
+        m = pattern.search(value)
+        if m:
+            if m.group() in mapping:
+                startpos = value.find(m.group())
+                value = value[:startpos] + mapping[m.group()]
+            return value
+        else:
+            return None
+
+    def vectorized(values):
+        word = values.str.extract('(' + pattern.pattern + ')', flags=pattern.flags, expand=False)
+        cleaned = values.where(word.notna(), None)
+        for abbreviation, full in mapping.items():
+            mask = word == abbreviation
+            if mask.any():
+                # Like value.find(), cut at the first occurrence of the word
+                cleaned[mask] = values[mask].str.partition(abbreviation)[0] + full
+        return cleaned
+
+    def part(value):
+        m = pattern.search(value)
+        return m.group() if m else None
+
+    return normalize, vectorized, part
+
+
+def split(spec):
+    separator = spec['separator']
+    return (lambda value: value.split(separator)[0],
+            lambda values: values.str.split(separator, n=1).str[0],
+            None)
+
+
+def mapping(spec):
+    table = spec['mapping']
+    return (lambda value: table.get(value, value),
+            lambda values: values.replace(table),
+            None)
+
+
+def regex(spec):
+    pattern = re.compile(spec['pattern'], re.IGNORECASE if spec.get('ignore_case') else 0)
+    replacement = spec['replacement']
+    return (lambda value: pattern.sub(replacement, value),
+            lambda values: values.str.replace(pattern, replacement, regex=True),
+            None)
+
+
+def string_method(name):
+    def build(spec):
+        return (lambda value: getattr(value, name)(), lambda values: getattr(values.str, name)(), None)
+    return build
+
+
+def none(spec):
+    return None, None, None
+
+
+NORMALIZERS = {'last_word': last_word,
+               'split': split,
+               'mapping': mapping,
+               'regex': regex,
+               'upper': string_method('upper'),
+               'lower': string_method('lower'),
+               'title': string_method('title'),
+               'strip': string_method('strip'),
+               'none': none}
+"""Normalizer name -> builder returning (normalize, vectorized, audited part) for a rule spec."""
+
+
+class Rule(object):
+    """A compiled rule for the values of one tag key.
+    Attributes:
+        key (str): full tag key.
+        normalize (callable): value -> cleaned value, or None for audit only rules.
+        vectorized (callable): pandas Series -> cleaned Series.
+    """
+
+    def __init__(self, key, spec):
+        name = spec.get('normalizer', 'none')
+        if name not in NORMALIZERS:
+            raise ValueError('Unknown normalizer for {0}: {1}'.format(key, name))
+        self.key = key
+        self.normalize, self.vectorized, part = NORMALIZERS[name](spec)
+        self.part = part or (lambda value: value)
+        self.expected = frozenset(spec['expected']) if 'expected' in spec else None
+        self.valid = re.compile(spec['valid']) if 'valid' in spec else None
+
+    def check(self, value):
+        """Audit a raw value.
+        Returns:
+            the offending part of the value (the whole value, or the last word
+            for last_word rules), or None if it is fine.
+        """
+        part = self.part(value)
+        if part is None:
+            return None
+        if self.expected is not None and part not in self.expected:
+            return part
+        if self.valid is not None and not self.valid.match(part):
+            return part
+        return None
+
+
+def compile_rules(config):
+    """Compile a rules dict (as in tag_rules.json) into full tag key -> Rule."""
+    return dict((key, Rule(key, spec)) for key, spec in config.items())
+
+
+def load_rules(rules_file=RULES_FILE):
+    """Read and compile a rules file."""
+    with open(rules_file) as f:
+        return compile_rules(json.load(f))
+
+
+RULES = load_rules()
+"""The rules of tag_rules.json."""
@@ -0,0 +1,46 @@
+# Audit of the node and way tag values against every rule of tag_rules.json
+# File = tag_rules_audit.py
+
+import pprint
+from collections import defaultdict
+
+import audit_engine
+import tag_rules
+
+"""
+Registers the RuleAudit plugin, run by audit_all.py with the other audits.
+Kept apart from tag_rules.py so that loading the rules, as the import does,
+does not add an audit.
+"""
+
+OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
+
+
+@audit_engine.register
+class RuleAudit(object):
+    """Audit plugin checking node and way tag values against every rule.
+    Its result maps each tag key to {offending part: set of values}.
+    """
+    name = 'tag_rules'
+
+    def __init__(self, rules=None):
+        self.rules = tag_rules.RULES if rules is None else rules
+        self.findings = dict((key, defaultdict(set)) for key in self.rules)
+
+    def process(self, elem):
+        if elem.tag == "node" or elem.tag == "way":
+            rules = self.rules
+            for tag in elem.iter("tag"):
+                rule = rules.get(tag.attrib['k'])
+                if rule is not None:
+                    value = tag.attrib['v']
+                    found = rule.check(value)
+                    if found is not None:
+                        self.findings[rule.key][found].add(value)
+
+    def result(self):
+        return self.findings
+
+
+if __name__ == '__main__':
+    pprint.pprint(audit_engine.run_audits(OSM_FILE, [RuleAudit()])[RuleAudit.name])
@@ -1,18 +1,33 @@
-import xml.etree.cElementTree as ET
 import pprint
 
+import audit_engine
+
 # Iterative parsing to process the map file and find out the tags.
 
 OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
 
-def count_tags(filename):
-    tags = {}
-    for event, elem in ET.iterparse(filename):
-        if elem.tag not in tags:
-            tags[elem.tag] = 1
+
+@audit_engine.register
+class TagCounter(object):
+    """Audit plugin counting how often each tag name occurs."""
+    name = 'tags'
+
+    def __init__(self):
+        self.tags = {}
+
+    def process(self, elem):
+        if elem.tag not in self.tags:
+            self.tags[elem.tag] = 1
         else:
-            tags[elem.tag] += 1
-    return tags
+            self.tags[elem.tag] += 1
+
+    def result(self):
+        return self.tags
+
+
+def count_tags(filename):
+    return audit_engine.run_audits(filename, [TagCounter()])[TagCounter.name]
 
-tags = count_tags(OSM_FILE)
-pprint.pprint(tags)
\ No newline at end of file
+if __name__ == '__main__':
+    tags = count_tags(OSM_FILE)
+    pprint.pprint(tags)
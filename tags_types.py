@@ -1,13 +1,15 @@
-import xml.etree.cElementTree as ET
 import pprint
 import re
 
+import audit_engine
+
 """
 Counting each tag category in a dictionary.  Check 'lower', 'lower_colon' and
 'problemchars'
 """
 
 OSM_FILE =  "D:\Desktop\WGU Projects\data_analyst_nanodegree\data_wrangling\inglewood_openstreetmap\inglewood_map"
+lower = re.compile(r'^([a-z]|_)*$')
 lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
 problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
@@ -27,13 +29,24 @@ def key_type(element, keys):
     return keys
 
 
+@audit_engine.register
+class KeyTypeCounter(object):
+    """Audit plugin counting tag keys in each key category."""
+    name = 'key_types'
 
-def process_map(filename):
-    keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
-    for _, element in ET.iterparse(filename):
-        keys = key_type(element, keys)
+    def __init__(self):
+        self.keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
 
-    return keys
+    def process(self, elem):
+        key_type(elem, self.keys)
+
+    def result(self):
+        return self.keys
+
+
+def process_map(filename):
+    return audit_engine.run_audits(filename, [KeyTypeCounter()])[KeyTypeCounter.name]
 
-keys = process_map(OSM_FILE)
-pprint.pprint(keys)
+if __name__ == '__main__':
+    keys = process_map(OSM_FILE)
+    pprint.pprint(keys)
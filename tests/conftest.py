@@ -0,0 +1,61 @@
+# Shared fixtures of the test suite
+# File = tests/conftest.py
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ing_import  # noqa: E402
+
+"""
+The tests run the scripts the way they are run by hand: from a working
+directory that receives the csv files and the database.  Each test gets its own
+directory (tmp_path), and the reference outputs of a plain serial import of the
+sample are made once per session.
+"""
+
+SAMPLE_FILE = os.path.join(ROOT, 'ing_small_sample.osm')
+
+CSV_FILES = [os.path.basename(path) for _, path, _ in ing_import.TABLES]
+
+
+def read_csvs(directory, files=CSV_FILES):
+    """{csv file: bytes} of the csv files written to a directory."""
+    outputs = {}
+    for name in files:
+        with open(os.path.join(directory, name), 'rb') as f:
+            outputs[name] = f.read()
+    return outputs
+
+
+def run_import(directory, osm_file=SAMPLE_FILE, **kwargs):
+    """Run ing_import.process_map() in a directory and return its csv files."""
+    cwd = os.getcwd()
+    os.chdir(str(directory))
+    try:
+        ing_import.process_map(osm_file, **kwargs)
+    finally:
+        os.chdir(cwd)
+    return read_csvs(str(directory))
+
+
+@pytest.fixture(scope='session')
+def sample_file():
+    return SAMPLE_FILE
+
+
+@pytest.fixture(scope='session')
+def serial_csvs(tmp_path_factory):
+    """The csv files of a plain serial import of the sample."""
+    return run_import(tmp_path_factory.mktemp('serial'))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test from its own empty directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,135 @@
+# Every way of running ing_import must write the same csv files
+# File = tests/test_import_modes.py
+
+import bz2
+import gzip
+import shutil
+
+import pytest
+
+import ing_import
+from conftest import CSV_FILES, SAMPLE_FILE, read_csvs, run_import
+
+"""
+Each import mode is run on the sample and its csv files are compared byte for
+byte with those of a plain serial run: worker processes over byte ranges
+(including ranges much smaller than the elements' spread), the tuple shaping
+path, the threaded pipeline, the parser backends, compressed and PBF input,
+checkpointed runs and runs resumed after an interruption.
+"""
+
+SERIAL_OPTIONS = {'validate': False, 'validate_fraction': 1.0, 'fast': False, 'pipelined': False}
+
+
+class Interrupted(Exception):
+    pass
+
+
+def assert_same_csvs(outputs, expected):
+    for name in CSV_FILES:
+        assert outputs[name] == expected[name], name
+
+
+@pytest.mark.parametrize('options', [
+    {'fast': True},
+    {'pipelined': True},
+    {'fast': True, 'pipelined': True},
+    {'validate': True},
+    {'parser': 'expat'},
+    {'checkpoint': True},
+    {'workers': 2},
+    {'workers': 2, 'fast': True, 'pipelined': True},
+    {'workers': 2, 'checkpoint': True},
+], ids=lambda options: ','.join('{0}={1}'.format(k, v) for k, v in sorted(options.items())))
+def test_mode_matches_serial(tmp_path, serial_csvs, options):
+    assert_same_csvs(run_import(tmp_path, **options), serial_csvs)
+
+
+def test_lxml_parser_matches_serial(tmp_path, serial_csvs):
+    pytest.importorskip('lxml')
+    assert_same_csvs(run_import(tmp_path, parser='lxml'), serial_csvs)
+
+
+@pytest.mark.parametrize('chunk_size', [4096, 64 * 1024])
+def test_small_byte_ranges_match_serial(tmp_path, serial_csvs, monkeypatch, chunk_size):
+    # process_map never splits below 1 MB; force many small ranges instead
+    find_chunks = ing_import.find_chunks
+    monkeypatch.setattr(ing_import, 'find_chunks',
+                        lambda file_in, size, offset=0: find_chunks(file_in, chunk_size, offset))
+    assert_same_csvs(run_import(tmp_path, workers=3), serial_csvs)
+
+
+@pytest.mark.parametrize('suffix, opener', [('.gz', gzip.open), ('.bz2', bz2.open)])
+def test_compressed_input_matches_serial(tmp_path, serial_csvs, suffix, opener):
+    compressed = str(tmp_path / ('sample.osm' + suffix))
+    with open(SAMPLE_FILE, 'rb') as f, opener(compressed, 'wb') as out:
+        shutil.copyfileobj(f, out)
+    assert_same_csvs(run_import(tmp_path, osm_file=compressed), serial_csvs)
+
+
+def test_pbf_input_matches_serial(tmp_path, serial_csvs):
+    osmium = pytest.importorskip('osmium')
+    # osmium only reads OSM files that state their version
+    versioned = str(tmp_path / 'versioned.osm')
+    with open(SAMPLE_FILE, 'rb') as f, open(versioned, 'wb') as out:
+        out.write(f.read().replace(b'<osm>', b'<osm version="0.6">', 1))
+    pbf = str(tmp_path / 'sample.osm.pbf')
+    writer = osmium.SimpleWriter(pbf)
+
+    class Copy(osmium.SimpleHandler):
+        def node(self, n):
+            writer.add_node(n)
+
+        def way(self, w):
+            writer.add_way(w)
+
+        def relation(self, r):
+            writer.add_relation(r)
+
+    Copy().apply_file(versioned)
+    writer.close()
+    assert_same_csvs(run_import(tmp_path, osm_file=pbf), serial_csvs)
+
+
+def test_serial_resume_matches_serial(workdir, serial_csvs, monkeypatch):
+    paths = [path for _, path, _ in ing_import.TABLES]
+    get_element = ing_import.get_element
+    calls = []
+
+    def interrupted_get_element(*args, **kwargs):
+        # Fail halfway through the third byte range, after some of its rows are written
+        calls.append(1)
+        for count, element in enumerate(get_element(*args, **kwargs)):
+            if len(calls) == 3 and count == 100:
+                raise Interrupted()
+            yield element
+
+    monkeypatch.setattr(ing_import, 'get_element', interrupted_get_element)
+    with pytest.raises(Interrupted):
+        ing_import.process_checkpointed(SAMPLE_FILE, paths, SERIAL_OPTIONS, False, chunk_size=256 * 1024)
+    monkeypatch.setattr(ing_import, 'get_element', get_element)
+    ing_import.process_checkpointed(SAMPLE_FILE, paths, SERIAL_OPTIONS, True, chunk_size=256 * 1024)
+    assert_same_csvs(read_csvs(str(workdir)), serial_csvs)
+
+
+PROCESS_CHUNK = ing_import.process_chunk
+
+
+def failing_chunk(task):
+    """process_chunk() failing on the second byte range."""
+    if task[3] == 1:
+        raise Interrupted()
+    return PROCESS_CHUNK(task)
+
+
+def test_parallel_resume_matches_serial(workdir, serial_csvs, monkeypatch):
+    find_chunks = ing_import.find_chunks
+    monkeypatch.setattr(ing_import, 'find_chunks',
+                        lambda file_in, size, offset=0: find_chunks(file_in, 256 * 1024, offset))
+    # Worker processes are forked from this one and see the failing function
+    monkeypatch.setattr(ing_import, 'process_chunk', failing_chunk)
+    with pytest.raises(Interrupted):
+        ing_import.process_map(SAMPLE_FILE, workers=2, checkpoint=True)
+    monkeypatch.setattr(ing_import, 'process_chunk', PROCESS_CHUNK)
+    ing_import.process_map(SAMPLE_FILE, workers=2, resume=True)
+    assert_same_csvs(read_csvs(str(workdir)), serial_csvs)
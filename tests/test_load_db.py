@@ -0,0 +1,60 @@
+# osm_to_db.py and ing_import.py + create_db.py must build the same database
+# File = tests/test_load_db.py
+
+import sqlite3
+
+import pytest
+
+import create_db
+import ing_import
+import osm_to_db
+import summary
+from conftest import SAMPLE_FILE
+
+"""
+The sample is loaded straight into SQLite by osm_to_db.load_osm() and through
+the csv files by ing_import.process_map() and create_db.bulk_load().  Every
+table of the two databases, including the unified tags, the summaries, the
+activity tables and the R-trees, must hold the same rows.
+"""
+
+# Bookkeeping of the csv load only
+SKIPPED_TABLES = ('import_checkpoints',)
+
+# Shadow tables of the R-trees, compared through the R-trees themselves
+RTREE_SHADOWS = ('_node', '_parent', '_rowid')
+
+
+def tables(conn):
+    names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                            "AND name NOT LIKE 'sqlite_%'")]
+    return sorted(name for name in names
+                  if name not in SKIPPED_TABLES and not name.endswith(RTREE_SHADOWS))
+
+
+def rows(conn, table):
+    return sorted(conn.execute('SELECT * FROM {0}'.format(table)).fetchall(), key=repr)
+
+
+@pytest.mark.parametrize('geometry', [False, True])
+def test_direct_load_matches_csv_load(workdir, geometry):
+    osm_to_db.load_osm(SAMPLE_FILE, db_file='direct.db', geometry=geometry)
+    ing_import.process_map(SAMPLE_FILE, geometry=geometry)
+    csv_tables = create_db.CSV_TABLES if geometry else [
+        (csvfile, table) for csvfile, table in create_db.CSV_TABLES if table != 'ways_geometry']
+    create_db.metadata.create_all(create_db.create_engine('sqlite:///csv.db'))
+    create_db.bulk_load(csv_tables, db_file='csv.db')
+
+    direct = sqlite3.connect('direct.db')
+    loaded = sqlite3.connect('csv.db')
+    try:
+        assert tables(direct) == tables(loaded)
+        for table in tables(direct):
+            assert rows(direct, table) == rows(loaded, table), table
+        assert rows(direct, 'ways')
+        if geometry:
+            assert rows(direct, 'ways_geometry')
+        assert summary.check(direct) == []
+    finally:
+        direct.close()
+        loaded.close()
@@ -0,0 +1,63 @@
+# The samples written by sample_osm.py must be referentially intact
+# File = tests/test_sample_osm.py
+
+import xml.etree.cElementTree as ET
+
+import pytest
+
+import sample_osm
+import synthetic_osm
+
+"""
+Every sampler is run on a small synthetic file, whose references all resolve
+(the sample is itself cut from a larger extract and is not), and each written
+file is checked for dangling references: every way node and relation member
+must be an element of the same file.  Samples with the same seed must also nest.
+"""
+
+SPECS = ['every:5', 'every:80', 'random:0.05', 'random:0.01', 'reservoir:500',
+         'bbox:33.93,-118.37,33.96,-118.33']
+
+
+def read_sample(path):
+    """({(tag, id)} of the elements, [(tag, id)] of their references) of a sample file."""
+    ids = set()
+    refs = []
+    for element in ET.parse(path).getroot():
+        if element.tag in sample_osm.ELEMENT_TAGS:
+            ids.add((element.tag, int(element.attrib['id'])))
+            refs.extend(sample_osm.references(element))
+    return ids, refs
+
+
+@pytest.fixture(scope='module')
+def samples(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('samples')
+    osm_file = str(directory / 'synthetic.osm')
+    synthetic_osm.generate(osm_file, seed=5, nodes=20000)
+    ids, refs = read_sample(osm_file)
+    assert set(refs) <= ids
+    outputs = [(spec, str(directory / 'sample{0}.osm'.format(i))) for i, spec in enumerate(SPECS)]
+    counts = sample_osm.sample(osm_file, [(sample_osm.parse_sampler(spec, seed=3), path)
+                                             for spec, path in outputs])
+    return dict((spec, (read_sample(path), count)) for (spec, path), count in zip(outputs, counts))
+
+
+@pytest.mark.parametrize('spec', SPECS)
+def test_sample_has_no_dangling_references(samples, spec):
+    (ids, refs), counts = samples[spec]
+    assert ids
+    assert [ref for ref in refs if ref not in ids] == []
+    assert sum(counts.values()) == len(ids)
+
+
+def test_reservoir_sample_size(samples):
+    # 500 chosen elements, plus the nodes of the chosen ways
+    (ids, _), _ = samples['reservoir:500']
+    assert len(ids) >= 500
+    assert len([element for element in ids if element[0] != 'node']) <= 500
+
+
+@pytest.mark.parametrize('larger, smaller', [('every:5', 'every:80'), ('random:0.05', 'random:0.01')])
+def test_samples_nest(samples, larger, smaller):
+    assert samples[smaller][0][0] <= samples[larger][0][0]
@@ -0,0 +1,82 @@
+# schema_validator must accept, reject and coerce like cerberus
+# File = tests/test_schema_validator.py
+
+import copy
+import random
+
+import pytest
+
+import ing_import
+import schema_validator
+from conftest import SAMPLE_FILE
+
+"""
+The shaped elements of the sample are mutated at random (fields removed, added,
+or replaced by values of the wrong type, None or strings that do or do not
+coerce) and validated by both validators, which must agree on the result, the
+errors and the coerced document.
+"""
+
+cerberus = pytest.importorskip('cerberus')
+
+BAD_VALUES = [None, 'x', '12', '1.5', 1.5, 3, True, [], {}, '']
+
+
+def mutate(element, rng):
+    """A copy of a shaped element with up to three random changes."""
+    doc = copy.deepcopy(element)
+    for _ in range(rng.randint(0, 3)):
+        key = rng.choice(list(doc))
+        value = doc[key]
+        roll = rng.random()
+        if isinstance(value, dict) and value:
+            field = rng.choice(list(value))
+            if roll < 0.2:
+                del value[field]
+            elif roll < 0.3:
+                value['extra_' + field] = 1
+            else:
+                value[field] = rng.choice(BAD_VALUES)
+        elif isinstance(value, list) and value:
+            i = rng.randrange(len(value))
+            if roll < 0.2:
+                value[i] = rng.choice([None, 5, 's', {}])
+            elif isinstance(value[i], dict) and value[i]:
+                field = rng.choice(list(value[i]))
+                if roll < 0.4:
+                    del value[i][field]
+                else:
+                    value[i][field] = rng.choice(BAD_VALUES)
+        elif roll < 0.1:
+            doc['extra'] = 1
+        elif roll < 0.2:
+            doc[key] = rng.choice(BAD_VALUES)
+    return doc
+
+
+@pytest.fixture(scope='module')
+def shaped_elements():
+    elements = [ing_import.shape_element(element)
+                for element in ing_import.get_element(SAMPLE_FILE, tags=ing_import.ELEMENT_TAGS)]
+    return elements[::25]
+
+
+def test_matches_cerberus_on_mutated_elements(shaped_elements):
+    rng = random.Random(1)
+    expected = cerberus.Validator()
+    got = schema_validator.Validator()
+    for element in shaped_elements:
+        for _ in range(4):
+            doc = mutate(element, rng)
+            valid = expected.validate(doc, ing_import.SCHEMA)
+            assert got.validate(doc, ing_import.SCHEMA) == valid, doc
+            assert got.errors == expected.errors, doc
+            assert list(got.errors) == list(expected.errors), doc
+            if valid:
+                assert got.document == expected.document, doc
+
+
+def test_validate_element_reports_the_failing_field():
+    with pytest.raises(Exception) as raised:
+        ing_import.validate_element({'node': {'id': 'x'}}, schema_validator.Validator())
+    assert "Element of type 'node'" in str(raised.value)
@@ -0,0 +1,90 @@
+# The summary answers must match the notebook queries they replace
+# File = tests/test_summary.py
+
+import sqlite3
+
+import osc_update
+import osm_to_db
+import summary
+
+"""
+A small file with a node tagged amenity under two tag types (the case where
+tag rows and elements differ) is loaded and then updated with an osmChange
+file; after each step every summary answer must equal its notebook query, and
+the incrementally kept summary tables must equal a full refresh().
+"""
+
+ATTRIBUTES = 'version="{0}" changeset="10" uid="5" user="a" timestamp="2017-01-0{0}T00:00:00Z"'
+
+OSM = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="33.95" lon="-118.35" {v1}>
+    <tag k="amenity" v="cafe"/>
+    <tag k="disused:amenity" v="cafe"/>
+  </node>
+  <node id="2" lat="33.95" lon="-118.36" {v1}>
+    <tag k="amenity" v="cafe"/>
+  </node>
+  <node id="3" lat="33.95" lon="-118.37" {v1}>
+    <tag k="amenity" v="school"/>
+    <tag k="addr:postcode" v="90301"/>
+  </node>
+  <way id="4" {v1}>
+    <nd ref="1"/>
+    <nd ref="2"/>
+    <tag k="addr:city" v="Inglewood"/>
+  </way>
+</osm>
+'''.format(v1=ATTRIBUTES.format(1))
+
+OSC = '''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+  <modify>
+    <node id="3" lat="33.95" lon="-118.37" {v2}>
+      <tag k="amenity" v="school"/>
+      <tag k="disused:amenity" v="school"/>
+    </node>
+  </modify>
+  <delete>
+    <node id="2" lat="33.95" lon="-118.36" {v2}/>
+  </delete>
+  <create>
+    <node id="5" lat="33.96" lon="-118.37" {v2}>
+      <tag k="amenity" v="cafe"/>
+      <tag k="old:amenity" v="cafe"/>
+    </node>
+  </create>
+</osmChange>
+'''.format(v2=ATTRIBUTES.format(2))
+
+
+def summary_rows(conn):
+    return dict((table, sorted(conn.execute('SELECT * FROM {0}'.format(table)).fetchall(), key=repr))
+                for table in summary.SUMMARY_KEYS)
+
+
+def assert_summaries_hold(conn):
+    assert summary.check(conn) == []
+    kept = summary_rows(conn)
+    summary.refresh(conn)
+    assert summary_rows(conn) == kept
+
+
+def test_answers_match_notebook_after_load_and_update(workdir):
+    (workdir / 'small.osm').write_text(OSM)
+    (workdir / 'change.osc').write_text(OSC)
+    osm_to_db.load_osm('small.osm', db_file='small.db')
+    conn = sqlite3.connect('small.db')
+    try:
+        assert_summaries_hold(conn)
+        assert summary.ANSWERS['top_amenities'](conn) == [('cafe', 2), ('school', 1)]
+    finally:
+        conn.close()
+
+    osc_update.apply_osc('change.osc', db_file='small.db')
+    conn = sqlite3.connect('small.db')
+    try:
+        assert_summaries_hold(conn)
+        assert sorted(summary.ANSWERS['top_amenities'](conn)) == [('cafe', 2), ('school', 1)]
+    finally:
+        conn.close()